@@ -1,6 +1,7 @@
 from pydantic import EmailStr
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from datetime import timedelta
+from typing import Literal
 
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
@@ -32,8 +33,40 @@ class Settings(BaseSettings):
 
     # Настройка redis
     REDIS_DSN: str
+    # TTL кэша; актуальность обеспечивают версии ключей, поэтому он может быть большим
+    CACHE_EXPIRE: int = 6 * 60 * 60
+    # сколько секунд после CACHE_EXPIRE листинг отдаётся устаревшим, пока пересчитывается в фоне
+    CACHE_STALE_TTL: int = 10 * 60
+    # L1-кэш в памяти процесса перед redis
+    CACHE_L1_TTL: float = 5.0
+    CACHE_L1_MAX_ENTRIES: int = 10000
+    CACHE_L1_MAX_BYTES: int = 64 * 1024 * 1024
+    # прогрев кэша листингов при старте
+    CACHE_WARMUP_ON_STARTUP: bool = True
+    CACHE_WARMUP_PAGES: int = 3
+    CACHE_WARMUP_LIMIT: int = 10  # limit по умолчанию в POST /products
+    CACHE_WARMUP_CONCURRENCY: int = 8
+
+    # Хранилище корзин: "sql" - сразу в БД, "redis" - в redis с фоновой записью в БД
+    CART_STORE: Literal["sql", "redis"] = "sql"
+    CART_REDIS_TTL: int = 7 * 24 * 60 * 60
+    CART_FLUSH_INTERVAL: float = 2.0
+    CART_FLUSH_LOCK_TIMEOUT: float = 10.0
+    # сверка итогов корзин с позициями
+    CART_TOTALS_CHECK_INTERVAL: int = 10 * 60
+    CART_TOTALS_CHECK_BATCH: int = 500
+    # снимок корзины в кэше; актуальность обеспечивает версия корзины
+    CART_CACHE_EXPIRE: int = 60 * 60
+    # диапазон id корзин, который пересчитывается одним запросом после смены цен
+    CART_REPRICE_CHUNK: int = 1000
 
     # Настройка пагинации
     LIMIT_MAXIMUM: int = 20
+    BATCH_MAXIMUM: int = 100
+    # поиск ранжирует не больше стольких совпадений (самых новых товаров)
+    SEARCH_MAX_MATCHES: int = 1000
+
+    # Границы ценовых диапазонов для фасетов
+    FACET_PRICE_BUCKETS: list[int] = [10000, 20000, 30000, 40000]
 
 settings = Settings()
\ No newline at end of file
@@ -3,8 +3,10 @@ from sqlalchemy.ext.asyncio import AsyncAttrs, create_async_engine, async_sessio
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.config.settings_config import settings
+from app.utils.metrics import TimedAsyncAdaptedQueuePool, instrument_engine
 
-engine = create_async_engine(settings.DATABASE_URL)
+engine = create_async_engine(settings.DATABASE_URL, poolclass=TimedAsyncAdaptedQueuePool)
+instrument_engine(engine.sync_engine)
 
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
@@ -1,5 +1,6 @@
 from typing import List, Optional
-from sqlalchemy import TEXT, String, Integer, ForeignKey, Table, Column, DateTime, Numeric, func
+from sqlalchemy import TEXT, CheckConstraint, String, Integer, ForeignKey, Table, Column, DateTime, Numeric, Computed, Index, UniqueConstraint, func
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from .database import Base
 from datetime import datetime
@@ -10,6 +11,8 @@ product_category = Table(
     Base.metadata,
     Column("product_id", ForeignKey("products.id"), primary_key=True),
     Column("category_id", ForeignKey("categories.id"), primary_key=True),
+    # первичный ключ начинается с product_id, для выборки по категории нужен обратный порядок
+    Index("ix_product_category_category_id_product_id", "category_id", "product_id"),
 )
 
 # Пользователь
@@ -39,6 +42,17 @@ class Category(Base):
         back_populates="categories",
     )
 
+# Замыкание дерева категорий: все пары предок-потомок (включая саму категорию с depth=0).
+# Заполняется триггерами на categories (см. миграцию), вручную не изменяется.
+class CategoryClosure(Base):
+    __tablename__ = "category_closure"
+
+    ancestor_id: Mapped[int] = mapped_column(ForeignKey("categories.id", ondelete="CASCADE"), primary_key=True)
+    descendant_id: Mapped[int] = mapped_column(
+        ForeignKey("categories.id", ondelete="CASCADE"), primary_key=True, index=True
+    )
+    depth: Mapped[int] = mapped_column(Integer)
+
 # Таблица размеров
 class Size(Base):
     __tablename__ = "sizes"
@@ -49,14 +63,33 @@ class Size(Base):
     products: Mapped[List["Product"]] = relationship(back_populates="size")
 
 # Товар
+PRODUCT_SEARCH_CONFIG = "russian"
+PRODUCT_SEARCH_VECTOR = (
+    f"setweight(to_tsvector('{PRODUCT_SEARCH_CONFIG}', coalesce(name, '')), 'A') || "
+    f"setweight(to_tsvector('{PRODUCT_SEARCH_CONFIG}', coalesce(description, '')), 'B')"
+)
+
 class Product(Base):
     __tablename__ = "products"
+    __table_args__ = (
+        Index("ix_products_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_products_price_id", "price", "id"),
+        CheckConstraint("stock >= 0", name="ck_products_stock_non_negative"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(100))
     description: Mapped[str] = mapped_column(TEXT)
     image: Mapped[str] = mapped_column(String(100))
     price: Mapped[Numeric] = mapped_column(Numeric)
+    # остаток на складе; NULL - остаток не ведётся
+    stock: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    # поисковый вектор, вычисляется базой из name и description
+    search_vector: Mapped[str] = mapped_column(
+        TSVECTOR,
+        Computed(PRODUCT_SEARCH_VECTOR, persisted=True),
+        deferred=True,
+    )
 
     size_id: Mapped[int] = mapped_column(ForeignKey("sizes.id"))
     size: Mapped["Size"] = relationship(back_populates="products")
@@ -84,6 +117,10 @@ class Cart(Base):
 # Элемент корзины
 class CartItem(Base):
     __tablename__ = "cart_items"
+    __table_args__ = (
+        # одна позиция на товар; по этому ограничению работает upsert в add_to_cart
+        UniqueConstraint("cart_id", "product_id", name="uq_cart_items_cart_id_product_id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     cart_id: Mapped[int] = mapped_column(ForeignKey("carts.id"))
@@ -99,7 +136,7 @@ class Order(Base):
     __tablename__ = "orders"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
     total_price: Mapped[Numeric] = mapped_column(Numeric)
     total_quantity: Mapped[int] = mapped_column(Integer)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
@@ -112,7 +149,7 @@ class OrderItem(Base):
     __tablename__ = "order_items"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    order_id: Mapped[int] = mapped_column(ForeignKey("orders.id"))
+    order_id: Mapped[int] = mapped_column(ForeignKey("orders.id"), index=True)
     product_id: Mapped[int] = mapped_column(ForeignKey("products.id"))
     quantity: Mapped[int] = mapped_column(Integer, default=1)
     price: Mapped[Numeric] = mapped_column(Numeric)  # цена товара на момент покупки
@@ -3,10 +3,14 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.database import get_session
 from app.repositories.cart_repository import CartRepository
 from app.repositories.product_repository import ProductRepository
-from app.services.cart_service import CartService
+from app.config.settings_config import settings
+from app.services.cart_service import CartService, RedisCartService
+from app.services.cart_store import redis_cart_store
 
 
-async def get_cart_service(session: AsyncSession = Depends(get_session)) -> CartService:
-    cart_repo = CartRepository(session)
+async def get_cart_service(session: AsyncSession = Depends(get_session)) -> CartService | RedisCartService:
     prod_repo = ProductRepository(session)
+    if settings.CART_STORE == "redis":
+        return RedisCartService(redis_cart_store, prod_repo)
+    cart_repo = CartRepository(session)
     return CartService(cart_repo, prod_repo)
\ No newline at end of file
@@ -3,10 +3,13 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.database import get_session
 from app.repositories.cart_repository import CartRepository
 from app.repositories.order_repository import OrderRepository
+from app.config.settings_config import settings
 from app.services.order_service import OrderService
+from app.services.cart_store import redis_cart_store
 
 
 async def get_order_service(session: AsyncSession = Depends(get_session)) -> OrderService:
     orderRepo = OrderRepository(session)
     cartRepo = CartRepository(session)
-    return OrderService(orderRepo, cartRepo)
\ No newline at end of file
+    cartStore = redis_cart_store if settings.CART_STORE == "redis" else None
+    return OrderService(orderRepo, cartRepo, cartStore)
\ No newline at end of file
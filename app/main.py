@@ -4,33 +4,74 @@ from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from contextlib import asynccontextmanager
-import redis.asyncio as redis
+import time
 from fastapi_limiter import FastAPILimiter
 from fastapi_cache.backends.redis import RedisBackend
 from fastapi_cache import FastAPICache
 
-from app.routers import auth, cart, categories, order, products
+from app.routers import auth, cache, cart, categories, metrics, order, products
 from app.config.settings_config import settings 
 from app.config.logging_config import logger
+from app.services.category_tree import category_tree_cache
+from app.services.cart_store import redis_cart_store
+from app.services.cart_totals import cart_totals_checker
+from app.services.cache_warmup import warm_up_cache
+from app.utils.two_tier_cache import LocalCache, TwoTierBackend
+from app.utils.etag_utils import etag_matches, not_modified
+from app.utils.metrics import HTTP_LATENCY, SQL_STATEMENTS, SQL_TIME, InstrumentedRedis, SqlStats, request_sql_stats, route_label
+from app.utils.rate_limit import rate_limit_callback
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    redis_conn = redis.from_url(settings.REDIS_DSN)
+    redis_conn = InstrumentedRedis.from_url(settings.REDIS_DSN)
 
     # rate limiter
-    await FastAPILimiter.init(redis_conn)
+    await FastAPILimiter.init(redis_conn, http_callback=rate_limit_callback)
 
-    # кэш с явной сериализацией в байты
-    FastAPICache.init(
+    # кэш с явной сериализацией в байты: L1 в памяти процесса + redis
+    cache_backend = TwoTierBackend(
         RedisBackend(
             redis_conn,
         ),
-        prefix="shop-cache"
+        LocalCache(
+            max_entries=settings.CACHE_L1_MAX_ENTRIES,
+            max_bytes=settings.CACHE_L1_MAX_BYTES,
+            ttl=settings.CACHE_L1_TTL,
+        ),
     )
+    FastAPICache.init(cache_backend, prefix="shop-cache")
+    await cache_backend.start()
+
+    # дерево категорий в памяти процесса
+    await category_tree_cache.start(redis_conn)
+
+    # корзины в redis с фоновой записью в БД
+    if settings.CART_STORE == "redis":
+        await redis_cart_store.start(redis_conn)
+
+    # периодическая сверка итогов корзин
+    await cart_totals_checker.start(redis_conn)
+
+    # прогрев листингов товаров, чтобы после деплоя первые запросы не шли в БД
+    if settings.CACHE_WARMUP_ON_STARTUP:
+        try:
+            await warm_up_cache(
+                pages=settings.CACHE_WARMUP_PAGES,
+                limit=settings.CACHE_WARMUP_LIMIT,
+                concurrency=settings.CACHE_WARMUP_CONCURRENCY,
+            )
+        except Exception:
+            logger.exception("Cache warm-up failed")
 
     logger.info("FastAPI app started, Redis, RateLimiter and Cache initialized")
     yield
+    await cart_totals_checker.stop()
+    if settings.CART_STORE == "redis":
+        await redis_cart_store.stop()
+    await category_tree_cache.stop()
+    await cache_backend.stop()
+    logger.info("Cache stats", extra={"extra_fields": cache_backend.stats()})
     await FastAPILimiter.close()
     await redis_conn.close()  # обязательно закрываем соединение
     logger.info("FastAPI app shutdown, Redis connection closed")
@@ -56,6 +97,8 @@ app.include_router(products.router)
 app.include_router(categories.router)
 app.include_router(cart.router)
 app.include_router(order.router)
+app.include_router(cache.router)
+app.include_router(metrics.router)
 
 
 @app.middleware("http")
@@ -71,4 +114,41 @@ async def log_requests(request: Request, call_next):
         return JSONResponse(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content={"detail": "Internal server error"},
-        )
\ No newline at end of file
+        )
+
+
+@app.middleware("http")
+async def conditional_get(request: Request, call_next):
+    # ETag берётся из ответа (для кэшированных ответов он хранится рядом с телом),
+    # при совпадении с If-None-Match тело не отправляется
+    response = await call_next(request)
+    etag = response.headers.get("etag")
+    if (
+        request.method == "GET"
+        and response.status_code == status.HTTP_200_OK
+        and etag
+        and etag_matches(request.headers.get("if-none-match"), etag)
+    ):
+        return not_modified(etag)
+    return response
+
+
+@app.middleware("http")
+async def collect_metrics(request: Request, call_next):
+    # самый внешний middleware: время запроса целиком и SQL, выполненный за время запроса
+    stats = SqlStats()
+    token = request_sql_stats.set(stats)
+    start = time.perf_counter()
+    status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = route_label(request.scope)
+        HTTP_LATENCY.labels(method=request.method, route=route, status=str(status_code)).observe(
+            time.perf_counter() - start
+        )
+        SQL_STATEMENTS.labels(route=route).observe(stats.statements)
+        SQL_TIME.labels(route=route).observe(stats.seconds)
+        request_sql_stats.reset(token)
@@ -0,0 +1,102 @@
+"""add category closure
+
+Revision ID: 25521bbd9475
+Revises: 5dc08c26d8c9
+Create Date: 2026-10-18 10:12:41.503118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '25521bbd9475'
+down_revision: Union[str, Sequence[str], None] = '5dc08c26d8c9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('category_closure',
+    sa.Column('ancestor_id', sa.Integer(), nullable=False),
+    sa.Column('descendant_id', sa.Integer(), nullable=False),
+    sa.Column('depth', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['ancestor_id'], ['categories.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['descendant_id'], ['categories.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id')
+    )
+    op.create_index(op.f('ix_category_closure_descendant_id'), 'category_closure', ['descendant_id'], unique=False)
+
+    # новая категория: ссылка на себя + все предки родителя
+    op.execute("""
+    CREATE FUNCTION category_closure_insert() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+        SELECT NEW.id, NEW.id, 0
+        UNION ALL
+        SELECT ancestor_id, NEW.id, depth + 1
+        FROM category_closure
+        WHERE descendant_id = NEW.parent_id;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+    CREATE TRIGGER categories_closure_insert
+    AFTER INSERT ON categories
+    FOR EACH ROW EXECUTE FUNCTION category_closure_insert();
+    """)
+
+    # смена родителя: поддерево отрывается от старых предков и подвешивается к новым
+    op.execute("""
+    CREATE FUNCTION category_closure_move() RETURNS trigger AS $$
+    BEGIN
+        DELETE FROM category_closure c
+        USING category_closure sub, category_closure sup
+        WHERE c.descendant_id = sub.descendant_id
+          AND c.ancestor_id = sup.ancestor_id
+          AND sub.ancestor_id = NEW.id
+          AND sup.descendant_id = NEW.id
+          AND sup.ancestor_id <> NEW.id;
+
+        INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+        SELECT sup.ancestor_id, sub.descendant_id, sup.depth + sub.depth + 1
+        FROM category_closure sup
+        JOIN category_closure sub ON sub.ancestor_id = NEW.id
+        WHERE sup.descendant_id = NEW.parent_id;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+    CREATE TRIGGER categories_closure_move
+    AFTER UPDATE OF parent_id ON categories
+    FOR EACH ROW WHEN (OLD.parent_id IS DISTINCT FROM NEW.parent_id)
+    EXECUTE FUNCTION category_closure_move();
+    """)
+
+    # заполнение для уже существующих категорий
+    op.execute("""
+    INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+    WITH RECURSIVE tree AS (
+        SELECT id AS ancestor_id, id AS descendant_id, 0 AS depth FROM categories
+        UNION ALL
+        SELECT t.ancestor_id, c.id, t.depth + 1
+        FROM tree t
+        JOIN categories c ON c.parent_id = t.descendant_id
+    )
+    SELECT ancestor_id, descendant_id, depth FROM tree;
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER IF EXISTS categories_closure_move ON categories")
+    op.execute("DROP TRIGGER IF EXISTS categories_closure_insert ON categories")
+    op.execute("DROP FUNCTION IF EXISTS category_closure_move()")
+    op.execute("DROP FUNCTION IF EXISTS category_closure_insert()")
+    op.drop_index(op.f('ix_category_closure_descendant_id'), table_name='category_closure')
+    op.drop_table('category_closure')
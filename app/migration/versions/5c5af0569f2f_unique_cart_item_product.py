@@ -0,0 +1,48 @@
+"""unique cart item product
+
+Revision ID: 5c5af0569f2f
+Revises: 15f0053a0e1e
+Create Date: 2026-10-18 14:02:37.218409
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c5af0569f2f'
+down_revision: Union[str, Sequence[str], None] = '15f0053a0e1e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # повторяющиеся позиции одного товара сливаются в позицию с наименьшим id
+    op.execute("""
+    WITH merged AS (
+        SELECT min(id) AS keep_id, cart_id, product_id, sum(quantity) AS quantity, sum(price) AS price
+        FROM cart_items
+        GROUP BY cart_id, product_id
+        HAVING count(*) > 1
+    ), kept AS (
+        UPDATE cart_items ci
+        SET quantity = m.quantity, price = m.price
+        FROM merged m
+        WHERE ci.id = m.keep_id
+    )
+    DELETE FROM cart_items ci
+    USING merged m
+    WHERE ci.cart_id = m.cart_id AND ci.product_id = m.product_id AND ci.id <> m.keep_id
+    """)
+    # уникальный индекс заменяет обычный с теми же колонками
+    op.drop_index('ix_cart_items_cart_id_product_id', table_name='cart_items')
+    op.create_unique_constraint('uq_cart_items_cart_id_product_id', 'cart_items', ['cart_id', 'product_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_cart_items_cart_id_product_id', 'cart_items', type_='unique')
+    op.create_index('ix_cart_items_cart_id_product_id', 'cart_items', ['cart_id', 'product_id'], unique=False)
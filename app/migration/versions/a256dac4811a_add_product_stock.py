@@ -0,0 +1,31 @@
+"""add product stock
+
+Revision ID: a256dac4811a
+Revises: 5c5af0569f2f
+Create Date: 2026-10-18 15:27:54.093126
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a256dac4811a'
+down_revision: Union[str, Sequence[str], None] = '5c5af0569f2f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # NULL - остаток не ведётся, у существующих товаров продажи не ограничиваются
+    op.add_column('products', sa.Column('stock', sa.Integer(), nullable=True))
+    op.create_check_constraint('ck_products_stock_non_negative', 'products', 'stock >= 0')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('ck_products_stock_non_negative', 'products', type_='check')
+    op.drop_column('products', 'stock')
@@ -30,12 +30,35 @@ class Product(BaseModel):
 class ProductIn(Product):
     size_id: int
     category_ids: List[int]
+    stock: Optional[int] = None  # None - остаток не ведётся
 
 class ProductOut(Product):
     id: int
     size: str
     categories: List[str]
 
+class ProductPrice(BaseModel):
+    product_id: int
+    price: float
+
+class ProductStock(BaseModel):
+    product_id: int
+    stock: Optional[int]
+
+class SizeFacet(BaseModel):
+    size: str
+    count: int
+
+class PriceBucketFacet(BaseModel):
+    min_price: Optional[float]
+    max_price: Optional[float]
+    count: int
+
+class ProductFacets(BaseModel):
+    category_id: int
+    sizes: List[SizeFacet]
+    price_buckets: List[PriceBucketFacet]
+
 # Category
 class Category(BaseModel):
     id: int
@@ -46,6 +69,9 @@ class CategoryOut(Category):
     class Config:
         orm_mode = True
 
+class CategoryTreeOut(CategoryOut):
+    children: List["CategoryTreeOut"] = []
+
 # Cart
 class CartItem(BaseModel):
     product_id: int
@@ -63,6 +89,10 @@ class CartOut(BaseModel):
     total_quantity: int
     items: List[CartItemOut]
 
+class CartBulkUpdate(BaseModel):
+    # новое количество для каждого товара, 0 удаляет позицию
+    items: List[CartItem]
+
 # Order
 class OrderItemOut(BaseModel):
     id: int
@@ -74,6 +104,12 @@ class OrderItemOut(BaseModel):
         orm_mode = True
 
 
+class StockConflict(BaseModel):
+    product_id: int
+    requested: int
+    available: int
+
+
 class OrderOut(BaseModel):
     id: int
     total_price: float
@@ -92,6 +128,7 @@ class PaginationMeta(BaseModel):
     limit: int
     offset: int
     has_next: bool
+    next_cursor: Optional[str] = None
 
 class PaginatedProducts(BaseModel):
     items: List[ProductOut]
@@ -99,4 +136,18 @@ class PaginatedProducts(BaseModel):
 
 class PaginatedCategories(BaseModel):
     items: List[CategoryOut]
-    meta: PaginationMeta
\ No newline at end of file
+    meta: PaginationMeta
+
+# Cache
+class CacheNamespaceStats(BaseModel):
+    l1_hits: int
+    l2_hits: int
+    misses: int
+    l1_hit_ratio: float
+    hit_ratio: float
+
+
+class CacheKeyStats(BaseModel):
+    keys: int
+    avg_bytes: int
+    estimated_bytes: int
@@ -1,13 +1,21 @@
-from sqlalchemy import select
+from sqlalchemy import (
+    Integer, Row, and_, column, delete, exists, func, literal, literal_column, or_, select, true, tuple_, union_all,
+    update, values,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
-from app.db.models import Cart, CartItem
+from app.db.models import Cart, CartItem, Product
 
 
 class CartRepository:
     def __init__(self, session: AsyncSession):
         self.session = session
 
+    async def get_cart(self, user_id: int) -> Cart | None:
+        result = await self.session.execute(select(Cart).where(Cart.user_id == user_id))
+        return result.scalars().first()
+
     async def get_cart_with_items(self, user_id: int) -> Cart | None:
         result = await self.session.execute(
             select(Cart)
@@ -52,14 +60,397 @@ class CartRepository:
         await self.session.flush()
         return item
 
+    async def upsert_item(self, user_id: int, product_id: int, quantity: int) -> Row | None:
+        """
+        корзина создаётся, если её нет, позиция товара добавляется
+        или увеличивается на quantity, итоги корзины сдвигаются на разницу;
+        None, если товара не существует
+        """
+        # один запрос на попытку; параллельный запрос мог создать корзину или позицию
+        # после снимка, тогда вставка ничего не вернёт, а повторный запрос их уже увидит
+        for _ in range(3):
+            row = await self._upsert_item_once(user_id, product_id, quantity)
+            if row:
+                return row
+            if not await self.session.scalar(select(exists().where(Product.id == product_id))):
+                return None
+        return None
+
+    async def _upsert_item_once(self, user_id: int, product_id: int, quantity: int) -> Row | None:
+        # прежняя позиция читается и блокируется CTE, к которому присоединяется UPDATE:
+        # CTE вычисляется до изменения строки и после ожидания блокировки видит её последнюю версию
+        old = (
+            select(CartItem.id, CartItem.price)
+            .join(Cart, Cart.id == CartItem.cart_id)
+            .where(Cart.user_id == user_id, CartItem.product_id == product_id)
+            .with_for_update(of=CartItem)
+            .cte("old")
+        )
+        updated = (
+            update(CartItem)
+            .where(CartItem.id == old.c.id, Product.id == CartItem.product_id)
+            .values(
+                quantity=CartItem.quantity + quantity,
+                price=Product.price * (CartItem.quantity + quantity),
+            )
+            .returning(
+                CartItem.id,
+                CartItem.cart_id,
+                CartItem.product_id,
+                CartItem.quantity,
+                CartItem.price,
+                literal(quantity).label("quantity_delta"),
+                (CartItem.price - old.c.price).label("price_delta"),
+            )
+            .cte("updated")
+        )
+
+        product = select(Product.id, Product.price).where(Product.id == product_id).cte("product")
+        existing = select(Cart.id).where(Cart.user_id == user_id).cte("existing")
+
+        # новая корзина сразу получает итоги с единственной позицией:
+        # UPDATE в том же запросе вставленную строку не увидит
+        new_cart = (
+            pg_insert(Cart)
+            .from_select(
+                ["user_id", "total_price", "total_quantity"],
+                select(literal(user_id), product.c.price * quantity, literal(quantity))
+                .where(~exists(select(existing.c.id))),
+            )
+            .on_conflict_do_nothing(index_elements=[Cart.user_id])
+            .returning(Cart.id)
+            .cte("new_cart")
+        )
+        cart = union_all(select(existing.c.id), select(new_cart.c.id)).cte("cart")
+
+        # позиция вставляется, только если прежней нет
+        inserted = (
+            pg_insert(CartItem)
+            .from_select(
+                ["cart_id", "product_id", "quantity", "price"],
+                select(cart.c.id, product.c.id, literal(quantity), product.c.price * quantity)
+                .select_from(cart)
+                .join(product, true())
+                .where(~exists(select(old.c.id))),
+            )
+            .on_conflict_do_nothing(constraint="uq_cart_items_cart_id_product_id")
+            .returning(
+                CartItem.id,
+                CartItem.cart_id,
+                CartItem.product_id,
+                CartItem.quantity,
+                CartItem.price,
+                CartItem.quantity.label("quantity_delta"),
+                CartItem.price.label("price_delta"),
+            )
+            .cte("inserted")
+        )
+        item = union_all(select(updated), select(inserted)).cte("item")
+        return await self._apply_delta(item)
+
+    async def update_item(self, user_id: int, item_id: int, product_id: int, quantity: int, price) -> Row | None:
+        # позиция меняется и итоги корзины сдвигаются на разницу одним запросом; None, если позиции нет
+        old = (
+            select(CartItem.id, CartItem.quantity, CartItem.price)
+            .join(Cart, Cart.id == CartItem.cart_id)
+            .where(Cart.user_id == user_id, CartItem.id == item_id)
+            .with_for_update(of=CartItem)
+            .cte("old")
+        )
+        item = (
+            update(CartItem)
+            .where(CartItem.id == old.c.id)
+            .values(product_id=product_id, quantity=quantity, price=price)
+            .returning(
+                CartItem.cart_id,
+                (CartItem.quantity - old.c.quantity).label("quantity_delta"),
+                (CartItem.price - old.c.price).label("price_delta"),
+            )
+            .cte("item")
+        )
+        return await self._apply_delta(item)
+
+    async def delete_item_by_id(self, user_id: int, item_id: int) -> Row | None:
+        # удаление позиции и вычитание её из итогов одним запросом; None, если позиции нет
+        item = (
+            delete(CartItem)
+            .where(CartItem.id == item_id, CartItem.cart_id == Cart.id, Cart.user_id == user_id)
+            .returning(
+                CartItem.cart_id,
+                (-CartItem.quantity).label("quantity_delta"),
+                (-CartItem.price).label("price_delta"),
+            )
+            .cte("item")
+        )
+        return await self._apply_delta(item)
+
+    async def _apply_delta(self, item) -> Row | None:
+        totals = (
+            update(Cart)
+            .where(Cart.id == item.c.cart_id)
+            .values(
+                total_quantity=Cart.total_quantity + item.c.quantity_delta,
+                total_price=Cart.total_price + item.c.price_delta,
+            )
+            .returning(Cart.id)
+            .cte("totals")
+        )
+        result = await self.session.execute(select(item).add_cte(totals))
+        return result.first()
+
+    async def get_or_create_cart_id(self, user_id: int) -> int:
+        stmt = pg_insert(Cart).values(user_id=user_id, total_price=0, total_quantity=0)
+        # DO UPDATE, чтобы RETURNING вернул id и уже существующей корзины
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Cart.user_id],
+            set_={"user_id": stmt.excluded.user_id},
+        ).returning(Cart.id)
+        return (await self.session.execute(stmt)).scalar_one()
+
+    async def set_quantities(self, cart_id: int, changes: list[tuple[int, int]]):
+        """
+        один изменяющий запрос на весь список (product_id, quantity): quantity задаёт новое количество,
+        0 удаляет позицию; итоги корзины сдвигаются на разницу старых и новых позиций.
+        Товары с quantity > 0 должны существовать
+        """
+        # сначала блокируется сама корзина: FOR UPDATE не пускает параллельную вставку позиции
+        # (проверка внешнего ключа ждёт блокировку), а следующий запрос со своим снимком
+        # видит всё, что было закоммичено до неё
+        await self.session.execute(select(Cart.id).where(Cart.id == cart_id).with_for_update())
+        # прежние позиции читаются и блокируются отдельным запросом до изменения:
+        # CTE с FOR UPDATE, прочитанный после записи, изменённые строки уже не видит
+        old = (
+            await self.session.execute(
+                select(CartItem.quantity, CartItem.price)
+                .where(CartItem.cart_id == cart_id, CartItem.product_id.in_([pid for pid, _ in changes]))
+                .order_by(CartItem.id)
+                .with_for_update()
+            )
+        ).all()
+        old_quantity = sum(row.quantity for row in old)
+        old_price = sum(row.price for row in old)
+
+        changes_values = values(
+            column("product_id", Integer), column("quantity", Integer), name="changes_values"
+        ).data(changes)
+        changes_cte = select(changes_values).cte("changes")
+
+        removed = (
+            delete(CartItem)
+            .where(
+                CartItem.cart_id == cart_id,
+                CartItem.product_id == changes_cte.c.product_id,
+                changes_cte.c.quantity == 0,
+            )
+            .returning(CartItem.id)
+            .cte("removed")
+        )
+        item_insert = pg_insert(CartItem).from_select(
+            ["cart_id", "product_id", "quantity", "price"],
+            select(
+                literal(cart_id),
+                changes_cte.c.product_id,
+                changes_cte.c.quantity,
+                Product.price * changes_cte.c.quantity,
+            )
+            .join(Product, Product.id == changes_cte.c.product_id)
+            .where(changes_cte.c.quantity > 0),
+        )
+        upserted = item_insert.on_conflict_do_update(
+            constraint="uq_cart_items_cart_id_product_id",
+            set_={"quantity": item_insert.excluded.quantity, "price": item_insert.excluded.price},
+        ).returning(CartItem.quantity, CartItem.price).cte("upserted")
+
+        def total(cte, col):
+            return select(func.coalesce(func.sum(cte.c[col]), 0)).scalar_subquery()
+
+        totals = (
+            update(Cart)
+            .where(Cart.id == cart_id)
+            .values(
+                total_quantity=Cart.total_quantity + total(upserted, "quantity") - old_quantity,
+                total_price=Cart.total_price + total(upserted, "price") - old_price,
+            )
+            .returning(Cart.id)
+            .cte("totals")
+        )
+        await self.session.execute(
+            select(func.count()).select_from(totals).add_cte(removed)
+        )
+
+    @staticmethod
+    def _cart_rows_query():
+        # итоги корзины вместе с позициями одним запросом:
+        # строки (id, total_price, total_quantity, item_id, product_id, quantity, price)
+        return (
+            select(
+                Cart.id,
+                Cart.total_price,
+                Cart.total_quantity,
+                CartItem.id.label("item_id"),
+                CartItem.product_id,
+                CartItem.quantity,
+                CartItem.price,
+            )
+            .outerjoin(CartItem, CartItem.cart_id == Cart.id)
+            .order_by(CartItem.id)
+        )
+
+    async def get_cart_rows(self, cart_id: int) -> list[Row]:
+        result = await self.session.execute(self._cart_rows_query().where(Cart.id == cart_id))
+        return result.all()
+
+    async def get_cart_rows_by_user(self, user_id: int) -> list[Row]:
+        result = await self.session.execute(self._cart_rows_query().where(Cart.user_id == user_id))
+        return result.all()
+
+    async def get_max_cart_id(self) -> int:
+        return (await self.session.execute(select(func.max(Cart.id)))).scalar() or 0
+
+    async def reprice_chunk(self, after_id: int, upto_id: int, product_ids: list[int] | None = None) -> list[int]:
+        """
+        один запрос на корзины с id в (after_id, upto_id]: цена позиций пересчитывается
+        по текущей цене товара, итоги корзин сдвигаются на разницу;
+        возвращает id пользователей, чьи корзины изменились
+        """
+        line_price = Product.price * CartItem.quantity
+        stale = (
+            select(CartItem.id, CartItem.price)
+            .join(Product, Product.id == CartItem.product_id)
+            .where(
+                CartItem.cart_id > after_id,
+                CartItem.cart_id <= upto_id,
+                CartItem.price.is_distinct_from(line_price),
+            )
+            # строки блокируются, чтобы разница считалась от актуальной цены позиции
+            .with_for_update(of=CartItem)
+        )
+        if product_ids is not None:
+            stale = stale.where(CartItem.product_id.in_(product_ids))
+        stale = stale.cte("stale")
+
+        repriced = (
+            update(CartItem)
+            # границы чанка повторяются, чтобы позиции и корзины читались по индексу, а не целиком
+            .where(
+                CartItem.id == stale.c.id,
+                CartItem.cart_id > after_id,
+                CartItem.cart_id <= upto_id,
+                Product.id == CartItem.product_id,
+            )
+            .values(price=line_price)
+            .returning(CartItem.cart_id, (CartItem.price - stale.c.price).label("delta"))
+            .cte("repriced")
+        )
+        deltas = (
+            select(repriced.c.cart_id, func.sum(repriced.c.delta).label("delta"))
+            .group_by(repriced.c.cart_id)
+            .cte("deltas")
+        )
+        result = await self.session.execute(
+            update(Cart)
+            .where(Cart.id == deltas.c.cart_id, Cart.id > after_id, Cart.id <= upto_id)
+            .values(total_price=Cart.total_price + deltas.c.delta)
+            .returning(Cart.user_id)
+            .execution_options(synchronize_session=False)
+        )
+        return result.scalars().all()
+
+    async def lock_carts_batch(self, after_id: int, batch_size: int) -> list[int]:
+        # занятые запросами пользователей корзины пропускаются и проверяются в следующий раз
+        result = await self.session.execute(
+            select(Cart.id)
+            .where(Cart.id > after_id)
+            .order_by(Cart.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        return result.scalars().all()
+
+    async def repair_totals(self, cart_ids: list[int]) -> list[int]:
+        # итоги пересчитываются по позициям; возвращаются id пользователей, у которых они расходились
+        sums = (
+            select(
+                Cart.id.label("cart_id"),
+                func.coalesce(func.sum(CartItem.quantity), 0).label("quantity"),
+                func.coalesce(func.sum(CartItem.price), 0).label("price"),
+            )
+            # список повторяется в условии соединения, чтобы позиции читались по индексу
+            .outerjoin(CartItem, and_(CartItem.cart_id == Cart.id, CartItem.cart_id.in_(cart_ids)))
+            .where(Cart.id.in_(cart_ids))
+            .group_by(Cart.id)
+            .subquery("sums")
+        )
+        result = await self.session.execute(
+            update(Cart)
+            .where(
+                Cart.id == sums.c.cart_id,
+                Cart.id.in_(cart_ids),
+                or_(
+                    Cart.total_quantity.is_distinct_from(sums.c.quantity),
+                    Cart.total_price.is_distinct_from(sums.c.price),
+                ),
+            )
+            .values(total_quantity=sums.c.quantity, total_price=sums.c.price)
+            .returning(Cart.user_id)
+        )
+        return result.scalars().all()
+
     async def delete_item(self, item: CartItem):
         await self.session.delete(item)
 
-    async def clear_cart(self, cart: Cart, items: list[CartItem]):
-        for ci in items:
-            await self.session.delete(ci)
-        cart.total_price = 0.0
-        cart.total_quantity = 0
+    async def lock_cart(self, user_id: int) -> int | None:
+        # блокировка корзины до конца транзакции: изменения корзины ждут оформления заказа
+        result = await self.session.execute(
+            select(Cart.id).where(Cart.user_id == user_id).with_for_update()
+        )
+        return result.scalar_one_or_none()
+
+    async def clear_cart(self, cart_id: int):
+        # все позиции удаляются и итоги обнуляются одним запросом
+        removed = delete(CartItem).where(CartItem.cart_id == cart_id).returning(CartItem.id).cte("removed")
+        await self.session.execute(
+            update(Cart)
+            .where(Cart.id == cart_id)
+            .values(total_price=0, total_quantity=0)
+            .add_cte(removed)
+        )
+
+    async def reserve_item_ids(self, count: int) -> list[int]:
+        # id будущих позиций из последовательности cart_items (для корзин в redis)
+        result = await self.session.execute(
+            select(literal_column("nextval('cart_items_id_seq')")).select_from(func.generate_series(1, count))
+        )
+        return result.scalars().all()
+
+    async def sync_items(self, cart_id: int, lines: list[dict]):
+        """
+        содержимое корзины приводится к строкам lines (id, product_id, quantity, price):
+        удаляются только позиции, которых нет в lines, остальные вставляются
+        или обновляются, если изменились; id позиций сохраняются
+        """
+        keep = [(line["id"], line["product_id"]) for line in lines]
+        removed = delete(CartItem).where(CartItem.cart_id == cart_id)
+        if keep:
+            removed = removed.where(tuple_(CartItem.id, CartItem.product_id).not_in(keep))
+        await self.session.execute(removed)
+        if not lines:
+            return
+
+        item_insert = pg_insert(CartItem).values([{"cart_id": cart_id, **line} for line in lines])
+        await self.session.execute(
+            item_insert.on_conflict_do_update(
+                constraint="uq_cart_items_cart_id_product_id",
+                set_={"quantity": item_insert.excluded.quantity, "price": item_insert.excluded.price},
+                where=or_(
+                    CartItem.quantity != item_insert.excluded.quantity,
+                    CartItem.price != item_insert.excluded.price,
+                ),
+            )
+        )
 
     async def commit(self):
-        await self.session.commit()
\ No newline at end of file
+        await self.session.commit()
+
+    async def rollback(self):
+        await self.session.rollback()
\ No newline at end of file
@@ -1,6 +1,6 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from app.db.models import Category
+from app.db.models import Category, CategoryClosure
 
 
 class CategoryRepository:
@@ -19,6 +19,19 @@ class CategoryRepository:
 
         return categories, has_next
     
+    async def get_all_ordered(self) -> list[Category]:
+        res = await self.session.execute(select(Category).order_by(Category.id.asc()))
+        return res.scalars().all()
+
     async def get_categories_by_ids(self, category_ids: list[int]) -> list[Category]:
         result = await self.session.execute(select(Category).where(Category.id.in_(category_ids)))
-        return result.scalars().all()
\ No newline at end of file
+        return result.scalars().all()
+
+    async def get_ancestor_ids(self, category_ids: list[int]) -> list[int]:
+        # сами категории и все их предки
+        result = await self.session.execute(
+            select(CategoryClosure.ancestor_id)
+            .where(CategoryClosure.descendant_id.in_(category_ids))
+            .distinct()
+        )
+        return result.scalars().all()
@@ -1,21 +1,88 @@
+from sqlalchemy import Row, func, insert, literal, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.db.models import Order, OrderItem
+from app.db.models import CartItem, Order, OrderItem, Product
 
 
 class OrderRepository:
     def __init__(self, session: AsyncSession):
         self.session = session
 
-    async def create_order(self, user_id: int, total_price: float, total_quantity: int) -> Order:
-        order = Order(user_id=user_id, total_price=total_price, total_quantity=total_quantity)
-        self.session.add(order)
-        await self.session.flush()
-        return order
+    async def create_order_from_cart(self, user_id: int, cart_id: int) -> Row | None:
+        # итоги заказа считаются по позициям корзины; None, если корзина пуста
+        result = await self.session.execute(
+            insert(Order)
+            .from_select(
+                ["user_id", "total_price", "total_quantity"],
+                select(literal(user_id), func.sum(CartItem.price), func.sum(CartItem.quantity))
+                .where(CartItem.cart_id == cart_id)
+                .having(func.count() > 0),
+            )
+            .returning(Order.id, Order.total_price, Order.total_quantity, Order.created_at)
+        )
+        return result.first()
 
-    async def add_order_item(self, order_id: int, product_id: int, quantity: int, price: float) -> OrderItem:
-        oi = OrderItem(order_id=order_id, product_id=product_id, quantity=quantity, price=price)
-        self.session.add(oi)
-        return oi
+    async def copy_cart_items(self, order_id: int, cart_id: int) -> list[Row]:
+        # все позиции корзины переносятся в заказ одним INSERT ... SELECT
+        result = await self.session.execute(
+            insert(OrderItem)
+            .from_select(
+                ["order_id", "product_id", "quantity", "price"],
+                select(literal(order_id), CartItem.product_id, CartItem.quantity, CartItem.price)
+                .where(CartItem.cart_id == cart_id)
+                .order_by(CartItem.id),
+            )
+            .returning(OrderItem.id, OrderItem.product_id, OrderItem.quantity, OrderItem.price)
+        )
+        return sorted(result.all(), key=lambda row: row.id)
+
+    async def reserve_stock(self, order_id: int) -> list[Row]:
+        """
+        списывает остатки сразу по всем позициям заказа одним условным UPDATE ... WHERE stock >= quantity;
+        возвращает позиции, которым не хватило остатка: (product_id, requested, available)
+        """
+        lines = (
+            select(OrderItem.product_id, OrderItem.quantity)
+            .where(OrderItem.order_id == order_id, OrderItem.quantity > 0)
+            .cte("lines")
+        )
+        # строки товаров блокирует подзапрос в порядке id, а не UPDATE в порядке соединения:
+        # иначе встречные заказы с общими товарами взаимно блокировались (deadlock);
+        # NO KEY UPDATE не мешает внешним ключам позиций заказов и корзин
+        locked = (
+            select(Product.id, lines.c.quantity)
+            .join(lines, lines.c.product_id == Product.id)
+            .where(Product.stock.is_not(None))
+            .order_by(Product.id)
+            .with_for_update(of=Product, key_share=True)
+            .subquery("locked")
+        )
+        result = await self.session.execute(
+            update(Product)
+            .where(Product.id == locked.c.id, Product.stock >= locked.c.quantity)
+            .values(stock=Product.stock - locked.c.quantity)
+            .returning(Product.id)
+        )
+        reserved = result.scalars().all()
+        # остаток для ответа читается после списания: строки заблокированы, значение актуально
+        result = await self.session.execute(
+            select(
+                OrderItem.product_id,
+                OrderItem.quantity.label("requested"),
+                Product.stock.label("available"),
+            )
+            .join(Product, Product.id == OrderItem.product_id)
+            .where(
+                OrderItem.order_id == order_id,
+                OrderItem.quantity > 0,
+                Product.stock.is_not(None),
+                OrderItem.product_id.not_in(reserved),
+            )
+            .order_by(OrderItem.product_id)
+        )
+        return result.all()
 
     async def commit(self):
-        await self.session.commit()
\ No newline at end of file
+        await self.session.commit()
+
+    async def rollback(self):
+        await self.session.rollback()
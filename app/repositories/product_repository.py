@@ -1,7 +1,8 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import Integer, Numeric, Row, Select, cast, column, func, select, tuple_, update, values
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by, array
 from sqlalchemy.orm import joinedload
-from app.db.models import Category, Product, Size, product_category
+from app.db.models import PRODUCT_SEARCH_CONFIG, Category, CategoryClosure, Product, Size, product_category
 from sqlalchemy.orm import selectinload
 
 
@@ -17,12 +18,14 @@ class ProductRepository:
         price: float,
         size: Size,
         categories: list[Category],
+        stock: int | None = None,
     ) -> Product:
         product = Product(
             name=name,
             description=description,
             image=image,
             price=price,
+            stock=stock,
             size=size,
             categories=categories
         )
@@ -37,21 +40,33 @@ class ProductRepository:
         )
         return result.scalar_one()
 
+    @staticmethod
+    def _in_category(category_id: int, include_descendants: bool):
+        # условие "товар лежит в категории" (или в любой из её подкатегорий)
+        # в виде полусоединения, чтобы товар из нескольких подкатегорий не дублировался
+        if include_descendants:
+            category_ids = select(CategoryClosure.descendant_id).where(CategoryClosure.ancestor_id == category_id)
+            category_cond = product_category.c.category_id.in_(category_ids)
+        else:
+            category_cond = product_category.c.category_id == category_id
+
+        return Product.id.in_(select(product_category.c.product_id).where(category_cond))
+
     async def get_filtered(
         self,
         category_id: int,
+        include_descendants: bool,
         min_price: float | None,
         max_price: float | None,
         sort: str | None,
         limit: int,
         offset: int,
-    ) -> tuple[list[Product], bool]:
-        q = (
-            select(Product.id)
-            .join(product_category, Product.id == product_category.c.product_id)
-            .join(Category, Category.id == product_category.c.category_id)
-            .where(Category.id == category_id)
-        )
+        after: tuple | None = None,
+    ) -> tuple[list[Row], bool]:
+        # after - ключ последней строки предыдущей страницы:
+        # (price, id) для сортировок по цене или (id,) для сортировки по умолчанию.
+        # Если он передан, страница ищется по индексу, а offset игнорируется.
+        q = select(Product.id).where(self._in_category(category_id, include_descendants))
 
         if min_price is not None:
             q = q.where(Product.price >= min_price)
@@ -59,35 +74,143 @@ class ProductRepository:
             q = q.where(Product.price <= max_price)
 
         if sort == "price_asc":
-            q = q.order_by(Product.price.asc(), Product.id.asc())
+            if after is not None:
+                q = q.where(tuple_(Product.price, Product.id) > tuple_(*after))
+            order_by = (Product.price.asc(), Product.id.asc())
         elif sort == "price_desc":
-            q = q.order_by(Product.price.desc(), Product.id.desc())
+            if after is not None:
+                q = q.where(tuple_(Product.price, Product.id) < tuple_(*after))
+            order_by = (Product.price.desc(), Product.id.desc())
         else:
-            q = q.order_by(Product.id.asc())
+            if after is not None:
+                q = q.where(Product.id > after[0])
+            order_by = (Product.id.asc(),)
+
+        q = q.order_by(*order_by).limit(limit + 1)
+        # OFFSET 0 не добавляется: первая страница планируется так же, как страница по курсору
+        if after is None and offset:
+            q = q.offset(offset)
 
-        q = q.limit(limit + 1).offset(offset)
+        page = q.cte("page")
+        res = await self.session.execute(
+            self._listing_query().join(page, page.c.id == Product.id).order_by(*order_by)
+        )
+        rows = res.all()
+
+        has_next = len(rows) > limit
+        return rows[:limit], has_next
+
+    async def search(
+        self,
+        query: str,
+        min_price: float | None,
+        max_price: float | None,
+        limit: int,
+        after: tuple[float, int] | None = None,
+        max_matches: int | None = None,
+    ) -> tuple[list[Row], bool]:
+        # полнотекстовый поиск по GIN-индексу search_vector,
+        # порядок - по релевантности, затем по id; after - (rank, id) последней строки.
+        # Ранг индексом не поддерживается, поэтому ранжируются не более max_matches
+        # совпадений с наибольшими id: стоимость любой страницы ограничена этим числом
+        ts_query = func.websearch_to_tsquery(PRODUCT_SEARCH_CONFIG, query)
+
+        matches = select(Product.id, Product.search_vector).where(Product.search_vector.op("@@")(ts_query))
+        if min_price is not None:
+            matches = matches.where(Product.price >= min_price)
+        if max_price is not None:
+            matches = matches.where(Product.price <= max_price)
+        if max_matches is not None:
+            matches = matches.order_by(Product.id.desc()).limit(max_matches)
+        matches = matches.cte("matches")
+
+        rank = func.ts_rank_cd(matches.c.search_vector, ts_query)
+        q = select(matches.c.id, rank.label("rank"))
+        if after is not None:
+            q = q.where(tuple_(rank, matches.c.id) < tuple_(*after))
+
+        page = q.order_by(rank.desc(), matches.c.id.desc()).limit(limit + 1).cte("page")
+        res = await self.session.execute(
+            self._listing_query(page.c.rank)
+            .join(page, page.c.id == Product.id)
+            .order_by(page.c.rank.desc(), Product.id.desc())
+        )
+        rows = res.all()
+
+        has_next = len(rows) > limit
+        return rows[:limit], has_next
+
+    async def get_facets(
+        self,
+        category_id: int,
+        include_descendants: bool,
+        price_thresholds: list[int],
+    ) -> tuple[list[tuple[str, int]], dict[int, int]]:
+        # счётчики по размерам и по ценовым диапазонам за один проход:
+        # width_bucket даёт номер диапазона (0..len(price_thresholds)),
+        # а GROUPING SETS группирует одну выборку сразу двумя способами
+        bucket = func.width_bucket(Product.price, cast(array(price_thresholds), ARRAY(Numeric)))
+
+        products = (
+            select(Size.name.label("size"), bucket.label("bucket"))
+            .select_from(Product)
+            .join(Size, Size.id == Product.size_id)
+            .where(self._in_category(category_id, include_descendants))
+            .subquery()
+        )
+
+        q = (
+            select(
+                products.c.size,
+                products.c.bucket,
+                func.grouping(products.c.size).label("by_bucket"),
+                func.count().label("count"),
+            )
+            .group_by(func.grouping_sets(tuple_(products.c.size), tuple_(products.c.bucket)))
+            .order_by(products.c.size, products.c.bucket)
+        )
 
         res = await self.session.execute(q)
-        ids = res.scalars().all()
 
-        has_next = len(ids) > limit
-        ids = ids[:limit]
+        sizes = []
+        buckets = {}
+        for row in res.all():
+            if row.by_bucket:
+                buckets[row.bucket] = row.count
+            else:
+                sizes.append((row.size, row.count))
 
-        if not ids:
-            return [], has_next
+        return sizes, buckets
 
-        q2 = (
-            select(Product)
-            .where(Product.id.in_(ids))
-            .options(joinedload(Product.categories), joinedload(Product.size))
+    @staticmethod
+    def _listing_query(*extra_columns) -> Select:
+        # плоская строка товара для списков: размер и названия категорий
+        # собираются в том же запросе, без отдельной подгрузки связей
+        categories = (
+            select(func.array_agg(aggregate_order_by(Category.name, Category.id)))
+            .join(product_category, product_category.c.category_id == Category.id)
+            .where(product_category.c.product_id == Product.id)
+            .correlate(Product)
+            .scalar_subquery()
         )
-        res2 = await self.session.execute(q2)
-        prods = res2.scalars().unique().all()
 
-        prod_map = {p.id: p for p in prods}
-        ordered = [prod_map[i] for i in ids if i in prod_map]
+        return (
+            select(
+                Product.id,
+                Product.name,
+                Product.description,
+                Product.image,
+                Product.price,
+                Size.name.label("size"),
+                categories.label("categories"),
+                *extra_columns,
+            )
+            .outerjoin(Size, Size.id == Product.size_id)
+        )
 
-        return ordered, has_next
+    async def get_products_by_ids(self, product_ids: list[int]) -> list[Row]:
+        res = await self.session.execute(self._listing_query().where(Product.id.in_(product_ids)))
+        return res.all()
 
     async def get_product_joined(self, product_id: int) -> Product | None:
         res = await self.session.execute(
@@ -97,6 +220,52 @@ class ProductRepository:
         )
         return res.unique().scalar_one_or_none()
     
+    async def get_prices(self, product_ids: list[int] | None) -> dict[int, Numeric]:
+        # текущие цены (product_ids=None - всех товаров); отсутствующих товаров в словаре нет
+        q = select(Product.id, Product.price)
+        if product_ids is not None:
+            q = q.where(Product.id.in_(product_ids))
+        result = await self.session.execute(q)
+        return dict(result.all())
+
+    async def update_prices(self, prices: list[tuple[int, float]]) -> list[Row]:
+        # все цены одним UPDATE ... FROM (VALUES ...); возвращает (id, price) изменённых товаров
+        new_prices = values(
+            column("id", Integer), column("price", Numeric), name="new_prices"
+        ).data(prices)
+        result = await self.session.execute(
+            update(Product)
+            .where(Product.id == new_prices.c.id)
+            .values(price=new_prices.c.price)
+            .returning(Product.id, Product.price)
+        )
+        rows = result.all()
+        await self.session.commit()
+        return rows
+
+    async def update_stock(self, stocks: list[tuple[int, int | None]]) -> list[Row]:
+        # все остатки одним UPDATE ... FROM (VALUES ...); возвращает (id, stock) изменённых товаров
+        new_stock = values(
+            column("id", Integer), column("stock", Integer), name="new_stock"
+        ).data(stocks)
+        result = await self.session.execute(
+            update(Product)
+            .where(Product.id == new_stock.c.id)
+            .values(stock=new_stock.c.stock)
+            .returning(Product.id, Product.stock)
+        )
+        rows = result.all()
+        await self.session.commit()
+        return rows
+
+    async def get_category_ids(self, product_ids: list[int]) -> list[int]:
+        result = await self.session.execute(
+            select(product_category.c.category_id)
+            .where(product_category.c.product_id.in_(product_ids))
+            .distinct()
+        )
+        return result.scalars().all()
+
     async def get_product(self, product_id: int) -> Product | None:
         result = await self.session.execute(
             select(Product).where(Product.id == product_id)
@@ -0,0 +1,28 @@
+from fastapi import APIRouter, Depends, Query
+from fastapi_cache import FastAPICache
+from app.dependencies.auth_dependencies import get_current_admin
+from app.pydantic_models import CacheKeyStats, CacheNamespaceStats
+from app.utils.cache_utils import cache_key_report
+from app.utils.rate_limit import rate_limit
+
+router = APIRouter(prefix="/cache", tags=["cache"])
+
+
+@router.get(
+    "/stats",
+    response_model=dict[str, CacheNamespaceStats],
+    dependencies=[Depends(rate_limit("MEDIUM")), Depends(get_current_admin)],
+)
+async def get_cache_stats():
+    # статистика L1/L2 текущего процесса по namespace
+    return FastAPICache.get_backend().stats()
+
+
+@router.get(
+    "/keys",
+    response_model=dict[str, CacheKeyStats],
+    dependencies=[Depends(rate_limit("RARE")), Depends(get_current_admin)],
+)
+async def get_cache_keys(sample_size: int = Query(50, ge=1, le=1000)):
+    # число ключей в redis и оценка памяти по namespace
+    return await cache_key_report(sample_size)
@@ -1,8 +1,10 @@
-from fastapi import APIRouter, Depends, Query
+from typing import List
+from fastapi import APIRouter, Depends, Query, Request, Response
 from app.dependencies.categoties_dependencies import get_category_service
 from app.services.category_service import CategoryService
-from app.pydantic_models import PaginatedCategories
+from app.pydantic_models import CategoryTreeOut, PaginatedCategories
 from app.config.settings_config import settings
+from app.utils.etag_utils import etag_matches, not_modified
 from app.utils.rate_limit import rate_limit
 
 router = APIRouter(prefix="", tags=["categories"])
@@ -14,8 +16,31 @@ router = APIRouter(prefix="", tags=["categories"])
     dependencies=[Depends(rate_limit("OFTEN"))],
 )
 async def get_categories(
+    request: Request,
+    response: Response,
     limit: int = Query(10, ge=1, le=settings.LIMIT_MAXIMUM),
     offset: int = Query(0, ge=0),
     service: CategoryService = Depends(get_category_service),
 ):
-    return await service.get_categories(limit, offset)
\ No newline at end of file
+    etag = await service.get_categories_etag(limit, offset)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    return await service.get_categories(limit, offset)
+
+
+@router.get(
+    "/categories/tree",
+    response_model=List[CategoryTreeOut],
+    dependencies=[Depends(rate_limit("OFTEN"))],
+)
+async def get_category_tree(
+    request: Request,
+    response: Response,
+    service: CategoryService = Depends(get_category_service),
+):
+    etag = await service.get_category_tree_etag()
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    return await service.get_category_tree()
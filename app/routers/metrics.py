@@ -0,0 +1,10 @@
+from fastapi import APIRouter, Response
+from app.utils.metrics import render_metrics
+
+router = APIRouter(prefix="", tags=["metrics"])
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    content, media_type = render_metrics()
+    return Response(content=content, media_type=media_type)
@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Depends, Query, status
-from typing import Optional
+from fastapi import APIRouter, BackgroundTasks, Depends, Query, status
+from typing import List, Optional
 from app.dependencies.products_dependencies import get_product_service
 from app.services.product_service import ProductService
-from app.pydantic_models import PaginatedProducts, ProductIn, ProductOut
+from app.pydantic_models import PaginatedProducts, ProductFacets, ProductIn, ProductOut, ProductPrice, ProductStock
 from app.dependencies.auth_dependencies import get_current_admin
 from app.config.settings_config import settings
+from app.utils.cache_utils import cached_response
 from app.utils.rate_limit import rate_limit
 
 router = APIRouter(prefix="", tags=["products"])
@@ -22,6 +23,31 @@ async def create_product(
     return await service.create_product(payload)
 
 
+@router.patch(
+    "/products/prices",
+    response_model=List[ProductPrice],
+    dependencies=[Depends(rate_limit("MEDIUM")), Depends(get_current_admin)]
+)
+async def update_product_prices(
+    payload: List[ProductPrice],
+    background_tasks: BackgroundTasks,
+    service: ProductService = Depends(get_product_service),
+):
+    return await service.update_prices(payload, background_tasks)
+
+
+@router.patch(
+    "/products/stock",
+    response_model=List[ProductStock],
+    dependencies=[Depends(rate_limit("MEDIUM")), Depends(get_current_admin)]
+)
+async def update_product_stock(
+    payload: List[ProductStock],
+    service: ProductService = Depends(get_product_service),
+):
+    return await service.update_stock(payload)
+
+
 @router.post(
     "/products",
     response_model=PaginatedProducts,
@@ -29,16 +55,59 @@ async def create_product(
 )
 async def get_products(
     category_id: int,
+    include_descendants: bool = Query(False),
     min_price: Optional[float] = Query(None),
     max_price: Optional[float] = Query(None),
     sort: Optional[str] = Query(None),
     limit: int = Query(10, ge=1, le=settings.LIMIT_MAXIMUM),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None),
+    service: ProductService = Depends(get_product_service),
+):
+    return await cached_response(service.get_products, category_id, include_descendants, min_price, max_price, sort, limit, offset, cursor)
+
+
+@router.get(
+    "/products/facets",
+    response_model=ProductFacets,
+    dependencies=[Depends(rate_limit("OFTEN"))]
+)
+async def get_product_facets(
+    category_id: int,
+    include_descendants: bool = Query(False),
+    service: ProductService = Depends(get_product_service),
+):
+    return await cached_response(service.get_product_facets, category_id, include_descendants)
+
+
+@router.get(
+    "/products/search",
+    response_model=PaginatedProducts,
+    dependencies=[Depends(rate_limit("OFTEN"))]
+)
+async def search_products(
+    q: str = Query(..., min_length=1, max_length=200),
+    min_price: Optional[float] = Query(None),
+    max_price: Optional[float] = Query(None),
+    limit: int = Query(10, ge=1, le=settings.LIMIT_MAXIMUM),
+    cursor: Optional[str] = Query(None),
+    service: ProductService = Depends(get_product_service),
+):
+    return await cached_response(service.search_products, q, min_price, max_price, limit, cursor)
+
+
+@router.get(
+    "/products/batch",
+    response_model=List[ProductOut],
+    dependencies=[Depends(rate_limit("OFTEN"))]
+)
+async def get_products_batch(
+    ids: List[int] = Query(..., min_length=1, max_length=settings.BATCH_MAXIMUM),
     service: ProductService = Depends(get_product_service),
 ):
-    return await service.get_products(category_id, min_price, max_price, sort, limit, offset)
+    return await service.get_products_batch(ids)
 
 
 @router.get("/product/{product_id}", response_model=ProductOut, dependencies=[Depends(rate_limit("OFTEN"))])
 async def get_product(product_id: int, service: ProductService = Depends(get_product_service)):
-    return await service.get_product(product_id)
+    return await cached_response(service.get_product, product_id)
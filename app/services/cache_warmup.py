@@ -0,0 +1,84 @@
+import asyncio
+import time
+from dataclasses import dataclass
+
+from app.db.database import async_session_maker
+from app.repositories.category_repository import CategoryRepository
+from app.services.category_tree import CategoryTree
+from app.services.product_service import ProductService
+from app.utils.cache_utils import cached_lookup
+from app.config.logging_config import logger
+
+
+WARMUP_SORTS = (None, "price_asc", "price_desc")
+
+
+@dataclass
+class WarmupReport:
+    listings: int
+    keys: int = 0  # ключи, которых не было в кэше и которые записал прогрев
+    seconds: float = 0.0
+
+
+async def _warm_listing(
+    category_id: int,
+    include_descendants: bool,
+    sort: str | None,
+    pages: int,
+    limit: int,
+    report: WarmupReport,
+):
+    # первые страницы листинга в обоих режимах пагинации: по offset и по цепочке курсоров;
+    # аргументы передаются так же, как из роутера, чтобы ключи кэша совпали
+    async with async_session_maker() as session:
+        service = ProductService.from_session(session)
+
+        async def warm_page(offset: int, cursor: str | None):
+            page, lookup = await cached_lookup(
+                service.get_products, category_id, include_descendants, None, None, sort, limit, offset, cursor
+            )
+            if lookup == "miss":
+                report.keys += 1
+            return page
+
+        page = await warm_page(0, None)
+        for page_number in range(1, pages):
+            cursor = page.meta.next_cursor
+            if cursor is None:
+                break
+            await warm_page(page_number * limit, None)
+            page = await warm_page(0, cursor)
+
+
+async def warm_up_cache(pages: int, limit: int, concurrency: int) -> WarmupReport:
+    started = time.perf_counter()
+
+    async with async_session_maker() as session:
+        rows = await CategoryRepository(session).get_all_ordered()
+    tree = CategoryTree.build(rows, 0)
+
+    listings = [
+        (category.id, include_descendants, sort)
+        for category in tree.categories
+        for include_descendants in ((False, True) if category.children else (False,))
+        for sort in WARMUP_SORTS
+    ]
+    report = WarmupReport(listings=len(listings))
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def warm(listing):
+        async with semaphore:
+            try:
+                await _warm_listing(*listing, pages, limit, report)
+            except Exception:
+                logger.exception("Cache warm-up failed for listing", extra={"extra_fields": {"listing": listing}})
+
+    await asyncio.gather(*(warm(listing) for listing in listings))
+
+    report.seconds = time.perf_counter() - started
+    logger.info(
+        "Cache warm-up finished",
+        extra={"extra_fields": {"listings": report.listings, "keys": report.keys, "seconds": round(report.seconds, 3)}}
+    )
+    return report
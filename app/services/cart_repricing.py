@@ -0,0 +1,50 @@
+import time
+
+from app.config.logging_config import logger
+from app.config.settings_config import settings
+from app.db.database import async_session_maker
+from app.repositories.cart_repository import CartRepository
+from app.repositories.product_repository import ProductRepository
+from app.services.cart_store import redis_cart_store
+from app.utils.cache_utils import bump_versions
+
+
+async def reprice_carts(product_ids: list[int] | None = None, chunk_size: int | None = None) -> int:
+    """
+    пересчитывает цены позиций корзин по текущим ценам товаров (всех или только product_ids)
+    диапазонами id корзин по chunk_size, каждый диапазон - один запрос в своей транзакции;
+    возвращает число изменённых корзин.
+    При CART_STORE=redis после БД пересчитываются и корзины в redis: иначе фоновая
+    запись вернула бы в БД старые цены
+    """
+    chunk_size = chunk_size or settings.CART_REPRICE_CHUNK
+    started = time.perf_counter()
+
+    async with async_session_maker() as session:
+        max_cart_id = await CartRepository(session).get_max_cart_id()
+
+    repriced = 0
+    for after_id in range(0, max_cart_id, chunk_size):
+        async with async_session_maker() as session:
+            cart_repo = CartRepository(session)
+            user_ids = await cart_repo.reprice_chunk(after_id, after_id + chunk_size, product_ids)
+            await cart_repo.commit()
+
+        if user_ids:
+            await bump_versions(*(f"cart:{user_id}" for user_id in user_ids))
+        repriced += len(user_ids)
+
+    if settings.CART_STORE == "redis":
+        async with async_session_maker() as session:
+            prices = await ProductRepository(session).get_prices(product_ids)
+        repriced += len(await redis_cart_store.reprice(prices))
+
+    logger.info(
+        "Carts repriced",
+        extra={"extra_fields": {
+            "product_ids": product_ids,
+            "carts": repriced,
+            "seconds": round(time.perf_counter() - started, 3),
+        }}
+    )
+    return repriced
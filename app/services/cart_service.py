@@ -1,49 +1,88 @@
 from fastapi import HTTPException, status
+from sqlalchemy.exc import IntegrityError
 from app.db.models import CartItem
 from app.repositories.cart_repository import CartRepository
 from app.repositories.product_repository import ProductRepository
-from app.pydantic_models import CartItem, CartItemFields, CartItemOut, CartOut
+from app.pydantic_models import CartBulkUpdate, CartItem, CartItemFields, CartItemOut, CartOut
+from app.config.settings_config import settings
+from app.utils.cache_utils import bump_versions, cache, versioned_key_builder
+from app.services.cart_store import ProductAlreadyInCart, RedisCartStore
 from app.config.logging_config import logger
 
 
+def _cart_cache_args(arguments: dict) -> dict:
+    # корзина кэшируется по пользователю, а не по объекту User
+    return {"user_id": arguments["user"].id}
+
+
+def validate_bulk_update(user, payload: CartBulkUpdate) -> list[tuple[int, int]]:
+    # общая проверка для обоих хранилищ корзины: список (product_id, quantity)
+    changes = [(item.product_id, item.quantity) for item in payload.items]
+    product_ids = [product_id for product_id, _ in changes]
+    if not changes or len(changes) > settings.BATCH_MAXIMUM:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Expected from 1 to {settings.BATCH_MAXIMUM} items",
+        )
+    if len(set(product_ids)) != len(product_ids):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Duplicate products in request")
+    if any(quantity < 0 for _, quantity in changes):
+        logger.warning("Bulk cart update failed: negative quantity", extra={"extra_fields": {"user_id": user.id}})
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Quantity is negative")
+    return changes
+
+
+async def get_bulk_prices(user, prodRepo: ProductRepository, changes: list[tuple[int, int]]) -> dict:
+    # общая для обоих хранилищ проверка товаров: нужны только добавляемые и изменяемые,
+    # удаление (quantity 0) отсутствующего товара ничего не делает
+    product_ids = [product_id for product_id, quantity in changes if quantity > 0]
+    prices = await prodRepo.get_prices(product_ids) if product_ids else {}
+    missing = sorted(set(product_ids) - set(prices))
+    if missing:
+        logger.warning("Bulk cart update failed: products not found", extra={"extra_fields": {"user_id": user.id, "product_ids": missing}})
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Products not found: {missing}")
+    return prices
+
+
 class CartService:
     def __init__(self, cartRepo: CartRepository, prodRepo: ProductRepository):
         self.cartRepo = cartRepo
         self.prodRepo = prodRepo
 
-    async def _build_cart_out(self, cart, items) -> CartOut:
+    @staticmethod
+    def _build_cart_out_from_rows(rows) -> CartOut:
+        # строки CartRepository.get_cart_rows: итоги корзины + по строке на позицию
+        cart = rows[0]
         return CartOut(
             id=cart.id,
             total_price=cart.total_price,
             total_quantity=cart.total_quantity,
             items=[
-                CartItemOut(
-                    id=ci.id,
-                    product_id=ci.product_id,
-                    quantity=ci.quantity,
-                    price=ci.price,
-                )
-                for ci in items
+                CartItemOut(id=r.item_id, product_id=r.product_id, quantity=r.quantity, price=r.price)
+                for r in rows
+                if r.item_id is not None
             ],
         )
-    
-    async def update_cart_totals(self, cart: CartOut, items: list[CartItem]):
-        cart.total_quantity = sum(ci.quantity for ci in items)
-        cart.total_price = sum(ci.price for ci in items)
+
+    async def _commit(self, user):
+        # версия меняется после коммита: иначе параллельное чтение могло бы
+        # закэшировать старое содержимое под новой версией
         await self.cartRepo.commit()
-        logger.info(
-            "Cart totals updated",
-            extra={"extra_fields": {"cart_id": cart.id, "total_quantity": cart.total_quantity, "total_price": cart.total_price}}
-        )
+        await bump_versions(f"cart:{user.id}")
 
+    @cache(
+        expire=settings.CART_CACHE_EXPIRE,
+        namespace="get_cart",
+        key_builder=versioned_key_builder("cart", "user_id", normalize=_cart_cache_args, consistent=True),
+        raw_response=True,
+    )
     async def get_cart(self, user) -> CartOut:
-        cart = await self.cartRepo.get_cart_with_items(user.id)
-        if not cart:
+        rows = await self.cartRepo.get_cart_rows_by_user(user.id)
+        if not rows:
             logger.info("Empty cart returned", extra={"extra_fields": {"user_id": user.id}})
             return CartOut(id=0, total_price=0.0, total_quantity=0, items=[])
-        items = await self.cartRepo.get_items(cart.id)
-        logger.info("Cart retrieved", extra={"extra_fields": {"user_id": user.id, "cart_id": cart.id}})
-        return await self._build_cart_out(cart, items)
+        logger.info("Cart retrieved", extra={"extra_fields": {"user_id": user.id, "cart_id": rows[0].id}})
+        return self._build_cart_out_from_rows(rows)
 
     async def add_to_cart(self, user, payload: CartItem) -> CartOut:
         logger.info(
@@ -58,95 +97,170 @@ class CartService:
             )
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Quantity is zero")
 
-        product = await self.prodRepo.get_product(payload.product_id)
-        if not product:
+        # корзина, позиция и итоги меняются одним upsert, ответ строится по второму запросу
+        item = await self.cartRepo.upsert_item(user.id, payload.product_id, payload.quantity)
+        if not item:
+            await self.cartRepo.rollback()
             logger.warning(
                 "Add to cart failed: product not found",
                 extra={"extra_fields": {"user_id": user.id, "product_id": payload.product_id}}
             )
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
 
-        cart = await self.cartRepo.get_cart_with_items(user.id)
-        if not cart:
-            cart = await self.cartRepo.create_cart(user.id)
-            logger.info("New cart created", extra={"extra_fields": {"user_id": user.id, "cart_id": cart.id}})
+        rows = await self.cartRepo.get_cart_rows(item.cart_id)
+        await self._commit(user)
+        logger.info(
+            "Cart item upserted",
+            extra={"extra_fields": {"cart_id": item.cart_id, "product_id": payload.product_id, "new_quantity": item.quantity}}
+        )
+        return self._build_cart_out_from_rows(rows)
 
-        items = await self.cartRepo.get_items(cart.id)
-        existing_item = await self.cartRepo.get_item_by_product(cart.id, payload.product_id)
+    async def update_cart_item(self, item_id: int, user, payload: CartItemFields) -> CartOut:
+        if payload.quantity == 0:
+            return await self._delete_item(user, item_id, "Cart item deleted due to zero quantity")
 
-        if existing_item:
-            existing_item.quantity += payload.quantity
-            existing_item.price = product.price * existing_item.quantity
-            logger.info(
-                "Cart item updated",
-                extra={"extra_fields": {"cart_id": cart.id, "product_id": payload.product_id, "new_quantity": existing_item.quantity}}
-            )
-        else:
-            new_item = await self.cartRepo.add_item(
-                cart.id, payload.product_id, payload.quantity, product.price * payload.quantity
-            )
-            items.append(new_item)
-            logger.info(
-                "New item added to cart",
-                extra={"extra_fields": {"cart_id": cart.id, "product_id": payload.product_id, "quantity": payload.quantity}}
-            )
+        product = await self.prodRepo.get_product(payload.product_id)
+        if not product:
+            logger.warning("Update cart item failed: product not found", extra={"extra_fields": {"user_id": user.id, "product_id": payload.product_id}})
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
 
-        await self.update_cart_totals(cart, items)
-        return await self._build_cart_out(cart, items)
-    
-    async def update_cart_item(self, item_id: int, user, payload: CartItemFields) -> CartOut:
-        cart = await self.cartRepo.get_cart_with_items(user.id)
-        if not cart:
-            logger.warning("Update cart item failed: cart not found", extra={"extra_fields": {"user_id": user.id, "item_id": item_id}})
+        try:
+            item = await self.cartRepo.update_item(user.id, item_id, payload.product_id, payload.quantity, payload.price)
+        except IntegrityError:
+            await self.cartRepo.rollback()
+            logger.warning("Update cart item failed: product already in cart", extra={"extra_fields": {"user_id": user.id, "product_id": payload.product_id}})
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Product already in cart")
+        if not item:
+            await self._raise_not_found(user, item_id, "Update cart item failed")
+
+        rows = await self.cartRepo.get_cart_rows(item.cart_id)
+        await self._commit(user)
+        logger.info(
+            "Cart item updated",
+            extra={"extra_fields": {
+                "cart_id": item.cart_id,
+                "item_id": item_id,
+                "product_id": payload.product_id,
+                "quantity": payload.quantity,
+                "price": payload.price
+            }}
+        )
+        return self._build_cart_out_from_rows(rows)
+
+    async def delete_cart_item(self, user, item_id: int) -> CartOut:
+        return await self._delete_item(user, item_id, "Cart item deleted")
+
+    async def _delete_item(self, user, item_id: int, message: str) -> CartOut:
+        item = await self.cartRepo.delete_item_by_id(user.id, item_id)
+        if not item:
+            await self._raise_not_found(user, item_id, "Delete cart item failed")
+
+        rows = await self.cartRepo.get_cart_rows(item.cart_id)
+        await self._commit(user)
+        logger.info(message, extra={"extra_fields": {"cart_id": item.cart_id, "item_id": item_id}})
+        return self._build_cart_out_from_rows(rows)
+
+    async def bulk_update(self, user, payload: CartBulkUpdate) -> CartOut:
+        changes = validate_bulk_update(user, payload)
+        await get_bulk_prices(user, self.prodRepo, changes)
+
+        cart_id = await self.cartRepo.get_or_create_cart_id(user.id)
+        await self.cartRepo.set_quantities(cart_id, changes)
+        rows = await self.cartRepo.get_cart_rows(cart_id)
+        await self._commit(user)
+        logger.info("Cart bulk updated", extra={"extra_fields": {"user_id": user.id, "cart_id": cart_id, "changes": len(changes)}})
+        return self._build_cart_out_from_rows(rows)
+
+    async def _raise_not_found(self, user, item_id: int, message: str):
+        # позиция не найдена; лишний запрос только на этом пути, чтобы отличить отсутствие корзины
+        await self.cartRepo.rollback()
+        if not await self.cartRepo.get_cart(user.id):
+            logger.warning(f"{message}: cart not found", extra={"extra_fields": {"user_id": user.id, "item_id": item_id}})
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found")
+        logger.warning(f"{message}: item not found", extra={"extra_fields": {"user_id": user.id, "item_id": item_id}})
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart item not found")
 
-        cart_item = await self.cartRepo.get_item_by_id(cart.id, item_id)
-        if not cart_item:
-            logger.warning("Update cart item failed: item not found", extra={"extra_fields": {"cart_id": cart.id, "item_id": item_id}})
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart item not found")
+
+class RedisCartService:
+    """
+    тот же интерфейс, что у CartService, но корзина хранится в redis (RedisCartStore),
+    а в БД записывается в фоне
+    """
+
+    def __init__(self, store: RedisCartStore, prodRepo: ProductRepository):
+        self.store = store
+        self.prodRepo = prodRepo
+
+    async def get_cart(self, user) -> CartOut:
+        cart = await self.store.get(user.id)
+        logger.info("Cart retrieved", extra={"extra_fields": {"user_id": user.id, "cart_id": cart.id}})
+        return cart
+
+    async def add_to_cart(self, user, payload: CartItem) -> CartOut:
+        logger.info(
+            "Add to cart attempt",
+            extra={"extra_fields": {"user_id": user.id, "product_id": payload.product_id, "quantity": payload.quantity}}
+        )
 
         if payload.quantity == 0:
-            await self.cartRepo.delete_item(cart_item)
-            logger.info("Cart item deleted due to zero quantity", extra={"extra_fields": {"cart_id": cart.id, "item_id": item_id}})
-        else:
+            logger.warning(
+                "Add to cart failed: quantity zero",
+                extra={"extra_fields": {"user_id": user.id, "product_id": payload.product_id}}
+            )
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Quantity is zero")
+
+        product = await self.prodRepo.get_product(payload.product_id)
+        if not product:
+            logger.warning(
+                "Add to cart failed: product not found",
+                extra={"extra_fields": {"user_id": user.id, "product_id": payload.product_id}}
+            )
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+
+        cart = await self.store.add_item(user.id, payload.product_id, payload.quantity, product.price)
+        logger.info(
+            "Cart item added",
+            extra={"extra_fields": {"user_id": user.id, "product_id": payload.product_id, "quantity": payload.quantity}}
+        )
+        return cart
+
+    async def update_cart_item(self, item_id: int, user, payload: CartItemFields) -> CartOut:
+        if payload.quantity != 0:
             product = await self.prodRepo.get_product(payload.product_id)
             if not product:
-                logger.warning("Update cart item failed: product not found", extra={"extra_fields": {"cart_id": cart.id, "product_id": payload.product_id}})
+                logger.warning("Update cart item failed: product not found", extra={"extra_fields": {"user_id": user.id, "product_id": payload.product_id}})
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
 
-            cart_item.product_id = payload.product_id
-            cart_item.quantity = payload.quantity
-            cart_item.price = payload.price
-            logger.info(
-                "Cart item updated",
-                extra={"extra_fields": {
-                    "cart_id": cart.id, 
-                    "item_id": item_id, 
-                    "product_id": cart_item.product_id, 
-                    "quantity": cart_item.quantity, 
-                    "price": cart_item.price
-                }}
-            )
+        try:
+            cart = await self.store.update_item(user.id, item_id, payload.product_id, payload.quantity, payload.price)
+        except ProductAlreadyInCart:
+            logger.warning("Update cart item failed: product already in cart", extra={"extra_fields": {"user_id": user.id, "product_id": payload.product_id}})
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Product already in cart")
+        if cart is None:
+            logger.warning("Update cart item failed: item not found", extra={"extra_fields": {"user_id": user.id, "item_id": item_id}})
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart item not found")
 
-        items = await self.cartRepo.get_items(cart.id)
-        await self.update_cart_totals(cart, items)
-        await self.cartRepo.commit()
-        return await self._build_cart_out(cart, items)
+        logger.info(
+            "Cart item updated",
+            extra={"extra_fields": {"user_id": user.id, "item_id": item_id, "product_id": payload.product_id, "quantity": payload.quantity}}
+        )
+        return cart
 
     async def delete_cart_item(self, user, item_id: int) -> CartOut:
-        cart = await self.cartRepo.get_cart_with_items(user.id)
-        if not cart:
-            logger.warning("Delete cart item failed: cart not found", extra={"extra_fields": {"user_id": user.id, "item_id": item_id}})
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found")
-
-        cart_item = await self.cartRepo.get_item_by_id(cart.id, item_id)
-        if not cart_item:
-            logger.warning("Delete cart item failed: item not found", extra={"extra_fields": {"cart_id": cart.id, "item_id": item_id}})
+        cart = await self.store.delete_item(user.id, item_id)
+        if cart is None:
+            logger.warning("Delete cart item failed: item not found", extra={"extra_fields": {"user_id": user.id, "item_id": item_id}})
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart item not found")
 
-        await self.cartRepo.delete_item(cart_item)
-        logger.info("Cart item deleted", extra={"extra_fields": {"cart_id": cart.id, "item_id": item_id}})
+        logger.info("Cart item deleted", extra={"extra_fields": {"user_id": user.id, "item_id": item_id}})
+        return cart
 
-        items = await self.cartRepo.get_items(cart.id)
-        await self.update_cart_totals(cart, items)
-        return await self._build_cart_out(cart, items)
\ No newline at end of file
+    async def bulk_update(self, user, payload: CartBulkUpdate) -> CartOut:
+        changes = validate_bulk_update(user, payload)
+        prices = await get_bulk_prices(user, self.prodRepo, changes)
+
+        cart = await self.store.set_quantities(
+            user.id, [(product_id, quantity, prices.get(product_id, 0)) for product_id, quantity in changes]
+        )
+        logger.info("Cart bulk updated", extra={"extra_fields": {"user_id": user.id, "changes": len(changes)}})
+        return cart
@@ -0,0 +1,481 @@
+import asyncio
+import uuid
+from contextlib import asynccontextmanager
+from decimal import ROUND_HALF_UP, Decimal
+
+from redis.exceptions import LockError
+
+from app.config.logging_config import logger
+from app.config.settings_config import settings
+from app.db.database import async_session_maker
+from app.pydantic_models import CartItemOut, CartOut
+from app.repositories.cart_repository import CartRepository
+
+CART_KEY_PREFIX = "shop-cart"
+CART_DIRTY_KEY = f"{CART_KEY_PREFIX}:dirty"
+# суммы хранятся целыми копейками: lua считает в double, и дробные суммы накапливали ошибку;
+# id позиций совпадают с id строк cart_items.
+# hash прежних форматов остаются под старыми ключами и не читаются
+# (при остановке прежняя версия записывает изменённые корзины в БД)
+CART_HASH_PREFIX = f"{CART_KEY_PREFIX}:v3"
+MINOR_UNITS = 100
+# столько id позиций из последовательности cart_items процесс резервирует за один запрос
+ITEM_ID_BLOCK = 100
+
+# Поля hash корзины:
+#   cart_id, total_quantity, total_price
+#   pid:<item_id>, q:<item_id>, p:<item_id> - товар, количество и цена позиции
+#   item:<product_id> -> item_id
+# id новой позиции передаётся в скрипт заранее взятым из последовательности cart_items.
+# total_price и p:<item_id> - целые копейки, меняются через HINCRBY/HSET целых.
+# Все скрипты возвращают -1, если корзина ещё не загружена из БД.
+
+ADD_ITEM_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return -1 end
+local iid = redis.call('HGET', KEYS[1], 'item:' .. ARGV[2])
+if not iid then
+    iid = ARGV[6]
+    redis.call('HSET', KEYS[1], 'item:' .. ARGV[2], iid, 'pid:' .. iid, ARGV[2])
+end
+local qty = redis.call('HINCRBY', KEYS[1], 'q:' .. iid, ARGV[3])
+local old_price = tonumber(redis.call('HGET', KEYS[1], 'p:' .. iid) or '0')
+local price = tonumber(ARGV[4]) * qty
+redis.call('HSET', KEYS[1], 'p:' .. iid, string.format('%d', price))
+redis.call('HINCRBY', KEYS[1], 'total_quantity', ARGV[3])
+redis.call('HINCRBY', KEYS[1], 'total_price', string.format('%d', price - old_price))
+redis.call('SADD', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return redis.call('HGETALL', KEYS[1])
+"""
+
+# количество 0 удаляет позицию; -2, если выбранный товар уже лежит в корзине другой позицией
+UPDATE_ITEM_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return -1 end
+local iid = ARGV[2]
+local old_pid = redis.call('HGET', KEYS[1], 'pid:' .. iid)
+if not old_pid then return 0 end
+local old_qty = tonumber(redis.call('HGET', KEYS[1], 'q:' .. iid))
+local old_price = tonumber(redis.call('HGET', KEYS[1], 'p:' .. iid))
+local qty = tonumber(ARGV[4])
+local price = tonumber(ARGV[5])
+if qty == 0 then
+    redis.call('HDEL', KEYS[1], 'item:' .. old_pid, 'pid:' .. iid, 'q:' .. iid, 'p:' .. iid)
+    price = 0
+else
+    if old_pid ~= ARGV[3] then
+        if redis.call('HEXISTS', KEYS[1], 'item:' .. ARGV[3]) == 1 then return -2 end
+        redis.call('HDEL', KEYS[1], 'item:' .. old_pid)
+        redis.call('HSET', KEYS[1], 'item:' .. ARGV[3], iid, 'pid:' .. iid, ARGV[3])
+    end
+    redis.call('HSET', KEYS[1], 'q:' .. iid, qty, 'p:' .. iid, ARGV[5])
+end
+redis.call('HINCRBY', KEYS[1], 'total_quantity', qty - old_qty)
+redis.call('HINCRBY', KEYS[1], 'total_price', string.format('%d', price - old_price))
+redis.call('SADD', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+return redis.call('HGETALL', KEYS[1])
+"""
+
+# новые количества по списку (product_id, quantity, цена за штуку, id для новой позиции);
+# 0 удаляет позицию
+SET_QUANTITIES_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return -1 end
+for i = 3, #ARGV, 4 do
+    local pid = ARGV[i]
+    local qty = tonumber(ARGV[i + 1])
+    local iid = redis.call('HGET', KEYS[1], 'item:' .. pid)
+    local old_qty = 0
+    local old_price = 0
+    if iid then
+        old_qty = tonumber(redis.call('HGET', KEYS[1], 'q:' .. iid))
+        old_price = tonumber(redis.call('HGET', KEYS[1], 'p:' .. iid))
+    end
+    local price = tonumber(ARGV[i + 2]) * qty
+    if qty == 0 then
+        if iid then
+            redis.call('HDEL', KEYS[1], 'item:' .. pid, 'pid:' .. iid, 'q:' .. iid, 'p:' .. iid)
+        end
+    else
+        if not iid then
+            iid = ARGV[i + 3]
+            redis.call('HSET', KEYS[1], 'item:' .. pid, iid, 'pid:' .. iid, pid)
+        end
+        redis.call('HSET', KEYS[1], 'q:' .. iid, qty, 'p:' .. iid, string.format('%d', price))
+    end
+    redis.call('HINCRBY', KEYS[1], 'total_quantity', qty - old_qty)
+    redis.call('HINCRBY', KEYS[1], 'total_price', string.format('%d', price - old_price))
+end
+redis.call('SADD', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return redis.call('HGETALL', KEYS[1])
+"""
+
+# корзина записывается, только если её ещё нет (могла загрузиться параллельным запросом)
+LOAD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# снимок корзины для записи в БД; изменения после снимка снова пометят корзину
+SNAPSHOT_SCRIPT = """
+redis.call('SREM', KEYS[2], ARGV[1])
+return redis.call('HGETALL', KEYS[1])
+"""
+
+# цены позиций пачки корзин пересчитываются по ценам товаров из hash KEYS[2]
+# (product_id -> копейки за штуку); KEYS[3..] - корзины, ARGV[i] - пользователь корзины KEYS[i + 2];
+# возвращает пользователей, чьи корзины изменились
+REPRICE_SCRIPT = """
+local repriced = {}
+for k = 3, #KEYS do
+    local fields = redis.call('HGETALL', KEYS[k])
+    local changed = false
+    local delta = 0
+    for i = 1, #fields, 2 do
+        if string.sub(fields[i], 1, 5) == 'item:' then
+            local unit_price = redis.call('HGET', KEYS[2], string.sub(fields[i], 6))
+            if unit_price then
+                local iid = fields[i + 1]
+                local old_price = tonumber(redis.call('HGET', KEYS[k], 'p:' .. iid))
+                local price = tonumber(unit_price) * tonumber(redis.call('HGET', KEYS[k], 'q:' .. iid))
+                if price ~= old_price then
+                    redis.call('HSET', KEYS[k], 'p:' .. iid, string.format('%d', price))
+                    delta = delta + price - old_price
+                    changed = true
+                end
+            end
+        end
+    end
+    if changed then
+        redis.call('HINCRBY', KEYS[k], 'total_price', string.format('%d', delta))
+        redis.call('SADD', KEYS[1], ARGV[k - 2])
+        table.insert(repriced, ARGV[k - 2])
+    end
+end
+return repriced
+"""
+
+# корзина забирается из redis целиком перед оформлением заказа
+EVICT_SCRIPT = """
+redis.call('SREM', KEYS[2], ARGV[1])
+local flat = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return flat
+"""
+
+SET_CART_ID_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then redis.call('HSET', KEYS[1], 'cart_id', ARGV[1]) end
+return 0
+"""
+
+
+class CartNotLoaded(Exception):
+    pass
+
+
+class ProductAlreadyInCart(Exception):
+    pass
+
+
+def _to_minor(value) -> int:
+    # сумма в рублях (Decimal, float из запроса) -> целые копейки
+    return int((Decimal(str(value)) * MINOR_UNITS).to_integral_value(ROUND_HALF_UP))
+
+
+def _from_minor(value) -> Decimal:
+    return Decimal(int(value)) / MINOR_UNITS
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def _cart_fields(flat: list) -> dict[str, str]:
+    return {_decode(k): _decode(v) for k, v in zip(flat[::2], flat[1::2])}
+
+
+def _build_cart_out(fields: dict[str, str]) -> CartOut:
+    item_ids = sorted(int(key[4:]) for key in fields if key.startswith("pid:"))
+    return CartOut(
+        id=int(fields.get("cart_id", 0)),
+        total_price=float(_from_minor(fields.get("total_price", 0))),
+        total_quantity=int(fields.get("total_quantity", 0)),
+        items=[
+            CartItemOut(
+                id=item_id,
+                product_id=int(fields[f"pid:{item_id}"]),
+                quantity=int(fields[f"q:{item_id}"]),
+                price=float(_from_minor(fields[f"p:{item_id}"])),
+            )
+            for item_id in item_ids
+        ],
+    )
+
+
+class RedisCartStore:
+    """
+    корзины в redis: hash на пользователя, количество и суммы меняются атомарно lua-скриптами.
+    - при первом обращении корзина загружается из carts/cart_items
+    - изменённые корзины попадают в множество CART_DIRTY_KEY и записываются в БД
+      фоновой задачей раз в CART_FLUSH_INTERVAL секунд
+    - заказ оформляется под блокировкой корзины (checkout): корзина забирается из redis
+      и записывается в БД синхронно
+    id новых позиций берутся из последовательности cart_items, и запись в БД сохраняет их:
+    id позиции, выданный клиенту, не меняется после загрузки корзины из БД
+    """
+
+    def __init__(self):
+        self.redis = None
+        self._flusher: asyncio.Task | None = None
+        self._item_ids: list[int] = []
+
+    async def start(self, redis_conn):
+        self.redis = redis_conn
+        self._add_item = redis_conn.register_script(ADD_ITEM_SCRIPT)
+        self._update_item = redis_conn.register_script(UPDATE_ITEM_SCRIPT)
+        self._set_quantities = redis_conn.register_script(SET_QUANTITIES_SCRIPT)
+        self._load = redis_conn.register_script(LOAD_SCRIPT)
+        self._snapshot = redis_conn.register_script(SNAPSHOT_SCRIPT)
+        self._evict = redis_conn.register_script(EVICT_SCRIPT)
+        self._reprice = redis_conn.register_script(REPRICE_SCRIPT)
+        self._set_cart_id = redis_conn.register_script(SET_CART_ID_SCRIPT)
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        # последние изменения не должны потеряться при остановке
+        await self.flush_dirty()
+
+    @staticmethod
+    def cart_key(user_id: int) -> str:
+        return f"{CART_HASH_PREFIX}:{user_id}"
+
+    @staticmethod
+    def lock_key(user_id: int) -> str:
+        return f"{CART_KEY_PREFIX}:lock:{user_id}"
+
+    async def get(self, user_id: int) -> CartOut:
+        flat = await self.redis.hgetall(self.cart_key(user_id))
+        if not flat:
+            await self._load_from_db(user_id)
+            flat = await self.redis.hgetall(self.cart_key(user_id))
+        fields = {_decode(k): _decode(v) for k, v in flat.items()}
+        return _build_cart_out(fields)
+
+    async def add_item(self, user_id: int, product_id: int, quantity: int, unit_price) -> CartOut:
+        new_ids = await self._take_item_ids(1)
+        args = [user_id, product_id, quantity, _to_minor(unit_price), settings.CART_REDIS_TTL, *new_ids]
+        fields = _cart_fields(await self._run(self._add_item, user_id, args))
+        self._return_item_ids(new_ids, fields)
+        return _build_cart_out(fields)
+
+    async def update_item(self, user_id: int, item_id: int, product_id: int, quantity: int, price) -> CartOut | None:
+        args = [user_id, item_id, product_id, quantity, _to_minor(price), settings.CART_REDIS_TTL]
+        result = await self._run(self._update_item, user_id, args)
+        if result == 0:
+            return None
+        if result == -2:
+            raise ProductAlreadyInCart(product_id)
+        return _build_cart_out(_cart_fields(result))
+
+    async def delete_item(self, user_id: int, item_id: int) -> CartOut | None:
+        # удаление - это обновление с нулевым количеством
+        return await self.update_item(user_id, item_id, 0, 0, 0)
+
+    async def set_quantities(self, user_id: int, changes: list[tuple]) -> CartOut:
+        # changes: (product_id, quantity, цена за штуку), всё применяется одним скриптом
+        new_ids = await self._take_item_ids(len(changes))
+        args = [user_id, settings.CART_REDIS_TTL]
+        for (product_id, quantity, unit_price), item_id in zip(changes, new_ids):
+            args += [product_id, quantity, _to_minor(unit_price), item_id]
+        fields = _cart_fields(await self._run(self._set_quantities, user_id, args))
+        self._return_item_ids(new_ids, fields)
+        return _build_cart_out(fields)
+
+    async def _take_item_ids(self, count: int) -> list[int]:
+        # id для позиций, которые могут появиться; неиспользованные возвращаются в запас
+        if len(self._item_ids) < count:
+            async with async_session_maker() as session:
+                self._item_ids += await CartRepository(session).reserve_item_ids(max(count, ITEM_ID_BLOCK))
+        taken, self._item_ids = self._item_ids[:count], self._item_ids[count:]
+        return taken
+
+    def _return_item_ids(self, item_ids: list[int], fields: dict[str, str]):
+        self._item_ids += [item_id for item_id in item_ids if f"pid:{item_id}" not in fields]
+
+    async def reprice(self, prices: dict) -> list[int]:
+        """
+        пересчитывает цены позиций во всех загруженных в redis корзинах по prices
+        (product_id -> цена за штуку), изменённые корзины помечаются для записи в БД;
+        возвращает id пользователей, чьи корзины изменились
+        """
+        if not prices:
+            return []
+        prices_key = f"{CART_KEY_PREFIX}:reprice:{uuid.uuid4().hex}"
+        await self.redis.hset(prices_key, mapping={pid: _to_minor(price) for pid, price in prices.items()})
+        await self.redis.expire(prices_key, 60 * 60)
+
+        # ключи корзин берутся пачками SCAN, каждая пачка пересчитывается одним скриптом
+        user_ids = []
+        cursor = 0
+        try:
+            while True:
+                cursor, keys = await self.redis.scan(
+                    cursor, match=f"{CART_HASH_PREFIX}:*", count=settings.CART_REPRICE_CHUNK
+                )
+                if keys:
+                    batch_user_ids = [int(_decode(key).rsplit(":", 1)[1]) for key in keys]
+                    repriced = await self._reprice(keys=[CART_DIRTY_KEY, prices_key, *keys], args=batch_user_ids)
+                    user_ids += [int(user_id) for user_id in repriced]
+                if cursor == 0:
+                    break
+        finally:
+            await self.redis.delete(prices_key)
+        return user_ids
+
+    async def _run(self, script, user_id: int, args: list):
+        keys = [self.cart_key(user_id), CART_DIRTY_KEY]
+        result = await script(keys=keys, args=args)
+        if result == -1:
+            await self._load_from_db(user_id)
+            result = await script(keys=keys, args=args)
+        if result == -1:
+            raise CartNotLoaded(user_id)
+        return result
+
+    def _lock(self, user_id: int, blocking: bool = True):
+        return self.redis.lock(
+            self.lock_key(user_id),
+            timeout=settings.CART_FLUSH_LOCK_TIMEOUT,
+            blocking_timeout=settings.CART_FLUSH_LOCK_TIMEOUT if blocking else 0,
+        )
+
+    async def _load_from_db(self, user_id: int):
+        # загрузка ждёт блокировку: во время оформления заказа в БД ещё лежит корзина,
+        # которую заказ вот-вот очистит
+        async with self._lock(user_id):
+            async with async_session_maker() as session:
+                cart_repo = CartRepository(session)
+                cart = await cart_repo.get_cart(user_id)
+                items = await cart_repo.get_items(cart.id) if cart else []
+
+            fields = {
+                "cart_id": cart.id if cart else 0,
+                "total_quantity": cart.total_quantity if cart else 0,
+                "total_price": _to_minor(cart.total_price) if cart else 0,
+            }
+            for ci in items:
+                fields[f"item:{ci.product_id}"] = ci.id
+                fields[f"pid:{ci.id}"] = ci.product_id
+                fields[f"q:{ci.id}"] = ci.quantity
+                fields[f"p:{ci.id}"] = _to_minor(ci.price)
+            await self._restore(user_id, fields)
+        logger.info("Cart loaded into redis", extra={"extra_fields": {"user_id": user_id, "items": len(items)}})
+
+    async def _restore(self, user_id: int, fields: dict):
+        args = [settings.CART_REDIS_TTL]
+        for field, value in fields.items():
+            args += [field, value]
+        await self._load(keys=[self.cart_key(user_id)], args=args)
+
+    async def flush(self, user_id: int, blocking: bool = True) -> bool:
+        """
+        записывает корзину пользователя в БД; при blocking=False пропускает корзину,
+        которую сейчас записывает другой процесс
+        """
+        try:
+            async with self._lock(user_id, blocking):
+                flat = await self._snapshot(keys=[self.cart_key(user_id), CART_DIRTY_KEY], args=[user_id])
+                if not flat:
+                    return True
+                try:
+                    await self._write_to_db(user_id, _cart_fields(flat))
+                except Exception:
+                    # корзина остаётся помеченной и будет записана следующим проходом
+                    await self.redis.sadd(CART_DIRTY_KEY, user_id)
+                    raise
+        except LockError:
+            if blocking:
+                raise
+            return False
+        return True
+
+    @asynccontextmanager
+    async def checkout(self, user_id: int):
+        """
+        оформление заказа целиком под блокировкой корзины: корзина забирается из redis
+        и записывается в БД, изменения во время оформления ждут её загрузки обратно
+        (после заказа - уже пустой) и не теряются; фоновая запись корзину пропускает
+        """
+        async with self._lock(user_id):
+            flat = await self._evict(keys=[self.cart_key(user_id), CART_DIRTY_KEY], args=[user_id])
+            if flat:
+                fields = _cart_fields(flat)
+                try:
+                    await self._write_to_db(user_id, fields)
+                except Exception:
+                    await self._restore(user_id, fields)
+                    await self.redis.sadd(CART_DIRTY_KEY, user_id)
+                    raise
+            yield
+
+    async def _write_to_db(self, user_id: int, fields: dict[str, str]):
+        cart_out = _build_cart_out(fields)
+        lines = [
+            {
+                "id": item.id,
+                "product_id": item.product_id,
+                "quantity": item.quantity,
+                "price": _from_minor(fields[f"p:{item.id}"]),
+            }
+            for item in cart_out.items
+        ]
+
+        async with async_session_maker() as session:
+            cart_repo = CartRepository(session)
+            cart = await cart_repo.get_cart(user_id)
+            if cart is None:
+                if not lines:
+                    return
+                cart = await cart_repo.create_cart(user_id)
+            cart.total_quantity = sum(line["quantity"] for line in lines)
+            cart.total_price = sum((line["price"] for line in lines), Decimal(0))
+            await cart_repo.sync_items(cart.id, lines)
+            await cart_repo.commit()
+            cart_id = cart.id
+
+        if cart_out.id != cart_id:
+            await self._set_cart_id(keys=[self.cart_key(user_id)], args=[cart_id])
+        logger.info(
+            "Cart flushed to DB",
+            extra={"extra_fields": {"user_id": user_id, "cart_id": cart_id, "items": len(lines)}}
+        )
+
+    async def flush_dirty(self):
+        user_ids = [int(uid) for uid in await self.redis.smembers(CART_DIRTY_KEY)]
+        for user_id in user_ids:
+            try:
+                await self.flush(user_id, blocking=False)
+            except Exception:
+                logger.exception("Cart flush failed", extra={"extra_fields": {"user_id": user_id}})
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(settings.CART_FLUSH_INTERVAL)
+            try:
+                await self.flush_dirty()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Cart write-behind pass failed")
+
+
+redis_cart_store = RedisCartStore()
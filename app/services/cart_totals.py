@@ -0,0 +1,72 @@
+import asyncio
+
+from app.config.logging_config import logger
+from app.config.settings_config import settings
+from app.db.database import async_session_maker
+from app.repositories.cart_repository import CartRepository
+from app.utils.cache_utils import bump_versions
+
+CART_TOTALS_LOCK_KEY = "shop-cart:totals-check"
+
+
+async def repair_cart_totals(batch_size: int) -> int:
+    """
+    сверяет итоги всех корзин с их позициями пачками по batch_size,
+    каждая пачка в своей транзакции; возвращает число исправленных корзин
+    """
+    repaired = 0
+    after_id = 0
+    while True:
+        async with async_session_maker() as session:
+            cart_repo = CartRepository(session)
+            cart_ids = await cart_repo.lock_carts_batch(after_id, batch_size)
+            if not cart_ids:
+                break
+            fixed = await cart_repo.repair_totals(cart_ids)
+            await cart_repo.commit()
+
+        if fixed:
+            await bump_versions(*(f"cart:{user_id}" for user_id in fixed))
+            logger.warning("Cart totals drift repaired", extra={"extra_fields": {"user_ids": fixed}})
+        repaired += len(fixed)
+        after_id = cart_ids[-1]
+    return repaired
+
+
+class CartTotalsChecker:
+    """
+    периодическая проверка итогов корзин: итоги меняются дельтами,
+    и расхождение (например, после ручной правки cart_items) здесь исправляется.
+    Проход выполняет один процесс из всех, он берёт ключ в redis на интервал проверки
+    """
+
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+
+    async def start(self, redis_conn):
+        self._task = asyncio.create_task(self._run(redis_conn))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, redis_conn):
+        interval = settings.CART_TOTALS_CHECK_INTERVAL
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if await redis_conn.set(CART_TOTALS_LOCK_KEY, 1, nx=True, ex=interval):
+                    repaired = await repair_cart_totals(settings.CART_TOTALS_CHECK_BATCH)
+                    logger.info("Cart totals checked", extra={"extra_fields": {"repaired": repaired}})
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Cart totals check failed")
+
+
+cart_totals_checker = CartTotalsChecker()
@@ -1,19 +1,20 @@
 from app.repositories.category_repository import CategoryRepository
-from app.pydantic_models import CategoryOut, PaginatedCategories, PaginationMeta
+from app.pydantic_models import CategoryOut, CategoryTreeOut, PaginatedCategories, PaginationMeta
+from app.services.category_tree import CategoryNode, category_tree_cache
 from app.config.logging_config import logger
-from fastapi_cache.decorator import cache
-from app.utils.cache_utils import key_builder
 
 
 class CategoryService:
     def __init__(self, cartRepo: CategoryRepository):
         self.cartRepo = cartRepo
 
-    @cache(expire=60, namespace="get_categories", key_builder=key_builder)
+    # категории отдаются из дерева в памяти процесса, без обращения к БД и redis
     async def get_categories(self, limit: int, offset: int) -> PaginatedCategories:
         logger.info("Fetching categories", extra={"extra_fields": {"limit": limit, "offset": offset}})
         try:
-            categories, has_next = await self.cartRepo.get_all(limit, offset)
+            tree = await category_tree_cache.get()
+            categories = tree.categories[offset:offset + limit]
+            has_next = len(tree.categories) > offset + limit
 
             items = [
                 CategoryOut(id=c.id, name=c.name, parent_id=c.parent_id)
@@ -27,4 +28,26 @@ class CategoryService:
 
         except Exception:
             logger.exception("Failed to fetch categories")
-            raise
\ No newline at end of file
+            raise
+
+    # ETag не требует сборки ответа: он зависит только от содержимого дерева и параметров страницы
+    async def get_categories_etag(self, limit: int, offset: int) -> str:
+        tree = await category_tree_cache.get()
+        return f'"{tree.content_hash}-{limit}-{offset}"'
+
+    async def get_category_tree_etag(self) -> str:
+        tree = await category_tree_cache.get()
+        return f'"{tree.content_hash}"'
+
+    async def get_category_tree(self) -> list[CategoryTreeOut]:
+        logger.info("Fetching category tree")
+        tree = await category_tree_cache.get()
+        return [self._build_tree_out(node) for node in tree.roots]
+
+    def _build_tree_out(self, node: CategoryNode) -> CategoryTreeOut:
+        return CategoryTreeOut(
+            id=node.id,
+            name=node.name,
+            parent_id=node.parent_id,
+            children=[self._build_tree_out(child) for child in node.children],
+        )
@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import json
+from dataclasses import dataclass
+
+from app.db.database import async_session_maker
+from app.repositories.category_repository import CategoryRepository
+from app.config.logging_config import logger
+
+
+CATEGORIES_VERSION_KEY = "shop:categories:version"
+CATEGORIES_CHANNEL = "shop:categories:changed"
+
+
+@dataclass(frozen=True)
+class CategoryNode:
+    id: int
+    name: str
+    parent_id: int | None
+    children: tuple["CategoryNode", ...] = ()
+
+
+@dataclass(frozen=True)
+class CategoryTree:
+    version: int
+    categories: tuple[CategoryNode, ...]  # все категории в порядке id
+    roots: tuple[CategoryNode, ...]
+    content_hash: str  # меняется при любом изменении категорий, основа для ETag
+
+    @classmethod
+    def build(cls, rows, version: int) -> "CategoryTree":
+        children_ids: dict[int | None, list[int]] = {}
+        by_id = {}
+        for row in rows:
+            by_id[row.id] = row
+            children_ids.setdefault(row.parent_id, []).append(row.id)
+
+        nodes: dict[int, CategoryNode] = {}
+
+        def make(category_id: int) -> CategoryNode:
+            row = by_id[category_id]
+            node = CategoryNode(
+                id=row.id,
+                name=row.name,
+                parent_id=row.parent_id,
+                children=tuple(make(child_id) for child_id in sorted(children_ids.get(row.id, []))),
+            )
+            nodes[row.id] = node
+            return node
+
+        roots = tuple(make(category_id) for category_id in sorted(children_ids.get(None, [])))
+
+        categories = tuple(nodes[category_id] for category_id in sorted(nodes))
+        content = json.dumps([(c.id, c.name, c.parent_id) for c in categories], ensure_ascii=False).encode()
+
+        return cls(
+            version=version,
+            categories=categories,
+            roots=roots,
+            content_hash=hashlib.blake2b(content, digest_size=16).hexdigest(),
+        )
+
+
+class CategoryTreeCache:
+    """
+    дерево категорий в памяти процесса:
+    - загружается целиком при старте приложения
+    - перечитывается из БД, когда другой процесс увеличивает версию в redis
+      и публикует её в канал CATEGORIES_CHANNEL
+    """
+
+    def __init__(self):
+        self._tree: CategoryTree | None = None
+        self._lock = asyncio.Lock()
+        self._listener: asyncio.Task | None = None
+
+    @property
+    def tree(self) -> CategoryTree | None:
+        return self._tree
+
+    async def load(self, version: int = 0) -> CategoryTree:
+        async with self._lock:
+            async with async_session_maker() as session:
+                rows = await CategoryRepository(session).get_all_ordered()
+            self._tree = CategoryTree.build(rows, version)
+
+        logger.info(
+            "Category tree loaded",
+            extra={"extra_fields": {"version": version, "categories": len(self._tree.categories)}}
+        )
+        return self._tree
+
+    async def get(self) -> CategoryTree:
+        # запасной путь на случай, если при старте дерево не загрузилось
+        if self._tree is None:
+            return await self.load()
+        return self._tree
+
+    async def start(self, redis_conn):
+        version = int(await redis_conn.get(CATEGORIES_VERSION_KEY) or 0)
+        await self.load(version)
+        self._listener = asyncio.create_task(self._listen(redis_conn))
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def _listen(self, redis_conn):
+        while True:
+            pubsub = redis_conn.pubsub()
+            try:
+                await pubsub.subscribe(CATEGORIES_CHANNEL)
+                # версия могла смениться, пока подписки не было
+                version = int(await redis_conn.get(CATEGORIES_VERSION_KEY) or 0)
+                if self._tree is None or version > self._tree.version:
+                    await self.load(version)
+
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    version = int(message["data"])
+                    if self._tree is None or version > self._tree.version:
+                        await self.load(version)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Category tree listener failed, resubscribing")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+
+async def publish_categories_changed(redis_conn) -> int:
+    # вызывать после любого изменения таблицы categories
+    version = await redis_conn.incr(CATEGORIES_VERSION_KEY)
+    await redis_conn.publish(CATEGORIES_CHANNEL, version)
+    return version
+
+
+category_tree_cache = CategoryTreeCache()
@@ -1,39 +1,65 @@
 from fastapi import HTTPException, status
 from app.repositories.order_repository import OrderRepository
 from app.repositories.cart_repository import CartRepository
-from app.pydantic_models import OrderOut, OrderItemOut
+from app.services.cart_store import RedisCartStore
+from app.pydantic_models import OrderOut, OrderItemOut, StockConflict
 from app.services.email_service import send_email
+from app.utils.cache_utils import bump_versions
 from app.config.logging_config import logger
 
 
 class OrderService:
-    def __init__(self, orderRepo: OrderRepository, cartRepo: CartRepository):
+    def __init__(self, orderRepo: OrderRepository, cartRepo: CartRepository, cartStore: RedisCartStore | None = None):
         self.orderRepo = orderRepo
         self.cartRepo = cartRepo
+        self.cartStore = cartStore
 
     async def create_order(self, user, background_tasks) -> OrderOut:
         logger.info("Creating order", extra={"extra_fields": {"user_id": str(user.id)}})
-        
-        cart = await self.cartRepo.get_cart_with_items(user.id)
-        if not cart or not cart.items:
+
+        # корзина из redis записывается в БД до того, как заказ её прочитает, и до конца
+        # оформления не меняется: изменения ждут, пока корзина загрузится обратно
+        if self.cartStore:
+            async with self.cartStore.checkout(user.id):
+                return await self._create_order(user, background_tasks)
+        return await self._create_order(user, background_tasks)
+
+    async def _create_order(self, user, background_tasks) -> OrderOut:
+        # заказ собирается несколькими запросами над множествами, их число не зависит от размера корзины
+        cart_id = await self.cartRepo.lock_cart(user.id)
+        order = await self.orderRepo.create_order_from_cart(user.id, cart_id) if cart_id else None
+        if not order:
+            await self.orderRepo.rollback()
             logger.warning("Cart is empty", extra={"extra_fields": {"user_id": str(user.id)}})
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cart is empty")
 
-        order = await self.orderRepo.create_order(user.id, cart.total_price, cart.total_quantity)
-        items = await self.cartRepo.get_items(cart.id) # cart
-
         logger.info(
             "Order created in DB",
             extra={"extra_fields": {"order_id": str(order.id), "total_price": order.total_price}}
         )
 
-        order_items = []
-        for ci in items:
-            oi = await self.orderRepo.add_order_item(order.id, ci.product_id, ci.quantity, ci.price)
-            order_items.append(oi)
+        order_items = await self.orderRepo.copy_cart_items(order.id, cart_id)
+        await self.cartRepo.clear_cart(cart_id)
+
+        # остатки списываются последним запросом перед коммитом (корзина уже очищена),
+        # чтобы блокировки строк товаров держались недолго;
+        # при нехватке заказ откатывается целиком, в ответе - все позиции, которым не хватило остатка
+        conflicts = await self.orderRepo.reserve_stock(order.id)
+        if conflicts:
+            await self.orderRepo.rollback()
+            items = [StockConflict(product_id=c.product_id, requested=c.requested, available=c.available) for c in conflicts]
+            logger.warning(
+                "Order rejected: not enough stock",
+                extra={"extra_fields": {"user_id": str(user.id), "conflicts": [i.model_dump() for i in items]}}
+            )
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail={"message": "Not enough stock", "items": [i.model_dump() for i in items]},
+            )
 
-        await self.cartRepo.clear_cart(cart, items)
         await self.orderRepo.commit()
+        if not self.cartStore:
+            await bump_versions(f"cart:{user.id}")
 
         logger.info(
             "Cart cleared after order creation",
@@ -1,11 +1,35 @@
+from decimal import Decimal, InvalidOperation
 from fastapi import HTTPException, status
 from app.repositories.product_repository import ProductRepository
 from app.repositories.size_repository import SizeRepository
 from app.repositories.category_repository import CategoryRepository
-from app.pydantic_models import PaginatedProducts, PaginationMeta, ProductIn, ProductOut
+from app.pydantic_models import PaginatedProducts, PaginationMeta, PriceBucketFacet, ProductFacets, ProductIn, ProductOut, ProductPrice, ProductStock, SizeFacet
+from app.services.cart_repricing import reprice_carts
 from app.config.logging_config import logger
-from fastapi_cache.decorator import cache
-from app.utils.cache_utils import key_builder
+from app.config.settings_config import settings
+from fastapi_cache import FastAPICache
+from app.utils.cache_utils import (
+    build_cache_key,
+    bump_versions,
+    cache,
+    encode_json,
+    get_versions,
+    pack_response,
+    unpack_response,
+    versioned_key_builder,
+    with_version,
+)
+from app.utils.cursor_utils import decode_cursor, encode_cursor
+
+
+PRICE_SORTS = ("price_asc", "price_desc")
+
+
+def _listing_cache_args(arguments: dict) -> dict:
+    # любая неизвестная сортировка работает как сортировка по id, поэтому и ключ у неё общий
+    if arguments["sort"] not in PRICE_SORTS:
+        arguments["sort"] = None
+    return arguments
 
 class ProductService:
     def __init__(self, prodRepo: ProductRepository, sizeRepo: SizeRepository, categRepo: CategoryRepository):
@@ -13,6 +37,10 @@ class ProductService:
         self.sizeRepo = sizeRepo
         self.categRepo = categRepo
 
+    @classmethod
+    def from_session(cls, session) -> "ProductService":
+        return cls(ProductRepository(session), SizeRepository(session), CategoryRepository(session))
+
     async def create_product(self, product_data: ProductIn) -> ProductOut:
         logger.info("Attempting to create product", extra={"extra_fields": product_data.dict()})
 
@@ -34,7 +62,8 @@ class ProductService:
                 image=product_data.image,
                 price=product_data.price,
                 size=size,
-                categories=categories
+                categories=categories,
+                stock=product_data.stock
             )
         except Exception:
             logger.exception("Error while creating product", extra={"extra_fields": product_data.dict()})
@@ -42,6 +71,14 @@ class ProductService:
 
         logger.info("Product created successfully", extra={"extra_fields": {"id": product_full.id}})
 
+        # листинги всех категорий товара и их предков, а также поиск больше не актуальны
+        category_ids = await self.categRepo.get_ancestor_ids(product_data.category_ids)
+        await bump_versions(
+            f"product:{product_full.id}",
+            "catalog",
+            *(f"category:{category_id}" for category_id in category_ids),
+        )
+
         return ProductOut(
             id=product_full.id,
             name=product_full.name,
@@ -52,44 +89,200 @@ class ProductService:
             categories=[c.name for c in product_full.categories]
         )
 
-    @cache(expire=60, namespace="get_products", key_builder=key_builder)
+    async def update_stock(self, stocks: list[ProductStock]) -> list[ProductStock]:
+        product_ids = [s.product_id for s in stocks]
+        if not product_ids:
+            return []
+        if len(set(product_ids)) != len(product_ids):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Duplicate products in request")
+        if any(s.stock is not None and s.stock < 0 for s in stocks):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Stock is negative")
+
+        rows = await self.prodRepo.update_stock([(s.product_id, s.stock) for s in stocks])
+        logger.info("Product stock updated", extra={"extra_fields": {"product_ids": [row.id for row in rows]}})
+        return [ProductStock(product_id=row.id, stock=row.stock) for row in rows]
+
+    async def update_prices(self, prices: list[ProductPrice], background_tasks) -> list[ProductPrice]:
+        product_ids = [p.product_id for p in prices]
+        if not product_ids:
+            return []
+        if len(set(product_ids)) != len(product_ids):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Duplicate products in request")
+        logger.info("Updating product prices", extra={"extra_fields": {"product_ids": product_ids}})
+
+        rows = await self.prodRepo.update_prices([(p.product_id, p.price) for p in prices])
+        updated_ids = [row.id for row in rows]
+        missing = sorted(set(product_ids) - set(updated_ids))
+        if missing:
+            logger.warning("Prices not updated: products not found", extra={"extra_fields": {"product_ids": missing}})
+
+        if updated_ids:
+            # цена видна в карточках, листингах и поиске
+            category_ids = await self.categRepo.get_ancestor_ids(await self.prodRepo.get_category_ids(updated_ids))
+            await bump_versions(
+                *(f"product:{product_id}" for product_id in updated_ids),
+                "catalog",
+                *(f"category:{category_id}" for category_id in category_ids),
+            )
+            # корзины с этими товарами пересчитываются после ответа
+            background_tasks.add_task(reprice_carts, updated_ids)
+
+        return [ProductPrice(product_id=row.id, price=row.price) for row in rows]
+
+    @cache(
+        expire=settings.CACHE_EXPIRE,
+        namespace="get_products",
+        key_builder=versioned_key_builder("category", "category_id", normalize=_listing_cache_args),
+        raw_response=True,
+        stale_ttl=settings.CACHE_STALE_TTL,
+    )
     async def get_products(
         self,
         category_id: int,
+        include_descendants: bool,
         min_price: float | None,
         max_price: float | None,
         sort: str | None,
         limit: int,
         offset: int,
+        cursor: str | None = None,
     ) -> PaginatedProducts:
+        after = self._parse_cursor(cursor, sort) if cursor else None
+
         try:
             prods, has_next = await self.prodRepo.get_filtered(
-                category_id, min_price, max_price, sort, limit, offset
+                category_id, include_descendants, min_price, max_price, sort, limit, offset, after
             )
         except Exception:
             logger.exception("Error fetching products")
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Products not found")
 
-        items = []
-        for p in prods:
-            items.append(
-                ProductOut(
-                    id=p.id,
-                    name=p.name,
-                    description=p.description,
-                    image=p.image,
-                    price=p.price,
-                    size=p.size.name if p.size else None,
-                    categories=[c.name for c in p.categories],
-                )
+        items = [self._build_product_out(p) for p in prods]
+
+        next_cursor = self._make_cursor(prods[-1], sort) if has_next and prods else None
+
+        return PaginatedProducts(
+            items=items,
+            meta=PaginationMeta(limit=limit, offset=offset, has_next=has_next, next_cursor=next_cursor),
+        )
+
+    @cache(
+        expire=settings.CACHE_EXPIRE,
+        namespace="get_product_facets",
+        key_builder=versioned_key_builder("category", "category_id"),
+        raw_response=True,
+    )
+    async def get_product_facets(self, category_id: int, include_descendants: bool) -> ProductFacets:
+        thresholds = settings.FACET_PRICE_BUCKETS
+
+        try:
+            sizes, buckets = await self.prodRepo.get_facets(category_id, include_descendants, thresholds)
+        except Exception:
+            logger.exception("Error fetching product facets", extra={"extra_fields": {"category_id": category_id}})
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Products not found")
+
+        # диапазон i: [thresholds[i-1], thresholds[i]), крайние диапазоны открыты
+        bounds = [None, *thresholds, None]
+        price_buckets = [
+            PriceBucketFacet(min_price=bounds[i], max_price=bounds[i + 1], count=buckets.get(i, 0))
+            for i in range(len(thresholds) + 1)
+        ]
+
+        return ProductFacets(
+            category_id=category_id,
+            sizes=[SizeFacet(size=name, count=count) for name, count in sizes],
+            price_buckets=price_buckets,
+        )
+
+    @cache(
+        expire=settings.CACHE_EXPIRE,
+        namespace="search_products",
+        key_builder=versioned_key_builder("catalog"),
+        raw_response=True,
+        stale_ttl=settings.CACHE_STALE_TTL,
+    )
+    async def search_products(
+        self,
+        query: str,
+        min_price: float | None,
+        max_price: float | None,
+        limit: int,
+        cursor: str | None = None,
+    ) -> PaginatedProducts:
+        after = self._parse_search_cursor(cursor) if cursor else None
+
+        try:
+            found, has_next = await self.prodRepo.search(
+                query, min_price, max_price, limit, after, settings.SEARCH_MAX_MATCHES
             )
+        except Exception:
+            logger.exception("Error searching products", extra={"extra_fields": {"query": query}})
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Products not found")
+
+        items = [self._build_product_out(p) for p in found]
+
+        next_cursor = None
+        if has_next and found:
+            last = found[-1]
+            next_cursor = encode_cursor({"sort": "rank", "rank": float(last.rank), "id": last.id})
 
         return PaginatedProducts(
             items=items,
-            meta=PaginationMeta(limit=limit, offset=offset, has_next=has_next),
+            meta=PaginationMeta(limit=limit, offset=0, has_next=has_next, next_cursor=next_cursor),
         )
 
-    @cache(expire=60, namespace="get_product", key_builder=key_builder)
+    @staticmethod
+    def _build_product_out(row) -> ProductOut:
+        # row - строка ProductRepository._listing_query
+        return ProductOut(
+            id=row.id,
+            name=row.name,
+            description=row.description,
+            image=row.image,
+            price=row.price,
+            size=row.size,
+            categories=row.categories or [],
+        )
+
+    @staticmethod
+    def _make_cursor(last, sort: str | None) -> str:
+        if sort in PRICE_SORTS:
+            return encode_cursor({"sort": sort, "price": str(last.price), "id": last.id})
+        return encode_cursor({"sort": "id", "id": last.id})
+
+    @staticmethod
+    def _parse_cursor(cursor: str, sort: str | None) -> tuple:
+        # курсор действителен только для той сортировки, в которой он был выдан
+        expected_sort = sort if sort in PRICE_SORTS else "id"
+        try:
+            payload = decode_cursor(cursor)
+            if payload.get("sort") != expected_sort:
+                raise ValueError("Cursor does not match sort")
+            last_id = int(payload["id"])
+            if expected_sort == "id":
+                return (last_id,)
+            return (Decimal(payload["price"]), last_id)
+        except (ValueError, KeyError, TypeError, InvalidOperation):
+            logger.warning("Invalid pagination cursor", extra={"extra_fields": {"cursor": cursor, "sort": sort}})
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    @staticmethod
+    def _parse_search_cursor(cursor: str) -> tuple[float, int]:
+        try:
+            payload = decode_cursor(cursor)
+            if payload.get("sort") != "rank":
+                raise ValueError("Cursor does not match sort")
+            return (float(payload["rank"]), int(payload["id"]))
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Invalid search cursor", extra={"extra_fields": {"cursor": cursor}})
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    @cache(
+        expire=settings.CACHE_EXPIRE,
+        namespace="get_product",
+        key_builder=versioned_key_builder("product", "product_id"),
+        raw_response=True,
+    )
     async def get_product(self, product_id: int) -> ProductOut:
         logger.info(
             "Fetching product by ID",
@@ -120,4 +313,44 @@ class ProductService:
             price=p.price,
             size=size_name,
             categories=cat_names,
-        )
\ No newline at end of file
+        )
+    async def get_products_batch(self, product_ids: list[int]) -> list[ProductOut]:
+        # кэш get_product читается из L1 и одним MGET, промахи загружаются одним запросом
+        # и дописываются в кэш одним pipeline
+        ids = list(dict.fromkeys(product_ids))
+        logger.info("Fetching products batch", extra={"extra_fields": {"product_ids": ids}})
+
+        backend = FastAPICache.get_backend()
+
+        versions = await get_versions([f"product:{product_id}" for product_id in ids])
+        keys = {
+            product_id: with_version(build_cache_key(ProductService.get_product, "get_product", product_id), version)
+            for product_id, version in zip(ids, versions)
+        }
+        cached = await backend.get_many(list(keys.values()))
+
+        found: dict[int, ProductOut] = {}
+        misses = []
+        for product_id, value in zip(ids, cached):
+            if value is None:
+                misses.append(product_id)
+            else:
+                _, body = unpack_response(value)
+                found[product_id] = ProductOut.model_validate_json(body)
+
+        if misses:
+            rows = await self.prodRepo.get_products_by_ids(misses)
+
+            backfill = {}
+            for row in rows:
+                product = self._build_product_out(row)
+                found[row.id] = product
+                backfill[keys[row.id]] = pack_response(encode_json(product))
+            await backend.set_many(backfill, settings.CACHE_EXPIRE)
+
+        logger.info(
+            "Products batch fetched",
+            extra={"extra_fields": {"requested": len(ids), "cache_misses": len(misses), "found": len(found)}}
+        )
+
+        return [found[product_id] for product_id in ids if product_id in found]
@@ -1,27 +1,429 @@
-from typing import Callable, Any
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import secrets
+from decimal import Decimal
+from typing import Callable, Any, get_type_hints
 
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
 from fastapi_cache import FastAPICache
+from pydantic import TypeAdapter
 from app.config.logging_config import logger
+from app.db.database import async_session_maker
+from app.utils.etag_utils import make_etag
+from app.utils.metrics import CACHE_LOOKUPS
+from app.utils.two_tier_cache import key_namespace
+
+MAX_KEY_LENGTH = 200
+
+# аргументы, которые не влияют на результат
+SERVICE_ARGS = ("self", "request", "response")
+
+
+@functools.lru_cache(maxsize=None)
+def _signature(func: Callable) -> inspect.Signature:
+    return inspect.signature(inspect.unwrap(func))
+
+
+def bind_arguments(func: Callable, args: tuple, kwargs: dict) -> dict[str, Any]:
+    """
+    аргументы вызова по именам, с подставленными значениями по умолчанию,
+    так что f(1), f(1, None) и f(x=1) дают одно и то же
+    """
+    bound = _signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    return {k: v for k, v in bound.arguments.items() if k not in SERVICE_ARGS}
+
+
+def canonical_value(value: Any) -> str:
+    # 100, 100.0 и Decimal("100.00") дают одно и то же значение
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else repr(value)
+    if isinstance(value, Decimal):
+        return format(value.normalize(), "f") if value.is_finite() else str(value)
+    return str(value)
+
+
+def canonical_key(namespace: str, arguments: dict[str, Any]) -> str:
+    key = ":".join([namespace, *(f"{k}={canonical_value(v)}" for k, v in arguments.items())])
+    # длинные ключи (например, с курсором или поисковой строкой) заменяются хэшем фиксированной длины
+    if len(key) > MAX_KEY_LENGTH:
+        key = f"{namespace}:h={hashlib.sha256(key.encode()).hexdigest()[:32]}"
+    return key
+
 
 def key_builder(func: Callable, namespace: str = "", *args: Any, **kwargs: Any) -> str:
     """
     ключ для кэша:
-    - игнорирует 'self' (первый позиционный аргумент)
-    - игнорирует request, response и другие служебные объекты
-    - формирует ключ на основе оставшихся простых аргументов
+    - игнорирует 'self', request, response
+    - аргументы берутся по именам с учётом значений по умолчанию
+    - значения приводятся к каноническому виду, длинные ключи хэшируются
+    """
+    arguments = bind_arguments(func, kwargs.get("args", ()), kwargs.get("kwargs", {}))
+    return canonical_key(namespace, arguments)
+
+
+def build_cache_key(func: Callable, namespace: str, *args: Any, **kwargs: Any) -> str:
+    # тот же ключ (без версии), что строит @cache(namespace=namespace) для метода сервиса func,
+    # вызванного с аргументами args/kwargs
+    arguments = bind_arguments(func, (None, *args), kwargs)
+    return canonical_key(f"{FastAPICache.get_prefix()}:{namespace}", arguments)
+
+
+def version_key(scope: str) -> str:
+    return f"{FastAPICache.get_prefix()}:version:{scope}"
+
+
+def with_version(key: str, version: int) -> str:
+    return f"{key}:v={version}"
+
+
+async def get_versions(scopes: list[str], consistent: bool = False) -> list[int]:
+    """
+    текущие версии областей кэша; consistent=True читает их прямо из redis, мимо L1,
+    чтобы изменение было видно в следующем же запросе в любом процессе
+    """
+    if not scopes:
+        return []
+    backend = FastAPICache.get_backend()
+    keys = [version_key(s) for s in scopes]
+    if consistent:
+        values = await backend.redis.mget(keys)
+    else:
+        values = await backend.get_many(keys, cache_absent=True)
+    return [int(v) if v is not None else 0 for v in values]
+
+
+async def bump_versions(*scopes: str):
+    # после изменения данных старые ключи перестают читаться и истекают по TTL
+    if not scopes:
+        return
+    backend = FastAPICache.get_backend()
+    keys = [version_key(scope) for scope in scopes]
+    async with backend.redis.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.incr(key)
+        await pipe.execute()
+    # старые версии убираются из L1 всех процессов
+    await backend.invalidate(keys)
+    logger.info("Cache versions bumped", extra={"extra_fields": {"scopes": list(scopes)}})
+
+
+def versioned_key_builder(
+    scope: str,
+    arg: str | None = None,
+    normalize: Callable[[dict[str, Any]], dict[str, Any]] | None = None,
+    consistent: bool = False,
+) -> Callable:
+    """
+    key_builder, который добавляет к ключу версию области кэша:
+    - scope="product", arg="product_id" -> версия "product:<product_id>"
+    - scope="catalog" без arg -> одна общая версия
+    normalize приводит аргументы к их фактическому смыслу для запроса
+    (например, неизвестная сортировка -> сортировка по умолчанию)
+    consistent: версия читается мимо L1 (см. get_versions)
+    """
+
+    async def builder(func: Callable, namespace: str = "", *args: Any, **kwargs: Any) -> str:
+        arguments = bind_arguments(func, kwargs.get("args", ()), kwargs.get("kwargs", {}))
+        if normalize is not None:
+            arguments = normalize(arguments)
+
+        scope_name = scope if arg is None else f"{scope}:{arguments[arg]}"
+        version, = await get_versions([scope_name], consistent=consistent)
+        return with_version(canonical_key(namespace, arguments), version)
+
+    return builder
+
+
+async def cache_key_report(sample_size: int = 50) -> dict[str, dict[str, int]]:
+    """
+    число ключей и оценка занимаемой памяти по namespace;
+    проходит по всем ключам префикса через SCAN, поэтому только для администрирования
+    """
+    redis_conn = FastAPICache.get_backend().redis
+    prefix = FastAPICache.get_prefix()
+
+    keys_by_namespace: dict[str, int] = {}
+    samples: dict[str, list[bytes]] = {}
+    async for key in redis_conn.scan_iter(match=f"{prefix}:*", count=1000):
+        namespace = key_namespace(key.decode() if isinstance(key, bytes) else key)
+        keys_by_namespace[namespace] = keys_by_namespace.get(namespace, 0) + 1
+        sample = samples.setdefault(namespace, [])
+        if len(sample) < sample_size:
+            sample.append(key)
+
+    report = {}
+    for namespace, count in sorted(keys_by_namespace.items()):
+        async with redis_conn.pipeline(transaction=False) as pipe:
+            for key in samples[namespace]:
+                pipe.memory_usage(key)
+            sizes = [size for size in await pipe.execute() if size is not None]
+        avg_bytes = sum(sizes) // len(sizes) if sizes else 0
+        report[namespace] = {"keys": count, "avg_bytes": avg_bytes, "estimated_bytes": avg_bytes * count}
+    return report
+
+
+# снятие блокировки только её владельцем
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# промахи, которые сейчас вычисляются в этом процессе
+_inflight: dict[str, asyncio.Task] = {}
+# фоновые обновления устаревших значений
+_refreshing: dict[str, asyncio.Task] = {}
+
+
+def _forget_inflight(cache_key: str, task: asyncio.Task):
+    _inflight.pop(cache_key, None)
+    if not task.cancelled():
+        task.exception()  # исключение получат ожидающие, без предупреждения о неполученной ошибке
+
+
+def encode_json(value: Any) -> bytes:
+    # так же, как тело JSONResponse: это тело можно отдать клиенту без изменений
+    return json.dumps(
+        jsonable_encoder(value),
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def pack_response(body: bytes) -> bytes:
+    # ETag считается один раз при записи и хранится в первой строке значения
+    return make_etag(body).encode() + b"\n" + body
+
+
+def unpack_response(payload: bytes) -> tuple[str, bytes]:
+    if not payload.startswith(b'"'):
+        # значение без ETag (записано до его появления)
+        return make_etag(payload), payload
+    etag, _, body = payload.partition(b"\n")
+    return etag.decode(), body
+
+
+def json_response(payload: bytes) -> Response:
+    etag, body = unpack_response(payload)
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
+def cache(
+    expire: int | None = None,
+    namespace: str = "",
+    key_builder: Callable = key_builder,
+    raw_response: bool = False,
+    stale_ttl: int | None = None,
+    lock_timeout: float = 5.0,
+    poll_interval: float = 0.05,
+):
+    """
+    замена fastapi_cache.decorator.cache для методов сервисов
+    (тот же backend, coder и prefix из FastAPICache) с защитой от лавины промахов:
+    - внутри процесса одновременные промахи по одному ключу ждут одну общую задачу
+    - между процессами первый промах берёт короткую блокировку в redis,
+      остальные ждут, пока значение появится в кэше
+    raw_response=True: в кэше хранится готовое json-тело ответа вместе с его ETag; метод по-прежнему
+    возвращает модель, а роутер через cached_response получает Response с этими байтами,
+    и при попадании модель не собирается и не валидируется заново
+    stale_ttl: значение живёт в redis expire + stale_ttl секунд; последние stale_ttl секунд
+    оно отдаётся сразу, а пересчитывается в фоне (у сервиса должен быть from_session)
     """
 
-    func_args = kwargs.get("args", ())
+    def wrapper(func: Callable) -> Callable:
+        return_type = get_type_hints(func).get("return")
+        body_type = TypeAdapter(return_type if return_type is not None else Any) if raw_response else None
+
+        def from_cache(payload: bytes, as_response: bool) -> Any:
+            if not raw_response:
+                return FastAPICache.get_coder().decode_as_type(payload, type_=return_type)
+            if as_response:
+                return json_response(payload)
+            return body_type.validate_json(unpack_response(payload)[1])
+
+        async def call(args: tuple, kwargs: dict, as_response: bool) -> tuple[Any, str]:
+            # значение и результат поиска в кэше: hit, stale, miss или off (кэш выключен);
+            # as_response - вернуть Response с телом из кэша (только для raw_response)
+            if not FastAPICache.get_enable():
+                result = await func(*args, **kwargs)
+                if raw_response and as_response:
+                    result = json_response(pack_response(encode_json(result)))
+                return result, "off"
+
+            backend = FastAPICache.get_backend()
+
+            cache_key = key_builder(
+                func,
+                f"{FastAPICache.get_prefix()}:{namespace}",
+                request=None,
+                response=None,
+                args=args,
+                kwargs=kwargs,
+            )
+            if inspect.isawaitable(cache_key):
+                cache_key = await cache_key
+
+            base_expire = expire or FastAPICache.get_expire()
+            hard_expire = base_expire + stale_ttl if base_expire and stale_ttl else base_expire
+
+            lookup = "hit"
+            if stale_ttl:
+                ttl, cached = await backend.get_with_ttl(cache_key)
+                if cached is not None and 0 <= ttl <= stale_ttl:
+                    lookup = "stale"
+                    _schedule_refresh(func, args, kwargs, cache_key, hard_expire, raw_response, lock_timeout)
+            else:
+                cached = await backend.get(cache_key)
+
+            CACHE_LOOKUPS.labels(namespace=namespace, result=lookup if cached is not None else "miss").inc()
+
+            if cached is not None:
+                return from_cache(cached, as_response), lookup
+
+            # расчёт идёт в отдельной задаче: отмена одного запроса не отменяет его для остальных
+            task = _inflight.get(cache_key)
+            if task is None:
+                task = asyncio.create_task(
+                    _compute_once(
+                        func, args, kwargs, cache_key, hard_expire, return_type, raw_response, lock_timeout, poll_interval
+                    )
+                )
+                _inflight[cache_key] = task
+                task.add_done_callback(functools.partial(_forget_inflight, cache_key))
+
+            result = await asyncio.shield(task)
+            # в режиме raw_response задача возвращает байты тела, Response у каждого запроса свой
+            return (from_cache(result, as_response) if raw_response else result), "miss"
+
+        @functools.wraps(func)
+        async def inner(*args: Any, **kwargs: Any) -> Any:
+            value, _ = await call(args, kwargs, as_response=False)
+            return value
+
+        inner.cached_call = call
+        return inner
+
+    return wrapper
+
+
+async def cached_response(method: Callable, *args: Any, **kwargs: Any) -> Any:
+    """
+    результат метода сервиса для роутера: у метода с @cache(raw_response=True) - Response
+    с готовым json-телом из кэша, у остальных методов - их обычный результат
+    """
+    call = getattr(method, "cached_call", None)
+    if call is None:
+        return await method(*args, **kwargs)
+    value, _ = await call((method.__self__, *args), kwargs, as_response=True)
+    return value
+
+
+async def cached_lookup(method: Callable, *args: Any, **kwargs: Any) -> tuple[Any, str]:
+    # результат метода сервиса с @cache и то, как он получен: hit, stale, miss или off
+    return await method.cached_call((method.__self__, *args), kwargs, as_response=False)
+
+
+async def _compute_once(
+    func: Callable,
+    args: tuple,
+    kwargs: dict,
+    cache_key: str,
+    expire: int | None,
+    return_type: Any,
+    raw_response: bool,
+    lock_timeout: float,
+    poll_interval: float,
+) -> Any:
+    backend = FastAPICache.get_backend()
+    coder = FastAPICache.get_coder()
+    redis_conn = backend.redis
+
+    lock_key = f"{cache_key}:lock"
+    token = secrets.token_hex(8)
+    acquired = await redis_conn.set(lock_key, token, nx=True, px=int(lock_timeout * 1000))
+
+    if not acquired:
+        # значение уже считает другой процесс
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + lock_timeout
+        while loop.time() < deadline:
+            await asyncio.sleep(poll_interval)
+            cached = await backend.get(cache_key)
+            if cached is not None:
+                return cached if raw_response else coder.decode_as_type(cached, type_=return_type)
+            if not await redis_conn.exists(lock_key):
+                break
+        logger.warning("Cache value did not appear after lock wait, computing locally", extra={"extra_fields": {"key": cache_key}})
+
+    try:
+        result = await func(*args, **kwargs)
+        payload = pack_response(encode_json(result)) if raw_response else coder.encode(result)
+        await backend.set(cache_key, payload, expire)
+        return payload if raw_response else result
+    finally:
+        if acquired:
+            await redis_conn.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+
+
+def _schedule_refresh(
+    func: Callable,
+    args: tuple,
+    kwargs: dict,
+    cache_key: str,
+    expire: int | None,
+    raw_response: bool,
+    lock_timeout: float,
+):
+    if cache_key in _refreshing:
+        return
+    task = asyncio.create_task(_refresh(func, args, kwargs, cache_key, expire, raw_response, lock_timeout))
+    _refreshing[cache_key] = task
+    task.add_done_callback(lambda _: _refreshing.pop(cache_key, None))
+
 
-    # Пропускаем self (первый элемент)
-    real_args = func_args[1:] if len(func_args) > 0 else ()
+async def _refresh(
+    func: Callable,
+    args: tuple,
+    kwargs: dict,
+    cache_key: str,
+    expire: int | None,
+    raw_response: bool,
+    lock_timeout: float,
+):
+    backend = FastAPICache.get_backend()
+    coder = FastAPICache.get_coder()
+    redis_conn = backend.redis
 
-    simple_kwargs = {k: v for k, v in kwargs.get("kwargs", {}).items()
-                     if k not in ("request", "response")}
+    # обновляет только один процесс
+    lock_key = f"{cache_key}:lock"
+    token = secrets.token_hex(8)
+    if not await redis_conn.set(lock_key, token, nx=True, px=int(lock_timeout * 1000)):
+        return
 
-    key_parts = [namespace]
-    key_parts.extend(map(str, real_args))
-    for k, v in sorted(simple_kwargs.items()):
-        key_parts.append(f"{k}={v}")
+    try:
+        # сессия запроса закрывается вместе с ним, поэтому обновление идёт в своей сессии
+        owner = args[0] if args else None
+        async with async_session_maker() as session:
+            if hasattr(owner, "from_session"):
+                result = await func(type(owner).from_session(session), *args[1:], **kwargs)
+            else:
+                result = await func(*args, **kwargs)
 
-    return ":".join(key_parts)
\ No newline at end of file
+        payload = pack_response(encode_json(result)) if raw_response else coder.encode(result)
+        await backend.set(cache_key, payload, expire)
+        logger.info("Stale cache entry refreshed", extra={"extra_fields": {"key": cache_key}})
+    except Exception:
+        logger.exception("Background cache refresh failed", extra={"extra_fields": {"key": cache_key}})
+    finally:
+        await redis_conn.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
@@ -0,0 +1,120 @@
+import os
+import time
+from contextvars import ContextVar
+
+import redis.asyncio as redis
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency",
+    ["method", "route", "status"],
+)
+SQL_STATEMENTS = Histogram(
+    "http_request_sql_statements",
+    "SQL statements executed per HTTP request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34),
+)
+SQL_TIME = Histogram(
+    "http_request_sql_seconds",
+    "Time spent in SQL per HTTP request",
+    ["route"],
+)
+REDIS_TIME = Histogram(
+    "redis_command_duration_seconds",
+    "Redis command latency",
+    ["command"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total",
+    "Service cache lookups by namespace and result (hit, stale, miss)",
+    ["namespace", "result"],
+)
+CACHE_TIER_LOOKUPS = Counter(
+    "cache_tier_lookups_total",
+    "Two-tier cache lookups by namespace and tier (l1_hits, l2_hits, misses)",
+    ["namespace", "tier"],
+)
+RATE_LIMIT_REJECTIONS = Counter(
+    "rate_limit_rejections_total",
+    "Requests rejected by the rate limiter",
+    ["route"],
+)
+DB_POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the SQLAlchemy pool",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+)
+
+
+class SqlStats:
+    __slots__ = ("statements", "seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+
+# SQL-статистика текущего HTTP-запроса
+request_sql_stats: ContextVar[SqlStats | None] = ContextVar("request_sql_stats", default=None)
+
+
+def instrument_engine(engine: Engine):
+    # время и число SQL-запросов складываются в статистику текущего HTTP-запроса
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = request_sql_stats.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.seconds += elapsed
+
+
+class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    # _do_get - точка расширения пулов SQLAlchemy: здесь ждут свободное соединение
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT.observe(time.perf_counter() - start)
+
+
+class InstrumentedRedis(redis.Redis):
+    # команды pipeline выполняются одним execute и сюда не попадают
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            command = args[0] if args else "UNKNOWN"
+            if isinstance(command, bytes):
+                command = command.decode()
+            REDIS_TIME.labels(command=str(command).upper()).observe(time.perf_counter() - start)
+
+
+def route_label(scope) -> str:
+    # шаблон пути, а не сам путь, чтобы число рядов метрик не росло
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+def render_metrics() -> tuple[bytes, str]:
+    # при нескольких воркерах prometheus_client собирает метрики из PROMETHEUS_MULTIPROC_DIR
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
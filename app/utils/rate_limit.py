@@ -1,7 +1,16 @@
+from fastapi import Request, Response
 from app.config.rate_limits_config import RATE_LIMITS
+from app.utils.metrics import RATE_LIMIT_REJECTIONS, route_label
+from fastapi_limiter import http_default_callback
 from fastapi_limiter.depends import RateLimiter
 
 
 def rate_limit(name: str):
     times, seconds = RATE_LIMITS[name]
-    return RateLimiter(times=times, seconds=seconds)
\ No newline at end of file
+    return RateLimiter(times=times, seconds=seconds)
+
+
+async def rate_limit_callback(request: Request, response: Response, pexpire: int):
+    # стандартный ответ 429, но с учётом отказа в метриках
+    RATE_LIMIT_REJECTIONS.labels(route=route_label(request.scope)).inc()
+    await http_default_callback(request, response, pexpire)
@@ -0,0 +1,225 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from fastapi_cache.backends.redis import RedisBackend
+from fastapi_cache.types import Backend
+
+from app.config.logging_config import logger
+from app.utils.metrics import CACHE_TIER_LOOKUPS
+
+
+INVALIDATION_CHANNEL = "shop-cache:invalidate"
+
+_ABSENT = object()
+
+
+def key_namespace(key: str) -> str:
+    # "shop-cache:get_products:..." -> "get_products"
+    parts = key.split(":", 2)
+    return parts[1] if len(parts) > 1 else parts[0]
+
+
+class LocalCache:
+    """
+    LRU в памяти процесса с ограничением по числу записей и по суммарному размеру значений
+    и коротким TTL; None тоже можно сохранить (отсутствующий в redis ключ)
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (value, срок жизни в L1, срок жизни в redis или None, если неизвестен)
+        self._data: OrderedDict[str, tuple[Optional[bytes], float, Optional[float]]] = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: str):
+        return self.get_with_deadline(key)[0]
+
+    def get_with_deadline(self, key: str) -> tuple[Any, Optional[float]]:
+        entry = self._data.get(key)
+        if entry is None:
+            return _ABSENT, None
+        value, expires_at, remote_expires_at = entry
+        if expires_at <= time.monotonic():
+            self.delete(key)
+            return _ABSENT, None
+        self._data.move_to_end(key)
+        return value, remote_expires_at
+
+    def set(self, key: str, value: Optional[bytes], ttl: Optional[float] = None):
+        size = self._size(key, value)
+        if size > self.max_bytes:
+            return
+        self.delete(key)
+        now = time.monotonic()
+        remote_expires_at = now + ttl if ttl is not None and ttl > 0 else None
+        local_ttl = self.ttl if ttl is None or ttl <= 0 else min(ttl, self.ttl)
+        self._data[key] = (value, now + local_ttl, remote_expires_at)
+        self._bytes += size
+        while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+            old_key, (old_value, _, _) = self._data.popitem(last=False)
+            self._bytes -= self._size(old_key, old_value)
+
+    def delete(self, key: str):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= self._size(key, entry[0])
+
+    def clear(self):
+        self._data.clear()
+        self._bytes = 0
+
+    @staticmethod
+    def _size(key: str, value: Optional[bytes]) -> int:
+        return len(key) + (len(value) if value else 0)
+
+
+class TwoTierBackend(Backend):
+    """
+    backend для FastAPICache: L1 в памяти процесса перед RedisBackend.
+    Ключи те же, что строит key_builder. Записи, изменяемые на месте (версии),
+    удаляются из L1 во всех процессах через redis pub/sub (invalidate).
+    """
+
+    def __init__(self, remote: RedisBackend, local: LocalCache):
+        self.remote = remote
+        self.local = local
+        self._stats: dict[str, dict[str, int]] = {}
+        self._listener: asyncio.Task | None = None
+
+    @property
+    def redis(self):
+        return self.remote.redis
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        # из L1 отдаются только записи с известным сроком жизни в redis
+        value, remote_expires_at = self.local.get_with_deadline(key)
+        if value is not _ABSENT and value is not None and remote_expires_at is not None:
+            self._count(key, "l1_hits")
+            return max(int(remote_expires_at - time.monotonic()), 0), value
+
+        ttl, value = await self.remote.get_with_ttl(key)
+        if value is None:
+            self._count(key, "misses")
+            return ttl, None
+
+        self._count(key, "l2_hits")
+        self.local.set(key, value, ttl)
+        return ttl, value
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value = self.local.get(key)
+        if value is not _ABSENT and value is not None:
+            self._count(key, "l1_hits")
+            return value
+
+        value = await self.remote.get(key)
+        if value is None:
+            self._count(key, "misses")
+            return None
+
+        self._count(key, "l2_hits")
+        self.local.set(key, value)
+        return value
+
+    async def get_many(self, keys: list[str], cache_absent: bool = False) -> list[Optional[bytes]]:
+        # один MGET на все ключи, которых нет в L1;
+        # cache_absent - запомнить в L1 и отсутствие ключа (для счётчиков версий)
+        values: dict[str, Optional[bytes]] = {}
+        remote_keys = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is _ABSENT or (value is None and not cache_absent):
+                remote_keys.append(key)
+            else:
+                self._count(key, "l1_hits")
+                values[key] = value
+
+        if remote_keys:
+            for key, value in zip(remote_keys, await self.redis.mget(remote_keys)):
+                self._count(key, "misses" if value is None else "l2_hits")
+                if value is not None or cache_absent:
+                    self.local.set(key, value)
+                values[key] = value
+
+        return [values[key] for key in keys]
+
+    async def set(self, key: str, value: bytes, expire: Optional[int] = None) -> None:
+        await self.remote.set(key, value, expire)
+        self.local.set(key, value, expire)
+
+    async def set_many(self, items: dict[str, bytes], expire: Optional[int] = None) -> None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(key, value, ex=expire)
+            await pipe.execute()
+        for key, value in items.items():
+            self.local.set(key, value, expire)
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        # сброс по namespace в redis выполняет RedisBackend, в L1 проще очистить всё
+        count = await self.remote.clear(namespace, key)
+        self.local.clear()
+        await self.redis.publish(INVALIDATION_CHANNEL, json.dumps({"all": True}))
+        return count
+
+    async def invalidate(self, keys: list[str]):
+        for key in keys:
+            self.local.delete(key)
+        await self.redis.publish(INVALIDATION_CHANNEL, json.dumps({"keys": keys}))
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        report = {}
+        for namespace, counters in sorted(self._stats.items()):
+            total = counters["l1_hits"] + counters["l2_hits"] + counters["misses"]
+            report[namespace] = {
+                **counters,
+                "l1_hit_ratio": counters["l1_hits"] / total if total else 0.0,
+                "hit_ratio": (counters["l1_hits"] + counters["l2_hits"]) / total if total else 0.0,
+            }
+        return report
+
+    def _count(self, key: str, counter: str):
+        namespace = key_namespace(key)
+        counters = self._stats.setdefault(namespace, {"l1_hits": 0, "l2_hits": 0, "misses": 0})
+        counters[counter] += 1
+        CACHE_TIER_LOOKUPS.labels(namespace=namespace, tier=counter).inc()
+
+    async def start(self):
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def _listen(self):
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # сообщения, пропущенные без подписки, не восстановить
+                self.local.clear()
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    payload = json.loads(message["data"])
+                    if payload.get("all"):
+                        self.local.clear()
+                    for key in payload.get("keys", []):
+                        self.local.delete(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Cache invalidation listener failed, resubscribing")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
@@ -0,0 +1,47 @@
+import argparse
+import asyncio
+
+import redis.asyncio as redis
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.redis import RedisBackend
+
+from app.config.settings_config import settings
+from app.services.cart_repricing import reprice_carts
+from app.services.cart_store import redis_cart_store
+from app.utils.two_tier_cache import LocalCache, TwoTierBackend
+
+
+async def main(product_ids: list[int] | None, chunk_size: int):
+    redis_conn = redis.from_url(settings.REDIS_DSN)
+
+    # тот же кэш и префикс, что и в приложении: версии корзин меняются после пересчёта
+    FastAPICache.init(
+        TwoTierBackend(
+            RedisBackend(redis_conn),
+            LocalCache(
+                max_entries=settings.CACHE_L1_MAX_ENTRIES,
+                max_bytes=settings.CACHE_L1_MAX_BYTES,
+                ttl=settings.CACHE_L1_TTL,
+            ),
+        ),
+        prefix="shop-cache",
+    )
+
+    # корзины в redis пересчитываются скриптами хранилища, остановка записывает их в БД
+    if settings.CART_STORE == "redis":
+        await redis_cart_store.start(redis_conn)
+    repriced = await reprice_carts(product_ids, chunk_size)
+    if settings.CART_STORE == "redis":
+        await redis_cart_store.stop()
+    await redis_conn.close()
+
+    print(f"✅ Пересчитано корзин: {repriced}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Пересчёт цен в корзинах по текущим ценам товаров")
+    parser.add_argument("--product-id", type=int, action="append", dest="product_ids", help="только эти товары (по умолчанию все)")
+    parser.add_argument("--chunk-size", type=int, default=settings.CART_REPRICE_CHUNK)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.product_ids, args.chunk_size))
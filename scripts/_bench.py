@@ -0,0 +1,99 @@
+import statistics
+import time
+from contextlib import asynccontextmanager
+
+import redis.asyncio as redis
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.redis import RedisBackend
+from sqlalchemy import text
+
+from app.config.settings_config import settings
+from app.db.database import engine
+from app.utils.two_tier_cache import LocalCache, TwoTierBackend
+
+
+@asynccontextmanager
+async def app_cache():
+    # тот же кэш и префикс, что и в приложении
+    redis_conn = redis.from_url(settings.REDIS_DSN)
+    backend = TwoTierBackend(
+        RedisBackend(redis_conn),
+        LocalCache(
+            max_entries=settings.CACHE_L1_MAX_ENTRIES,
+            max_bytes=settings.CACHE_L1_MAX_BYTES,
+            ttl=settings.CACHE_L1_TTL,
+        ),
+    )
+    FastAPICache.init(backend, prefix="shop-cache")
+    try:
+        yield backend
+    finally:
+        await redis_conn.close()
+
+
+class Timings:
+    """длительности вызовов в мс и их перцентили для отчёта"""
+
+    def __init__(self):
+        self.samples: list[float] = []
+
+    @asynccontextmanager
+    async def measure(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples.append((time.perf_counter() - started) * 1000)
+
+    def report(self, name: str) -> str:
+        if not self.samples:
+            return f"{name}: нет замеров"
+        samples = sorted(self.samples)
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return (
+            f"{name}: n={len(samples)} p50={statistics.median(samples):.2f} мс "
+            f"p95={p95:.2f} мс max={samples[-1]:.2f} мс"
+        )
+
+
+@asynccontextmanager
+async def bench_catalog(tag: str, products: int):
+    """
+    категория tag с products товарами, созданными одним INSERT ... SELECT;
+    каждый 100-й товар в описании содержит «норковая шуба». Удаляется после прогона
+    """
+    async with engine.begin() as conn:
+        size_id = (await conn.execute(text("INSERT INTO sizes (name) VALUES (:tag) RETURNING id"), {"tag": tag})).scalar_one()
+        category_id = (
+            await conn.execute(text("INSERT INTO categories (name) VALUES (:tag) RETURNING id"), {"tag": tag})
+        ).scalar_one()
+        await conn.execute(
+            text(
+                "INSERT INTO products (name, description, image, price, size_id) "
+                "SELECT :tag || ' ' || i, "
+                "CASE WHEN i % 100 = 0 THEN 'норковая шуба' ELSE 'пальто из шерсти' END, '', "
+                "(i::bigint * 7919) % 100000 + 0.99, :size_id "
+                "FROM generate_series(1, :products) i"
+            ),
+            {"tag": tag, "size_id": size_id, "products": products},
+        )
+    # без свежей статистики проверки внешнего ключа связей планируются сканированием products
+    async with engine.begin() as conn:
+        await conn.execute(text("ANALYZE products"))
+    async with engine.begin() as conn:
+        await conn.execute(
+            text(
+                "INSERT INTO product_category (product_id, category_id) "
+                "SELECT id, :category_id FROM products WHERE size_id = :size_id"
+            ),
+            {"category_id": category_id, "size_id": size_id},
+        )
+        await conn.execute(text("ANALYZE product_category"))
+    try:
+        yield category_id
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text("DELETE FROM product_category WHERE category_id = :id"), {"id": category_id})
+            await conn.execute(text("DELETE FROM products WHERE size_id = :id"), {"id": size_id})
+            await conn.execute(text("DELETE FROM categories WHERE id = :id"), {"id": category_id})
+            await conn.execute(text("DELETE FROM sizes WHERE id = :id"), {"id": size_id})
@@ -0,0 +1,95 @@
+"""
+Пропускная способность попаданий в кэш листинга через FastAPI: готовое json-тело
+(raw_response=True, роутер отдаёт его через cached_response) против декодирования в PaginatedProducts, повторной валидации
+по response_model и кодирования ответа.
+
+    python -m scripts.bench_cache_hits --items 20 --requests 2000
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from app.pydantic_models import PaginatedProducts, PaginationMeta, ProductOut
+from app.utils.cache_utils import cache, cached_response
+from scripts._bench import Timings, app_cache
+
+
+class ListingService:
+    def __init__(self, items: int):
+        self.items = items
+
+    def _page(self, page: int) -> PaginatedProducts:
+        return PaginatedProducts(
+            items=[
+                ProductOut(
+                    id=page * self.items + i,
+                    name=f"Шуба {i}",
+                    description="Норковая шуба в пол, " * 5,
+                    image=f"images/{i}.jpg",
+                    price=19999.99 + i,
+                    size="M",
+                    categories=["Меха", "Шубы"],
+                )
+                for i in range(self.items)
+            ],
+            meta=PaginationMeta(limit=self.items, offset=page * self.items, has_next=True),
+        )
+
+    @cache(expire=600, namespace="bench_cache_hits_raw", raw_response=True)
+    async def get_raw(self, page: int) -> PaginatedProducts:
+        return self._page(page)
+
+    @cache(expire=600, namespace="bench_cache_hits_model")
+    async def get_model(self, page: int) -> PaginatedProducts:
+        return self._page(page)
+
+
+def build_app(service: ListingService) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/raw", response_model=PaginatedProducts)
+    async def raw(page: int = 0):
+        return await cached_response(service.get_raw, page)
+
+    @app.get("/model", response_model=PaginatedProducts)
+    async def model(page: int = 0):
+        return await service.get_model(page)
+
+    return app
+
+
+async def run(client: httpx.AsyncClient, path: str, requests: int) -> tuple[Timings, float]:
+    await client.get(path)  # промах, значение попадает в кэш
+    timings = Timings()
+    started = time.perf_counter()
+    for _ in range(requests):
+        async with timings.measure():
+            response = await client.get(path)
+        response.raise_for_status()
+    return timings, requests / (time.perf_counter() - started)
+
+
+async def main(items: int, requests: int):
+    async with app_cache():
+        app = build_app(ListingService(items))
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            raw_body = (await client.get("/raw")).content
+            model_body = (await client.get("/model")).content
+            assert raw_body == model_body, "ответы двух режимов различаются"
+
+            for path in ("/model", "/raw"):
+                timings, rps = await run(client, path, requests)
+                print(f"{timings.report(path)} ~{rps:.0f} запросов/с")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Попадания в кэш листинга: готовые байты против моделей")
+    parser.add_argument("--items", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.items, args.requests))
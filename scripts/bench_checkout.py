@@ -0,0 +1,102 @@
+"""
+Нагрузка на оформление заказов с общими «горячими» товарами: покупатели одновременно
+оформляют корзины из одних и тех же товаров, добавленных в разном порядке.
+Считаются оформленные заказы, отказы 409 и ошибки (в том числе deadlock), выводятся задержки.
+Создаёт собственных пользователей и товары и удаляет их после прогона.
+
+    python -m scripts.bench_checkout --buyers 40 --hot 3 --stock 30 --filler 20000
+"""
+import argparse
+import asyncio
+import uuid
+from collections import Counter
+
+from fastapi import BackgroundTasks, HTTPException
+from sqlalchemy import delete, select, text
+
+from app.db.database import async_session_maker, engine
+from app.db.models import Cart, CartItem, Order, OrderItem, Product, Size, User
+from app.repositories.cart_repository import CartRepository
+from app.repositories.order_repository import OrderRepository
+from app.services.order_service import OrderService
+from scripts._bench import Timings, app_cache
+
+
+async def prepare(tag: str, buyers: int, hot: int, stock: int, filler: int) -> tuple[list[User], list[int], int]:
+    async with async_session_maker() as session:
+        size = Size(name=tag)
+        products = [
+            Product(name=f"{tag}-{i}", description="", image="", price=100, stock=stock, size=size)
+            for i in range(hot)
+        ]
+        users = [User(username=f"{tag}-{i}", email=f"{tag}-{i}@example.com", password="x") for i in range(buyers)]
+        # без остального каталога планировщик перебирает товары целиком, а не по позициям корзины
+        products += [Product(name=f"{tag}-filler", description="", image="", price=1, size=size) for _ in range(filler)]
+        session.add_all(products + users)
+        await session.commit()
+        await session.execute(text("ANALYZE products"))
+
+        repo = CartRepository(session)
+        for i, user in enumerate(users):
+            # разный порядок позиций в корзинах - разный порядок строк товаров в запросах
+            for product in products[:hot] if i % 2 else reversed(products[:hot]):
+                await repo.upsert_item(user.id, product.id, 1)
+        await repo.commit()
+        return users, [product.id for product in products[:hot]], size.id
+
+
+async def cleanup(users: list[User], size_id: int):
+    user_ids = [user.id for user in users]
+    async with async_session_maker() as session:
+        order_ids = select(Order.id).where(Order.user_id.in_(user_ids))
+        cart_ids = select(Cart.id).where(Cart.user_id.in_(user_ids))
+        await session.execute(delete(OrderItem).where(OrderItem.order_id.in_(order_ids)))
+        await session.execute(delete(Order).where(Order.user_id.in_(user_ids)))
+        await session.execute(delete(CartItem).where(CartItem.cart_id.in_(cart_ids)))
+        await session.execute(delete(Cart).where(Cart.user_id.in_(user_ids)))
+        await session.execute(delete(User).where(User.id.in_(user_ids)))
+        await session.execute(delete(Product).where(Product.size_id == size_id))
+        await session.execute(delete(Size).where(Size.id == size_id))
+        await session.commit()
+
+
+async def checkout(user: User, timings: Timings) -> str:
+    async with async_session_maker() as session, timings.measure():
+        service = OrderService(OrderRepository(session), CartRepository(session))
+        try:
+            await service.create_order(user, BackgroundTasks())
+            return "ok"
+        except HTTPException as e:
+            return str(e.status_code)
+        except Exception as e:
+            await session.rollback()
+            # ошибка драйвера, например DeadlockDetectedError
+            return type(getattr(e, "orig", e).__cause__ or e).__name__
+
+
+async def main(buyers: int, hot: int, stock: int, filler: int):
+    tag = f"bench-{uuid.uuid4().hex[:8]}"
+    async with app_cache():
+        users, product_ids, size_id = await prepare(tag, buyers, hot, stock, filler)
+        try:
+            timings = Timings()
+            results = Counter(await asyncio.gather(*(checkout(user, timings) for user in users)))
+            async with async_session_maker() as session:
+                stocks = (await session.execute(select(Product.stock).where(Product.id.in_(product_ids)))).scalars().all()
+        finally:
+            await cleanup(users, size_id)
+    await engine.dispose()
+
+    print(timings.report("checkout"))
+    print(f"результаты: {dict(results)}; остатки: {sorted(stocks)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Оформление заказов с общими товарами")
+    parser.add_argument("--buyers", type=int, default=40)
+    parser.add_argument("--hot", type=int, default=3, help="товаров в каждой корзине")
+    parser.add_argument("--stock", type=int, default=30)
+    parser.add_argument("--filler", type=int, default=20000, help="прочих товаров в каталоге")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.buyers, args.hot, args.stock, args.filler))
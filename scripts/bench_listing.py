@@ -0,0 +1,55 @@
+"""
+Глубина страницы листинга: первая и далёкая страница категории через offset и через курсор.
+С курсором далёкая страница ищется по индексу и стоит столько же, сколько первая.
+
+    python -m scripts.bench_listing --products 20000 --page 500 --limit 20
+"""
+import argparse
+import asyncio
+import uuid
+
+from app.db.database import async_session_maker, engine
+from app.repositories.product_repository import ProductRepository
+from scripts._bench import Timings, bench_catalog
+
+SORTS = [None, "price_asc", "price_desc"]
+
+
+async def page_key(repo: ProductRepository, category_id: int, sort: str | None, offset: int) -> tuple:
+    # ключ последней строки предыдущей страницы - то, что клиент передал бы в cursor
+    rows, _ = await repo.get_filtered(category_id, False, None, None, sort, 1, offset - 1)
+    return (rows[0].id,) if sort is None else (rows[0].price, rows[0].id)
+
+
+async def main(products: int, page: int, limit: int, repeat: int):
+    tag = f"bench-{uuid.uuid4().hex[:8]}"
+    offset = (page - 1) * limit
+    async with bench_catalog(tag, products) as category_id:
+        async with async_session_maker() as session:
+            repo = ProductRepository(session)
+            for sort in SORTS:
+                after = await page_key(repo, category_id, sort, offset)
+                first, deep_offset, deep_cursor = Timings(), Timings(), Timings()
+                for _ in range(repeat):
+                    async with first.measure():
+                        await repo.get_filtered(category_id, False, None, None, sort, limit, 0)
+                    async with deep_offset.measure():
+                        await repo.get_filtered(category_id, False, None, None, sort, limit, offset)
+                    async with deep_cursor.measure():
+                        await repo.get_filtered(category_id, False, None, None, sort, limit, 0, after)
+                print(f"sort={sort or 'id'}")
+                print("  " + first.report("страница 1"))
+                print("  " + deep_offset.report(f"страница {page}, offset"))
+                print("  " + deep_cursor.report(f"страница {page}, cursor"))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Листинг категории: первая и далёкая страница")
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--page", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.products, args.page, args.limit, args.repeat))
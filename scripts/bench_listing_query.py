@@ -0,0 +1,66 @@
+"""
+Страница листинга одним запросом (ProductRepository.get_filtered) против прежней схемы
+в два запроса: id страницы, затем товары с joinedload категорий и размера,
+удаление дублей и восстановление порядка в Python.
+
+    python -m scripts.bench_listing_query --products 20000 --limit 20
+"""
+import argparse
+import asyncio
+import uuid
+
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from app.db.database import async_session_maker, engine
+from app.db.models import Product
+from app.repositories.product_repository import ProductRepository
+from scripts._bench import Timings, bench_catalog
+
+
+async def two_round_trips(session, category_id: int, limit: int, offset: int) -> list[Product]:
+    ids = (
+        await session.execute(
+            select(Product.id)
+            .where(ProductRepository._in_category(category_id, False))
+            .order_by(Product.price.asc(), Product.id.asc())
+            .limit(limit + 1)
+            .offset(offset)
+        )
+    ).scalars().all()[:limit]
+    products = (
+        await session.execute(
+            select(Product).where(Product.id.in_(ids)).options(joinedload(Product.categories), joinedload(Product.size))
+        )
+    ).unique().scalars().all()
+    by_id = {product.id: product for product in products}
+    return [by_id[product_id] for product_id in ids]
+
+
+async def main(products: int, limit: int, pages: int, repeat: int):
+    tag = f"bench-{uuid.uuid4().hex[:8]}"
+    async with bench_catalog(tag, products) as category_id:
+        single, double = Timings(), Timings()
+        for _ in range(repeat):
+            for page in range(pages):
+                # новая сессия на запрос, как у запроса к API: без попаданий в identity map
+                async with async_session_maker() as session, single.measure():
+                    await ProductRepository(session).get_filtered(
+                        category_id, False, None, None, "price_asc", limit, page * limit
+                    )
+                async with async_session_maker() as session, double.measure():
+                    await two_round_trips(session, category_id, limit, page * limit)
+        print(single.report("один запрос"))
+        print(double.report("два запроса + joinedload"))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Страница листинга: один запрос против двух")
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.products, args.limit, args.pages, args.repeat))
@@ -0,0 +1,65 @@
+"""
+Полнотекстовый поиск по большому каталогу: поиск по GIN-индексу search_vector
+(ранжируются не более SEARCH_MAX_MATCHES совпадений) против сканирования name/description через ILIKE.
+
+    python -m scripts.bench_search --products 1000000
+"""
+import argparse
+import asyncio
+import uuid
+
+from sqlalchemy import func, or_, select
+
+from app.config.settings_config import settings
+from app.db.database import async_session_maker, engine
+from app.db.models import Product
+from app.repositories.product_repository import ProductRepository
+from scripts._bench import Timings, bench_catalog
+
+QUERIES = ["норковая шуба", "шерсть"]
+
+
+async def main(products: int, limit: int, repeat: int):
+    tag = f"bench-{uuid.uuid4().hex[:8]}"
+    async with bench_catalog(tag, products):
+        async with async_session_maker() as session:
+            repo = ProductRepository(session)
+            for query in QUERIES:
+                search, search_next, ilike = Timings(), Timings(), Timings()
+                first, _ = await repo.search(query, None, None, limit, None, settings.SEARCH_MAX_MATCHES)
+                after = (first[-1].rank, first[-1].id)
+                for _ in range(repeat):
+                    async with search.measure():
+                        await repo.search(query, None, None, limit, None, settings.SEARCH_MAX_MATCHES)
+                    async with search_next.measure():
+                        await repo.search(query, None, None, limit, after, settings.SEARCH_MAX_MATCHES)
+                    async with ilike.measure():
+                        pattern = f"%{query.split()[0]}%"
+                        await session.execute(
+                            select(Product.id)
+                            .where(or_(Product.name.ilike(pattern), Product.description.ilike(pattern)))
+                            .order_by(Product.id)
+                            .limit(limit)
+                        )
+                total = (
+                    await session.execute(
+                        select(func.count()).where(
+                            Product.search_vector.op("@@")(func.websearch_to_tsquery("russian", query))
+                        )
+                    )
+                ).scalar_one()
+                print(f"q={query!r}, найдено {total}")
+                print("  " + search.report("search, страница 1"))
+                print("  " + search_next.report("search, страница 2"))
+                print("  " + ilike.report("ILIKE"))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Полнотекстовый поиск по каталогу")
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.products, args.limit, args.repeat))
@@ -1,18 +1,31 @@
 import asyncio
 import random
+from pathlib import Path
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+import redis.asyncio as redis
+from alembic import command
+from alembic.config import Config
 
-from app.db.database import async_session_maker, engine, Base
+from app.db.database import async_session_maker
 from app.db.models import Category, Size, Product, User
 from app.utils.security import get_password_hash  # ✅ заменили путь
+from app.services.category_tree import publish_categories_changed
+from app.config.settings_config import settings
 
 
-async def seed():
-    async with engine.begin() as conn:
-        # Создадим таблицы, если их нет
-        await conn.run_sync(Base.metadata.create_all)
+ROOT = Path(__file__).resolve().parent
+
+
+def migrate():
+    # схема создаётся миграциями: create_all не создаёт триггеры category_closure,
+    # и без них замыкание осталось бы пустым, а include_descendants ничего не находил бы
+    config = Config(str(ROOT / "alembic.ini"))
+    config.set_main_option("script_location", str(ROOT / "app" / "migration"))
+    command.upgrade(config, "head")
 
+
+async def seed():
     async with async_session_maker() as session:  # type: AsyncSession
         # Проверим, есть ли данные
         result = await session.execute(select(Category))
@@ -71,8 +84,8 @@ async def seed():
                 size=random.choice(sizes),
             )
 
-            # Добавляем категории: родительская и дочерняя
-            product.categories.append(parent)
+            # Товар привязывается только к дочерней категории,
+            # в родительской он виден через include_descendants
             product.categories.append(child)
 
             products.append(product)
@@ -82,6 +95,12 @@ async def seed():
 
         print("✅ База успешно заполнена тестовыми данными!")
 
+    # запущенные воркеры перечитают дерево категорий
+    redis_conn = redis.from_url(settings.REDIS_DSN)
+    await publish_categories_changed(redis_conn)
+    await redis_conn.close()
+
 
 if __name__ == "__main__":
+    migrate()
     asyncio.run(seed())
\ No newline at end of file
@@ -0,0 +1,118 @@
+import os
+
+import pytest
+import pytest_asyncio
+from fakeredis import FakeAsyncRedis
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.redis import RedisBackend
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+# тесты с БД запускаются на отдельной базе: TEST_DATABASE_URL=postgresql+asyncpg://.../shop_test
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+# настройки приложения обязательны при импорте, для тестов хватает заглушек
+os.environ.setdefault("DATABASE_URL", TEST_DATABASE_URL or "postgresql+asyncpg://postgres@localhost/shop_test")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("SMTP_HOST", "localhost")
+os.environ.setdefault("SMTP_PORT", "1025")
+os.environ.setdefault("SMTP_USER", "test")
+os.environ.setdefault("SMTP_PASSWORD", "test")
+os.environ.setdefault("EMAILS_FROM_EMAIL", "shop@example.com")
+os.environ.setdefault("YANDEX_CLIENT_ID", "test")
+os.environ.setdefault("YANDEX_CLIENT_SECRET", "test")
+os.environ.setdefault("YANDEX_REDIRECT_URI", "http://localhost/auth/yandex/callback")
+os.environ.setdefault("REDIS_DSN", "redis://localhost:6379/0")
+
+from app.db.database import Base  # noqa: E402
+from app.db.models import Cart, CartItem, Product, Size, User  # noqa: E402
+from app.utils.two_tier_cache import LocalCache, TwoTierBackend  # noqa: E402
+
+requires_db = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+
+@pytest_asyncio.fixture
+async def redis_conn():
+    # промахи кэша до single-flight идут в redis одновременно, пул по умолчанию (100) для них мал
+    redis_conn = FakeAsyncRedis(max_connections=1000)
+    yield redis_conn
+    await redis_conn.aclose()
+
+
+@pytest_asyncio.fixture
+async def cache_backend(redis_conn):
+    # тот же кэш, что в приложении, поверх fakeredis
+    backend = TwoTierBackend(RedisBackend(redis_conn), LocalCache(max_entries=1000, max_bytes=1024 * 1024, ttl=5.0))
+    FastAPICache.init(backend, prefix="shop-cache")
+    yield backend
+    FastAPICache.reset()
+
+
+@pytest_asyncio.fixture
+async def engine():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = create_async_engine(TEST_DATABASE_URL, poolclass=NullPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    await engine.dispose()
+
+
+@pytest_asyncio.fixture
+async def session_maker(engine):
+    return async_sessionmaker(engine, expire_on_commit=False)
+
+
+@pytest_asyncio.fixture
+async def session(session_maker):
+    async with session_maker() as session:
+        yield session
+
+
+@pytest_asyncio.fixture
+async def user(session):
+    user = User(username="buyer", email="buyer@example.com", password="x", role="user")
+    session.add(user)
+    await session.commit()
+    return user
+
+
+@pytest_asyncio.fixture
+async def products(session):
+    size = Size(name="M")
+    products = [
+        Product(name=f"Товар {i}", description="", image="", price=price, stock=stock, size=size)
+        for i, (price, stock) in enumerate([(100, None), (60, 5), (1999.99, 10), (250, 5)], start=1)
+    ]
+    session.add_all(products)
+    await session.commit()
+    return products
+
+
+async def cart_state(session, user_id: int) -> tuple:
+    # итоги корзины и суммы по её позициям
+    cart = (await session.execute(select(Cart).where(Cart.user_id == user_id))).scalar_one()
+    await session.refresh(cart)
+    sums = (
+        await session.execute(
+            select(func.coalesce(func.sum(CartItem.quantity), 0), func.coalesce(func.sum(CartItem.price), 0))
+            .where(CartItem.cart_id == cart.id)
+        )
+    ).one()
+    return (cart.total_quantity, cart.total_price), tuple(sums)
+
+
+@pytest_asyncio.fixture
+async def cart_store(engine, redis_conn):
+    # хранилище работает с БД через async_session_maker приложения
+    from app.db.database import engine as app_engine
+    from app.services.cart_store import RedisCartStore
+
+    store = RedisCartStore()
+    await store.start(redis_conn)
+    yield store
+    await store.stop()
+    await app_engine.dispose()
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+from pydantic import BaseModel
+
+from app.utils.cache_utils import cache, cached_response
+
+
+class Item(BaseModel):
+    id: int
+    name: str
+
+
+class SlowService:
+    def __init__(self):
+        self.calls = 0
+
+    @cache(expire=60, namespace="test_item")
+    async def get_item(self, item_id: int) -> Item:
+        self.calls += 1
+        await asyncio.sleep(0.1)
+        return Item(id=item_id, name=f"item {item_id}")
+
+    @cache(expire=60, namespace="test_item_raw", raw_response=True)
+    async def get_item_raw(self, item_id: int) -> Item:
+        self.calls += 1
+        await asyncio.sleep(0.1)
+        return Item(id=item_id, name=f"item {item_id}")
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_compute_once(cache_backend):
+    service = SlowService()
+
+    results = await asyncio.gather(*(service.get_item(1) for _ in range(500)))
+
+    assert service.calls == 1
+    assert all(result == Item(id=1, name="item 1") for result in results)
+    # следующий вызов - попадание в кэш
+    assert Item.model_validate(await service.get_item(1)) == results[0]
+    assert service.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_raw_misses_compute_once(cache_backend):
+    service = SlowService()
+
+    responses = await asyncio.gather(*(cached_response(service.get_item_raw, 1) for _ in range(500)))
+
+    assert service.calls == 1
+    assert len({response.body for response in responses}) == 1
+    assert len({response.headers["ETag"] for response in responses}) == 1
+
+
+@pytest.mark.asyncio
+async def test_raw_response_method_returns_model(cache_backend):
+    service = SlowService()
+
+    # сервис возвращает модель и при промахе, и при попадании; готовое тело получает только роутер
+    assert await service.get_item_raw(3) == Item(id=3, name="item 3")
+    assert await service.get_item_raw(3) == Item(id=3, name="item 3")
+    response = await cached_response(service.get_item_raw, 3)
+    assert response.body == b'{"id":3,"name":"item 3"}'
+    assert service.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_cancel_computation(cache_backend):
+    service = SlowService()
+
+    first = asyncio.create_task(service.get_item(2))
+    await asyncio.sleep(0.01)
+    second = asyncio.create_task(service.get_item(2))
+    await asyncio.sleep(0.01)
+    first.cancel()
+
+    assert await second == Item(id=2, name="item 2")
+    assert service.calls == 1
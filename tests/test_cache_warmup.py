@@ -0,0 +1,27 @@
+import pytest
+
+from app.db.models import Category, Product, Size
+from app.services.cache_warmup import WARMUP_SORTS, warm_up_cache
+
+
+@pytest.mark.asyncio
+async def test_warmup_counts_only_filled_keys(engine, session, cache_backend):
+    from app.db.database import engine as app_engine
+
+    size = Size(name="M")
+    category = Category(name="Шубы")
+    session.add_all(
+        Product(name=f"Шуба {i}", description="", image="", price=100 + i, size=size, categories=[category])
+        for i in range(25)
+    )
+    await session.commit()
+
+    # 25 товаров по 10: первая страница и ещё по две страницы через offset и через курсор
+    first = await warm_up_cache(pages=3, limit=10, concurrency=2)
+    second = await warm_up_cache(pages=3, limit=10, concurrency=2)
+    await app_engine.dispose()
+
+    assert first.listings == second.listings == len(WARMUP_SORTS)
+    assert first.keys == 5 * len(WARMUP_SORTS)
+    # всё уже в кэше: повторный прогрев ничего не записал
+    assert second.keys == 0
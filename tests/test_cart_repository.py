@@ -0,0 +1,113 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import update
+
+from app.db.models import Product
+from app.repositories.cart_repository import CartRepository
+from tests.conftest import cart_state
+
+
+@pytest.mark.asyncio
+async def test_upsert_item_readd_keeps_totals(session, user, products):
+    repo = CartRepository(session)
+    first, second = products[0], products[1]
+
+    await repo.upsert_item(user.id, first.id, 2)
+    await repo.upsert_item(user.id, second.id, 1)
+    await repo.commit()
+    # повторное добавление того же товара увеличивает позицию и сдвигает итоги на разницу
+    item = await repo.upsert_item(user.id, first.id, 3)
+    await repo.commit()
+
+    assert item.quantity == 5
+    assert item.price == Decimal(500)
+    totals, sums = await cart_state(session, user.id)
+    assert totals == sums == (6, Decimal(560))
+
+
+@pytest.mark.asyncio
+async def test_upsert_item_missing_product(session, user):
+    repo = CartRepository(session)
+    assert await repo.upsert_item(user.id, 999, 1) is None
+
+
+@pytest.mark.asyncio
+async def test_upsert_item_concurrent_readd_keeps_totals(session_maker, session, user, products):
+    async def add(product_id):
+        async with session_maker() as s:
+            repo = CartRepository(s)
+            await repo.upsert_item(user.id, product_id, 1)
+            await repo.commit()
+
+    await asyncio.gather(*(add(products[i % 2].id) for i in range(20)))
+
+    totals, sums = await cart_state(session, user.id)
+    assert totals == sums == (20, Decimal(1600))
+
+
+@pytest.mark.asyncio
+async def test_set_quantities_mixed_batch_keeps_totals(session, user, products):
+    repo = CartRepository(session)
+    first, second, third, fourth = products
+
+    await repo.upsert_item(user.id, first.id, 2)
+    await repo.upsert_item(user.id, second.id, 4)
+    await repo.commit()
+    cart_id = await repo.get_or_create_cart_id(user.id)
+    # обновление, удаление и вставка в одном списке
+    await repo.set_quantities(cart_id, [(first.id, 1), (second.id, 0), (fourth.id, 2)])
+    await repo.commit()
+
+    totals, sums = await cart_state(session, user.id)
+    assert totals == sums == (3, Decimal(600))
+    rows = await repo.get_cart_rows(cart_id)
+    assert {(row.product_id, row.quantity) for row in rows} == {(first.id, 1), (fourth.id, 2)}
+
+
+@pytest.mark.asyncio
+async def test_set_quantities_waits_for_concurrent_add(session_maker, session, user, products):
+    first, second = products[0], products[1]
+    repo = CartRepository(session)
+    await repo.upsert_item(user.id, second.id, 1)
+    await repo.commit()
+    cart_id = await repo.get_or_create_cart_id(user.id)
+    await repo.commit()
+
+    async def bulk():
+        async with session_maker() as s:
+            bulk_repo = CartRepository(s)
+            await bulk_repo.set_quantities(cart_id, [(first.id, 3)])
+            await bulk_repo.commit()
+
+    async with session_maker() as other:
+        # позиция того же товара добавлена, но ещё не закоммичена
+        await CartRepository(other).upsert_item(user.id, first.id, 1)
+        task = asyncio.create_task(bulk())
+        await asyncio.sleep(0.3)
+        await other.commit()
+    await task
+
+    # списочное изменение учло добавленную позицию как прежнюю
+    totals, sums = await cart_state(session, user.id)
+    assert totals == sums == (4, Decimal(360))
+
+
+@pytest.mark.asyncio
+async def test_reprice_chunk_updates_lines_and_totals(session, user, products):
+    repo = CartRepository(session)
+    first, second = products[0], products[1]
+    await repo.upsert_item(user.id, first.id, 2)
+    await repo.upsert_item(user.id, second.id, 1)
+    await repo.commit()
+    await session.execute(update(Product).where(Product.id == first.id).values(price=150))
+    await session.commit()
+
+    assert await repo.reprice_chunk(0, 1000) == [user.id]
+    # повторный проход ничего не меняет
+    assert await repo.reprice_chunk(0, 1000) == []
+    await repo.commit()
+
+    totals, sums = await cart_state(session, user.id)
+    assert totals == sums == (3, Decimal(360))
@@ -0,0 +1,59 @@
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event
+
+from app.pydantic_models import CartBulkUpdate, CartItem as CartItemIn, CartOut
+from app.repositories.cart_repository import CartRepository
+from app.repositories.product_repository import ProductRepository
+from app.services.cart_service import CartService, RedisCartService
+
+
+@pytest.mark.asyncio
+async def test_both_stores_return_cart_out(session, cart_store, cache_backend, user, products):
+    sql_service = CartService(CartRepository(session), ProductRepository(session))
+    redis_service = RedisCartService(cart_store, ProductRepository(session))
+
+    added = await sql_service.add_to_cart(user, CartItemIn(product_id=products[0].id, quantity=2))
+    # промах и попадание в кэш снимка дают одну и ту же модель
+    miss = await sql_service.get_cart(user)
+    hit = await sql_service.get_cart(user)
+    from_redis = await redis_service.get_cart(user)
+
+    assert all(isinstance(cart, CartOut) for cart in (miss, hit, from_redis))
+    assert miss == hit == from_redis == added
+
+
+@pytest.mark.asyncio
+async def test_add_to_cart_takes_two_statements(engine, session, cache_backend, user, products):
+    service = CartService(CartRepository(session), ProductRepository(session))
+    await service.add_to_cart(user, CartItemIn(product_id=products[1].id, quantity=1))
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)  # noqa: E731
+    event.listen(engine.sync_engine, "before_cursor_execute", listener)
+    try:
+        # и новая позиция, и повторное добавление: upsert и чтение корзины
+        await service.add_to_cart(user, CartItemIn(product_id=products[0].id, quantity=1))
+        await service.add_to_cart(user, CartItemIn(product_id=products[0].id, quantity=2))
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", listener)
+
+    assert len(statements) == 4
+
+
+@pytest.mark.asyncio
+async def test_bulk_update_validates_the_same_in_both_stores(session, cart_store, cache_backend, user, products):
+    services = [
+        CartService(CartRepository(session), ProductRepository(session)),
+        RedisCartService(cart_store, ProductRepository(session)),
+    ]
+    removal = CartBulkUpdate(items=[CartItemIn(product_id=products[0].id, quantity=1), CartItemIn(product_id=999, quantity=0)])
+    addition = CartBulkUpdate(items=[CartItemIn(product_id=999, quantity=1)])
+
+    for service in services:
+        # удаление отсутствующего товара ничего не делает, добавление - 404
+        cart = await service.bulk_update(user, removal)
+        assert [(item.product_id, item.quantity) for item in cart.items] == [(products[0].id, 1)]
+        with pytest.raises(HTTPException) as e:
+            await service.bulk_update(user, addition)
+        assert e.value.status_code == 404
@@ -0,0 +1,136 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+from fastapi import BackgroundTasks, HTTPException
+from sqlalchemy import select
+
+from app.db.models import CartItem, User
+from app.repositories.cart_repository import CartRepository
+from app.repositories.order_repository import OrderRepository
+from app.services.order_service import OrderService
+from tests.conftest import cart_state
+
+
+@pytest.mark.asyncio
+async def test_cart_money_is_exact(cart_store, redis_conn, session, user, products):
+    product = products[2]  # 1999.99
+
+    cart = await cart_store.add_item(user.id, product.id, 3, product.price)
+    cart = await cart_store.add_item(user.id, products[0].id, 1, products[0].price)
+
+    # суммы хранятся целыми копейками, без ошибки округления double
+    fields = await redis_conn.hgetall(cart_store.cart_key(user.id))
+    assert fields[b"total_price"] == b"609997"
+    assert cart.total_price == 6099.97
+    assert [item.price for item in cart.items] == [5999.97, 100]
+
+    await cart_store.flush(user.id)
+    totals, sums = await cart_state(session, user.id)
+    assert totals == sums == (4, Decimal("6099.97"))
+
+
+@pytest.mark.asyncio
+async def test_cart_loaded_from_db_in_minor_units(cart_store, session, user, products):
+    await CartRepository(session).upsert_item(user.id, products[2].id, 2)
+    await session.commit()
+
+    cart = await cart_store.set_quantities(user.id, [(products[2].id, 1, products[2].price)])
+
+    assert cart.total_price == 1999.99
+    assert cart.total_quantity == 1
+
+
+def order_service(session, cart_store):
+    return OrderService(OrderRepository(session), CartRepository(session), cart_store)
+
+
+@pytest.mark.asyncio
+async def test_cart_changes_during_checkout_are_kept(cart_store, session_maker, user, products, cache_backend):
+    first, second = products[0], products[1]
+    await cart_store.add_item(user.id, first.id, 2, first.price)
+
+    async with session_maker() as session:
+        async with cart_store.checkout(user.id):
+            # изменение во время оформления ждёт его окончания
+            adding = asyncio.create_task(cart_store.add_item(user.id, second.id, 1, second.price))
+            await asyncio.sleep(0.3)
+            assert not adding.done()
+            await cart_store.flush_dirty()
+            order = await order_service(session, cart_store)._create_order(user, BackgroundTasks())
+    cart = await adding
+
+    assert [(item.product_id, item.quantity) for item in order.items] == [(first.id, 2)]
+    assert [(item.product_id, item.quantity) for item in cart.items] == [(second.id, 1)]
+    await cart_store.flush(user.id)
+    async with session_maker() as session:
+        totals, sums = await cart_state(session, user.id)
+    assert totals == sums == (1, Decimal(60))
+
+
+@pytest.mark.asyncio
+async def test_rejected_checkout_keeps_cart(cart_store, session_maker, user, products, cache_backend):
+    product = products[1]  # 5 на складе
+    await cart_store.add_item(user.id, product.id, 6, product.price)
+
+    async with session_maker() as session:
+        with pytest.raises(HTTPException) as e:
+            await order_service(session, cart_store).create_order(user, BackgroundTasks())
+    assert e.value.status_code == 409
+
+    cart = await cart_store.get(user.id)
+    assert [(item.product_id, item.quantity) for item in cart.items] == [(product.id, 6)]
+
+
+@pytest.mark.asyncio
+async def test_reprice_updates_carts_in_redis(cart_store, session, user, products):
+    first, second = products[0], products[2]
+    await cart_store.add_item(user.id, first.id, 2, first.price)
+    await cart_store.add_item(user.id, second.id, 1, second.price)
+    await cart_store.flush(user.id)
+
+    # ещё две корзины: с тем же товаром и без изменившихся товаров
+    others = [User(username=f"other{i}", email=f"other{i}@example.com", password="x") for i in range(2)]
+    session.add_all(others)
+    await session.commit()
+    await cart_store.add_item(others[0].id, first.id, 1, first.price)
+    await cart_store.add_item(others[1].id, products[3].id, 1, products[3].price)
+    await cart_store.flush_dirty()
+
+    repriced = await cart_store.reprice({first.id: Decimal("150.5"), products[1].id: Decimal("1")})
+
+    assert sorted(repriced) == [user.id, others[0].id]
+    assert (await cart_store.get(others[0].id)).total_price == 150.5
+    assert (await cart_store.get(others[1].id)).total_price == 250
+    cart = await cart_store.get(user.id)
+    assert cart.total_price == 2300.99
+    assert [item.price for item in cart.items] == [301, 1999.99]
+
+    # изменённая корзина снова записывается в БД
+    await cart_store.flush_dirty()
+    totals, sums = await cart_state(session, user.id)
+    assert totals == sums == (3, Decimal("2300.99"))
+
+    assert await cart_store.reprice({first.id: Decimal("150.5")}) == []
+
+
+@pytest.mark.asyncio
+async def test_item_ids_survive_reload_from_db(cart_store, redis_conn, session, user, products):
+    first, second, third = products[0], products[2], products[3]
+    await cart_store.add_item(user.id, first.id, 1, first.price)
+    cart = await cart_store.add_item(user.id, second.id, 1, second.price)
+    await cart_store.flush(user.id)
+
+    # корзина вытеснена из redis (TTL) и загружается из БД заново: id позиций у клиента прежние
+    await redis_conn.delete(cart_store.cart_key(user.id))
+    reloaded = await cart_store.get(user.id)
+    assert reloaded.items == cart.items
+
+    first_id, second_id = [item.id for item in cart.items]
+    await cart_store.delete_item(user.id, first_id)
+    cart = await cart_store.add_item(user.id, third.id, 2, third.price)
+    await cart_store.flush(user.id)
+
+    rows = (await session.execute(select(CartItem.id, CartItem.product_id).order_by(CartItem.id))).all()
+    assert [tuple(row) for row in rows] == [(item.id, item.product_id) for item in cart.items]
+    assert rows[0].id == second_id
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+from fastapi import BackgroundTasks, HTTPException
+from sqlalchemy import select, text, update
+
+from app.db.models import Order, Product, User
+from app.repositories.cart_repository import CartRepository
+from app.repositories.order_repository import OrderRepository
+from app.services.order_service import OrderService
+
+
+async def make_buyers(session, products, count: int) -> list[User]:
+    # у каждого покупателя в корзине одни и те же товары, но добавленные в разном порядке
+    users = [User(username=f"buyer{i}", email=f"buyer{i}@example.com", password="x") for i in range(count)]
+    session.add_all(users)
+    await session.commit()
+    repo = CartRepository(session)
+    for i, user in enumerate(users):
+        for product in products if i % 2 else reversed(products):
+            await repo.upsert_item(user.id, product.id, 1)
+    await repo.commit()
+    return users
+
+
+async def checkout(session_maker, user) -> int | None:
+    async with session_maker() as session:
+        service = OrderService(OrderRepository(session), CartRepository(session))
+        try:
+            return (await service.create_order(user, BackgroundTasks())).id
+        except HTTPException as e:
+            assert e.status_code == 409
+            return None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_checkouts_share_hot_products(session_maker, session, products, cache_backend):
+    hot = [products[1], products[3]]
+    await session.execute(update(Product).where(Product.id.in_([p.id for p in hot])).values(stock=30))
+    # на большом каталоге товары ищутся по индексу в порядке позиций корзины, как в рабочей базе
+    await session.execute(
+        text(
+            "INSERT INTO products (name, description, image, price, stock, size_id) "
+            "SELECT 'filler', '', '', 1, 1, :size_id FROM generate_series(1, 20000)"
+        ),
+        {"size_id": hot[0].size_id},
+    )
+    await session.commit()
+    await session.execute(text("ANALYZE products"))
+    users = await make_buyers(session, hot, 40)
+
+    results = await asyncio.gather(*(checkout(session_maker, user) for user in users))
+
+    # без взаимных блокировок: каждый заказ либо оформлен, либо отклонён с 409
+    assert len([order_id for order_id in results if order_id]) == 30
+    stocks = (await session.execute(select(Product.stock).where(Product.id.in_([p.id for p in hot])))).scalars().all()
+    assert stocks == [0, 0]
+    assert len((await session.execute(select(Order.id))).all()) == 30
+
+
+@pytest.mark.asyncio
+async def test_reserve_stock_reports_stock_after_concurrent_order(session_maker, session, user, products, cache_backend):
+    product = products[1]
+    await CartRepository(session).upsert_item(user.id, product.id, 3)
+    await session.commit()
+
+    async with session_maker() as other:
+        # параллельный заказ уже списал 3 из 5, но ещё не закоммичен
+        await other.execute(update(Product).where(Product.id == product.id).values(stock=Product.stock - 3))
+        task = asyncio.create_task(checkout_conflicts(session_maker, user))
+        await asyncio.sleep(0.3)
+        await other.commit()
+    conflicts = await task
+
+    assert conflicts == [{"product_id": product.id, "requested": 3, "available": 2}]
+
+
+async def checkout_conflicts(session_maker, user) -> list[dict]:
+    async with session_maker() as session:
+        service = OrderService(OrderRepository(session), CartRepository(session))
+        with pytest.raises(HTTPException) as e:
+            await service.create_order(user, BackgroundTasks())
+    assert e.value.status_code == 409
+    return e.value.detail["items"]
@@ -0,0 +1,270 @@
+"""
+Регрессия планов запросов: на заполненной базе запросы репозиториев прогоняются через
+EXPLAIN, и проверяется, что каждый идёт по своему индексу, а не последовательным
+сканированием большой таблицы.
+"""
+import json
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.repositories.cart_repository import CartRepository
+from app.repositories.order_repository import OrderRepository
+from app.repositories.product_repository import ProductRepository
+from app.repositories.user_repository import UserRepository
+
+# последовательное сканирование таблицы с большей оценкой строк считается регрессией
+SEQ_SCAN_ROWS_THRESHOLD = 1000
+# чанк пересчёта цен (~5000 позиций) сравним с каталогом в 100000 товаров: хеш-соединение по всей
+# таблице товаров дешевле поиска по ключу на каждую позицию, на большом каталоге план переходит на products_pkey
+ALLOWED_SEQ_SCANS = {"cart repricing": {"products"}}
+
+SEED_SQL = [
+    "INSERT INTO sizes (name) SELECT 'size ' || i FROM generate_series(1, 5) i",
+    # 20 корневых категорий и по 10 подкатегорий у каждой
+    "INSERT INTO categories (id, name) SELECT i, 'root ' || i FROM generate_series(1, 20) i",
+    "INSERT INTO categories (id, name, parent_id) SELECT 100 + i, 'child ' || i, 1 + i % 20 FROM generate_series(1, 200) i",
+    "INSERT INTO category_closure (ancestor_id, descendant_id, depth) SELECT id, id, 0 FROM categories",
+    "INSERT INTO category_closure (ancestor_id, descendant_id, depth) SELECT parent_id, id, 1 FROM categories WHERE parent_id IS NOT NULL",
+    """
+    INSERT INTO products (name, description, image, price, stock, size_id)
+    SELECT 'товар ' || i, CASE WHEN i % 500 = 0 THEN 'норковая шуба' ELSE 'пальто из шерсти' END, '',
+           (i * 7919) % 100000 + 0.99, 10, 1 + i % 5
+    FROM generate_series(1, 100000) i
+    """,
+    "INSERT INTO product_category (product_id, category_id) SELECT id, 101 + id % 200 FROM products",
+    "INSERT INTO users (username, email, password, role) SELECT 'user' || i, 'user' || i || '@example.com', '', 'user' FROM generate_series(1, 20000) i",
+    "INSERT INTO carts (user_id, total_price, total_quantity) SELECT id, 0, 0 FROM users",
+    "INSERT INTO cart_items (cart_id, product_id, quantity, price) SELECT c.id, 1 + (c.id * 13 + k * 101) % 100000, 1, 1 FROM carts c, generate_series(1, 5) k",
+    "INSERT INTO orders (user_id, total_price, total_quantity) SELECT 1 + i % 20000, 0, 0 FROM generate_series(1, 40000) i",
+    "INSERT INTO order_items (order_id, product_id, quantity, price) SELECT o.id, 1 + (o.id * 17 + k) % 100000, 1, 1 FROM orders o, generate_series(1, 3) k",
+    "ANALYZE",
+]
+
+
+@pytest_asyncio.fixture
+async def seeded(engine):
+    async with engine.begin() as conn:
+        for statement in SEED_SQL:
+            await conn.execute(text(statement))
+    return engine
+
+
+def plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+async def explain_calls(engine, call) -> list[list[dict]]:
+    """выполняет call(session) и возвращает планы всех запросов, которые он отправил в базу"""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        async with engine.connect() as conn:
+            async with AsyncSession(bind=conn) as session:
+                await call(session)
+                await session.rollback()
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", capture)
+
+    plans = []
+    async with engine.connect() as conn:
+        for statement, parameters in statements:
+            result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters)
+            plan = result.scalar()
+            plans.append(list(plan_nodes((json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"])))
+    return plans
+
+
+QUERIES = {
+    "listing by category": (
+        lambda s: ProductRepository(s).get_filtered(150, False, None, None, None, 20, 0),
+        {"ix_product_category_category_id_product_id"},
+    ),
+    "listing by category, price sort": (
+        lambda s: ProductRepository(s).get_filtered(150, False, None, None, "price_asc", 20, 0),
+        {"ix_product_category_category_id_product_id", "ix_products_price_id"},
+    ),
+    "listing by category, price sort, cursor": (
+        lambda s: ProductRepository(s).get_filtered(150, False, None, None, "price_desc", 20, 0, after=(50000, 500)),
+        {"ix_product_category_category_id_product_id", "ix_products_price_id"},
+    ),
+    "listing by subtree": (
+        lambda s: ProductRepository(s).get_filtered(7, True, None, None, None, 20, 0),
+        # большое поддерево: товары перебираются по id с проверкой категории по первичному ключу связи
+        {"ix_product_category_category_id_product_id", "product_category_pkey"},
+    ),
+    "search": (
+        lambda s: ProductRepository(s).search("норковая шуба", None, None, 20),
+        {"ix_products_search_vector"},
+    ),
+    "facets": (
+        lambda s: ProductRepository(s).get_facets(150, False, [10000, 20000, 30000, 40000]),
+        {"ix_product_category_category_id_product_id"},
+    ),
+    "products by ids": (
+        lambda s: ProductRepository(s).get_products_by_ids(list(range(500, 520))),
+        {"products_pkey"},
+    ),
+    "product card": (
+        lambda s: ProductRepository(s).get_product_joined(500),
+        {"products_pkey"},
+    ),
+    "product": (
+        lambda s: ProductRepository(s).get_product(500),
+        {"products_pkey"},
+    ),
+    "prices": (
+        lambda s: ProductRepository(s).get_prices(list(range(500, 520))),
+        {"products_pkey"},
+    ),
+    "product categories": (
+        lambda s: ProductRepository(s).get_category_ids(list(range(500, 520))),
+        {"product_category_pkey"},
+    ),
+    "price update": (
+        lambda s: ProductRepository(s).update_prices([(500, 10.0), (501, 20.0)]),
+        {"products_pkey"},
+    ),
+    "stock update": (
+        lambda s: ProductRepository(s).update_stock([(500, 10), (501, None)]),
+        {"products_pkey"},
+    ),
+    "cart by user": (
+        lambda s: CartRepository(s).get_cart(1234),
+        {"carts_user_id_key"},
+    ),
+    "cart with items": (
+        lambda s: CartRepository(s).get_cart_with_items(1234),
+        {"carts_user_id_key", "uq_cart_items_cart_id_product_id"},
+    ),
+    "cart items": (
+        lambda s: CartRepository(s).get_items(1234),
+        {"uq_cart_items_cart_id_product_id"},
+    ),
+    "cart rows": (
+        lambda s: CartRepository(s).get_cart_rows(1234),
+        {"uq_cart_items_cart_id_product_id"},
+    ),
+    "cart rows by user": (
+        lambda s: CartRepository(s).get_cart_rows_by_user(1234),
+        {"carts_user_id_key", "uq_cart_items_cart_id_product_id"},
+    ),
+    "cart item by product": (
+        lambda s: CartRepository(s).get_item_by_product(1234, 42),
+        {"uq_cart_items_cart_id_product_id"},
+    ),
+    "cart item by id": (
+        lambda s: CartRepository(s).get_item_by_id(1234, 42),
+        {"cart_items_pkey"},
+    ),
+    "add to cart": (
+        lambda s: CartRepository(s).upsert_item(1234, 42, 1),
+        {"carts_user_id_key", "uq_cart_items_cart_id_product_id"},
+    ),
+    "update cart item": (
+        lambda s: CartRepository(s).update_item(1234, 42, 43, 2, 10),
+        {"cart_items_pkey"},
+    ),
+    "delete cart item": (
+        lambda s: CartRepository(s).delete_item_by_id(1234, 42),
+        {"cart_items_pkey"},
+    ),
+    "cart id": (
+        lambda s: CartRepository(s).get_or_create_cart_id(1234),
+        {"carts_user_id_key"},
+    ),
+    "bulk cart update": (
+        lambda s: CartRepository(s).set_quantities(1234, [(42, 1), (43, 0), (44, 2)]),
+        {"carts_pkey", "uq_cart_items_cart_id_product_id"},
+    ),
+    "max cart id": (
+        lambda s: CartRepository(s).get_max_cart_id(),
+        {"carts_pkey"},
+    ),
+    "cart repricing": (
+        lambda s: CartRepository(s).reprice_chunk(1000, 2000),
+        {"uq_cart_items_cart_id_product_id"},
+    ),
+    "cart repricing by products": (
+        lambda s: CartRepository(s).reprice_chunk(1000, 2000, [42, 43]),
+        {"uq_cart_items_cart_id_product_id"},
+    ),
+    "cart totals batch": (
+        lambda s: CartRepository(s).lock_carts_batch(1000, 500),
+        {"carts_pkey"},
+    ),
+    "cart totals repair": (
+        lambda s: CartRepository(s).repair_totals(list(range(1000, 1500))),
+        {"carts_pkey", "uq_cart_items_cart_id_product_id"},
+    ),
+    "cart lock": (
+        lambda s: CartRepository(s).lock_cart(1234),
+        {"carts_user_id_key"},
+    ),
+    "cart clear": (
+        lambda s: CartRepository(s).clear_cart(1234),
+        {"uq_cart_items_cart_id_product_id"},
+    ),
+    "cart sync from redis": (
+        lambda s: CartRepository(s).sync_items(1234, [{"id": 10_000_000, "product_id": 42, "quantity": 1, "price": 1}]),
+        {"uq_cart_items_cart_id_product_id"},
+    ),
+    "order from cart": (
+        lambda s: OrderRepository(s).create_order_from_cart(1234, 1234),
+        {"uq_cart_items_cart_id_product_id"},
+    ),
+    "order items from cart": (
+        lambda s: OrderRepository(s).copy_cart_items(1234, 1234),
+        {"uq_cart_items_cart_id_product_id"},
+    ),
+    "stock reservation": (
+        lambda s: OrderRepository(s).reserve_stock(1234),
+        {"ix_order_items_order_id"},
+    ),
+    "user by email": (
+        lambda s: UserRepository(s).get_by_email("user1234@example.com"),
+        {"users_email_key"},
+    ),
+    "user by username": (
+        lambda s: UserRepository(s).get_by_username("user1234"),
+        {"users_username_key"},
+    ),
+    "user by id": (
+        lambda s: UserRepository(s).get_by_id(1234),
+        {"users_pkey"},
+    ),
+}
+
+
+@pytest.mark.asyncio
+async def test_query_plans_use_indexes(seeded):
+    async with seeded.connect() as conn:
+        table_rows = dict(
+            (await conn.execute(text("SELECT relname, reltuples FROM pg_class WHERE relkind = 'r'"))).all()
+        )
+
+    failures = []
+    for name, (call, expected) in QUERIES.items():
+        plans = await explain_calls(seeded, call)
+        nodes = [node for plan in plans for node in plan]
+        used = {node["Index Name"] for node in nodes if "Index Name" in node}
+        # INSERT ... ON CONFLICT проверяет конфликт по индексу, не сканируя его
+        used |= {index for node in nodes for index in node.get("Conflict Arbiter Indexes", [])}
+        if not used & expected:
+            failures.append(f"{name}: expected one of {sorted(expected)}, used {sorted(used)}")
+        for node in nodes:
+            if (
+                node["Node Type"] == "Seq Scan"
+                and table_rows[node["Relation Name"]] > SEQ_SCAN_ROWS_THRESHOLD
+                and node["Relation Name"] not in ALLOWED_SEQ_SCANS.get(name, set())
+            ):
+                failures.append(f"{name}: Seq Scan on {node['Relation Name']}")
+    assert not failures, "\n".join(failures)
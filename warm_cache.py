@@ -0,0 +1,42 @@
+import argparse
+import asyncio
+
+import redis.asyncio as redis
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.redis import RedisBackend
+
+from app.config.settings_config import settings
+from app.services.cache_warmup import warm_up_cache
+from app.utils.two_tier_cache import LocalCache, TwoTierBackend
+
+
+async def main(pages: int, limit: int, concurrency: int):
+    redis_conn = redis.from_url(settings.REDIS_DSN)
+
+    # тот же кэш и префикс, что и в приложении
+    FastAPICache.init(
+        TwoTierBackend(
+            RedisBackend(redis_conn),
+            LocalCache(
+                max_entries=settings.CACHE_L1_MAX_ENTRIES,
+                max_bytes=settings.CACHE_L1_MAX_BYTES,
+                ttl=settings.CACHE_L1_TTL,
+            ),
+        ),
+        prefix="shop-cache",
+    )
+
+    report = await warm_up_cache(pages=pages, limit=limit, concurrency=concurrency)
+    await redis_conn.close()
+
+    print(f"✅ Кэш прогрет за {report.seconds:.2f} с: листингов {report.listings}, ключей {report.keys}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Прогрев кэша листингов товаров")
+    parser.add_argument("--pages", type=int, default=settings.CACHE_WARMUP_PAGES)
+    parser.add_argument("--limit", type=int, default=settings.CACHE_WARMUP_LIMIT)
+    parser.add_argument("--concurrency", type=int, default=settings.CACHE_WARMUP_CONCURRENCY)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.pages, args.limit, args.concurrency))